@@ -0,0 +1,18 @@
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def recompute_activity(rooms, messages):
+    """Recompute the activity columns of the given rooms from their messages.
+
+    Takes querysets rather than models so that migration 0006 can pass
+    historical models. Returns the number of updated rooms.
+    """
+    room_messages = messages.filter(room=OuterRef('pk'))
+    latest = room_messages.order_by('-created_at', '-id')
+    counts = room_messages.order_by().values('room').annotate(total=Count('pk')).values('total')
+    return rooms.update(
+        message_count=Coalesce(Subquery(counts), 0),
+        last_message_at=Subquery(latest.values('created_at')[:1]),
+        last_message_id=Subquery(latest.values('id')[:1]),
+    )
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        """Connect signal handlers."""
+        from . import profiling, signals  # noqa: F401
+        from .partitioning import create_partitions_after_migrate
+        post_migrate.connect(create_partitions_after_migrate, sender=self)
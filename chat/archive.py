@@ -0,0 +1,270 @@
+import gzip
+import json
+import os
+from contextvars import ContextVar
+from datetime import date, timedelta, timezone as dt_timezone
+from pathlib import Path
+from uuid import uuid4
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import room_index
+from .models import ArchiveSegment, Message, Room
+from .storage import release_blob
+
+
+# Messages older than a room's retention horizon are moved out of the message
+# table into one append-only segment file per room and month. A segment is a
+# sequence of blocks, each a separate gzip member holding up to
+# CHAT_ARCHIVE_BLOCK_SIZE messages as JSON lines, so a block can be read by
+# seeking to its offset. The block index is kept on the ArchiveSegment row;
+# bytes past the indexed size are leftovers of an interrupted run and are
+# truncated before the next append.
+#
+# Archived messages keep their image blob references, so their images stay
+# available through the archive-media view. When a user is deleted, the
+# segments holding their messages are rewritten without them.
+_archiving = ContextVar('chat_archiving', default=False)
+
+
+def is_archiving():
+    """Return whether the messages being deleted are moved into the archive."""
+    return _archiving.get()
+
+
+def retention_cutoff(room, now=None):
+    """Return the time before which a room's messages are archived, or None to keep them all."""
+    days = room.retention_days if room.retention_days is not None else settings.CHAT_RETENTION_DAYS
+    if not days:
+        return None
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def segment_path(room_id, month):
+    return f'{room_id}/{month:%Y-%m}.jsonl.gz'
+
+
+def _full_path(segment):
+    return Path(settings.CHAT_ARCHIVE_ROOT) / segment.path
+
+
+def _encode(message):
+    return {
+        'id': message.pk,
+        'sender_id': message.sender_id,
+        'sender': message.sender.username,
+        'content': message.content,
+        'image': message.image.name if message.image else '',
+        'created_at': message.created_at.isoformat(),
+    }
+
+
+def _decode(room_id, data):
+    """Return an unsaved Message standing in for an archived message."""
+    message = Message(
+        id=data['id'],
+        room_id=room_id,
+        sender=User(id=data['sender_id'], username=data['sender']),
+        content=data['content'],
+        image=data['image'] or None,
+        created_at=parse_datetime(data['created_at']),
+    )
+    message.archived = True
+    return message
+
+
+def _position(message):
+    return message.created_at.isoformat(), message.pk
+
+
+def archive_room(room, cutoff, batch_size=1000):
+    """Move the messages of a room created before `cutoff` into its archive segments.
+
+    Messages are archived oldest first in batches; every batch is appended to
+    its segment files before its rows are deleted in one transaction. Returns
+    the number of archived messages.
+    """
+    archived = 0
+    while True:
+        batch = list(
+            Message.objects.filter(room=room, created_at__lt=cutoff)
+            .select_related('sender').order_by('created_at', 'id')[:batch_size]
+        )
+        if not batch:
+            return archived
+
+        months = {}
+        for message in batch:
+            created_at = message.created_at.astimezone(dt_timezone.utc)
+            months.setdefault(date(created_at.year, created_at.month, 1), []).append(message)
+
+        with transaction.atomic():
+            for month, messages in months.items():
+                segment, _ = ArchiveSegment.objects.select_for_update().get_or_create(
+                    room=room, month=month, defaults={'path': segment_path(room.pk, month)},
+                )
+                _append(segment, messages)
+            # The post_delete handlers leave image references and room activity to the archive
+            token = _archiving.set(True)
+            try:
+                Message.objects.filter(pk__in=[message.pk for message in batch]).delete()
+            finally:
+                _archiving.reset(token)
+            Room.remove_messages(room.pk, [message.pk for message in batch])
+            Room.objects.filter(pk=room.pk).update(archived_through=batch[-1].created_at)
+            room_index.rooms_changed(room.pk)
+        room.archived_through = batch[-1].created_at
+        archived += len(batch)
+
+
+def _append(segment, messages):
+    """Write messages as new blocks at the end of a segment file and update its index."""
+    path = _full_path(segment)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    block_size = settings.CHAT_ARCHIVE_BLOCK_SIZE
+    with open(path, 'ab') as f:
+        f.truncate(segment.size)
+        offset = segment.size
+        for i in range(0, len(messages), block_size):
+            block = messages[i:i + block_size]
+            lines = ''.join(json.dumps(_encode(message)) + '\n' for message in block)
+            data = gzip.compress(lines.encode(), compresslevel=6)
+            f.write(data)
+            segment.blocks.append({
+                'offset': offset,
+                'length': len(data),
+                'count': len(block),
+                'first': _position(block[0]),
+                'last': _position(block[-1]),
+                'ids': [min(message.pk for message in block), max(message.pk for message in block)],
+                'senders': sorted({message.sender_id for message in block}),
+            })
+            offset += len(data)
+        f.flush()
+        os.fsync(f.fileno())
+    segment.size = offset
+    segment.message_count += len(messages)
+    segment.save(update_fields=['size', 'message_count', 'blocks', 'updated_at'])
+
+
+def _read_block(f, room_id, block):
+    f.seek(block['offset'])
+    lines = gzip.decompress(f.read(block['length'])).decode().splitlines()
+    return [_decode(room_id, json.loads(line)) for line in lines]
+
+
+def _is_before(key, position):
+    created_at, message_id = position
+    return key[0] < created_at or (message_id is not None and key[0] == created_at and key[1] < message_id)
+
+
+def _is_after(key, position):
+    created_at, message_id = position
+    return key[0] > created_at or (message_id is not None and key[0] == created_at and key[1] > message_id)
+
+
+def _key(position):
+    return parse_datetime(position[0]), position[1]
+
+
+def _blocks(room):
+    """Yield (segment, block) pairs of a room in chronological order."""
+    for segment in room.archive_segments.order_by('month'):
+        for block in sorted(segment.blocks, key=lambda block: _key(block['first'])):
+            yield segment, block
+
+
+def read_before(room, position, limit):
+    """Return up to `limit` archived messages preceding `position`, newest first.
+
+    Without a position the newest archived messages are returned.
+    """
+    found = []
+    for segment, block in reversed(list(_blocks(room))):
+        if position is not None and not _is_before(_key(block['first']), position):
+            continue
+        with open(_full_path(segment), 'rb') as f:
+            messages = _read_block(f, room.pk, block)
+        found.extend(
+            message for message in reversed(messages)
+            if position is None or _is_before((message.created_at, message.pk), position)
+        )
+        if len(found) >= limit:
+            break
+    return found[:limit]
+
+
+def read_after(room, position, limit):
+    """Return up to `limit` archived messages following `position`, oldest first."""
+    found = []
+    for segment, block in _blocks(room):
+        if not _is_after(_key(block['last']), position):
+            continue
+        with open(_full_path(segment), 'rb') as f:
+            messages = _read_block(f, room.pk, block)
+        found.extend(message for message in messages if _is_after((message.created_at, message.pk), position))
+        if len(found) >= limit:
+            break
+    return found[:limit]
+
+
+def find_message(room, message_id):
+    """Return an archived message of a room by id, or None."""
+    for segment, block in _blocks(room):
+        if not block['ids'][0] <= message_id <= block['ids'][1]:
+            continue
+        with open(_full_path(segment), 'rb') as f:
+            for message in _read_block(f, room.pk, block):
+                if message.pk == message_id:
+                    return message
+    return None
+
+
+def iter_segment(segment):
+    """Yield every message stored in a segment."""
+    path = _full_path(segment)
+    if not path.exists():
+        return
+    with open(path, 'rb') as f:
+        for block in segment.blocks:
+            yield from _read_block(f, segment.room_id, block)
+
+
+def remove_sender(user):
+    """Remove the archived messages of a user from the segments of rooms they do not own.
+
+    Segments are rewritten to new files, and the old files are removed once
+    the transaction commits. Segments of the user's own rooms are deleted
+    with the rooms.
+    """
+    for segment in ArchiveSegment.objects.exclude(room__owner=user).order_by('pk'):
+        # Blocks written before senders were indexed have to be read
+        if not any(user.pk in block.get('senders', [user.pk]) for block in segment.blocks):
+            continue
+        with transaction.atomic():
+            segment = ArchiveSegment.objects.select_for_update().get(pk=segment.pk)
+            messages = list(iter_segment(segment))
+            kept = [message for message in messages if message.sender_id != user.pk]
+            if len(kept) == len(messages):
+                continue
+            if not kept:
+                # Deleting the segment releases the images of its messages
+                segment.delete()
+                continue
+            for message in messages:
+                if message.sender_id == user.pk and message.image:
+                    release_blob(message.image.name)
+            old_path = _full_path(segment)
+            segment.path = f'{segment.room_id}/{segment.month:%Y-%m}-{uuid4().hex[:8]}.jsonl.gz'
+            segment.size, segment.message_count, segment.blocks = 0, 0, []
+            segment.save(update_fields=['path'])
+            _append(segment, kept)
+            transaction.on_commit(lambda path=old_path: path.unlink(missing_ok=True))
+
+
+def delete_segment_file(segment):
+    """Remove the file of a deleted segment."""
+    _full_path(segment).unlink(missing_ok=True)
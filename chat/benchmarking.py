@@ -0,0 +1,13 @@
+def percentile(values, fraction):
+    """Return the value below which `fraction` of the sorted values fall."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(values, points=(('p50', 0.5), ('p90', 0.9), ('p99', 0.99))):
+    """Return percentiles and the maximum of durations in seconds, in milliseconds."""
+    values = sorted(values)
+    summary = {name: percentile(values, fraction) for name, fraction in points}
+    summary['max'] = values[-1] if values else None
+    return {name: None if value is None else round(value * 1000, 2) for name, value in summary.items()}
@@ -1,96 +1,296 @@
-import json
-import base64
+import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.utils import timezone
-from django.core.files.base import ContentFile
-from channels.db import database_sync_to_async
-from django.urls import reverse
+from channels.db import aclose_old_connections
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError
 
-from .models import Room, Message
+from . import metrics, profiling, routers
+from .imaging import ImagePipelineBusy, ImageRejected, asave_with_image, decode_data_url
+from .membership import is_member
+from .models import Message
+from .persistence import WriteBufferFull, message_buffer
+from .presence import presence
+from .protocol import MSGPACK, decode, encode_for, encode_message, negotiate, select_frame
+from .ratelimit import rate_limiter
+from .uploads import ImageUpload, UploadError
+
+
+logger = logging.getLogger(__name__)
+# WebSocket close code for policy violations
+CLOSE_POLICY_VIOLATION = 1008
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
     """Handles real-time chat via WebSocket."""
 
     async def connect(self):
-        """Join the chat room group."""
+        """Join the chat room group if the user is a member of the room."""
+        with profiling.profiled('websocket.connect'):
+            await self._connect()
+
+    async def _connect(self):
+        """Accept the connection of a room member and register it."""
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'chat_{self.room_id}'
 
+        # The async ORM does not recycle connections like database_sync_to_async,
+        # so every frame that queries does it first
+        await aclose_old_connections()
+        if not await is_member(self.room_id, self.scope["user"]):
+            metrics.connections.inc(outcome='rejected')
+            await self.close()
+            return
+
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
+        # Clients that offer no known subprotocol keep the legacy JSON frames
+        self.subprotocol = negotiate(self.scope.get('subprotocols', []))
+        await self.accept(subprotocol=self.subprotocol)
+        self.limits = rate_limiter.open(self.scope["user"].pk)
+        metrics.connections.inc(outcome='accepted')
+        metrics.open_sockets.inc()
+        presence.join(self.room_id, self.room_group_name, self.channel_name, self.scope["user"])
 
     async def disconnect(self, close_code):
         """Leave the chat room group."""
+        self._abort_upload()
+        presence.leave(self.room_id, self.channel_name)
+        if getattr(self, 'limits', None) is not None:
+            rate_limiter.close(self.scope["user"].pk)
+            self.limits = None
+            metrics.open_sockets.dec()
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """Handle incoming messages and broadcast them."""
-        data = json.loads(text_data)
+        with profiling.profiled('websocket.receive'):
+            await self._receive(text_data, bytes_data)
+
+    async def _receive(self, text_data, bytes_data):
+        """Dispatch a frame to uploads, presence or message handling."""
+        # Binary frames carry upload chunks, except for MessagePack clients
+        # which also use them for messages while no upload is in progress
+        is_chunk = bytes_data is not None and (self.subprotocol != MSGPACK or getattr(self, 'upload', None))
+        size = len(bytes_data) if bytes_data is not None else len(text_data.encode())
+        metrics.frames_received.inc(kind='chunk' if is_chunk else 'binary' if bytes_data is not None else 'text')
+        # Upload chunks only count against the byte budgets
+        exceeded = self.limits.check(size, message=not is_chunk)
+        if exceeded is not None:
+            await self._reject_over_limit(*exceeded, is_chunk)
+            return
+
+        if is_chunk:
+            await self._receive_upload_chunk(bytes_data)
+            return
+
+        data = decode(self.subprotocol, text_data, bytes_data)
+        if data.get('type') == 'upload':
+            await self._start_upload(data)
+            return
+        if data.get('type') in ('presence', 'heartbeat', 'typing'):
+            await self._receive_presence(data)
+            return
+
         message_text = data.get('message', '')
         image_data = data.get('image')
         user = self.scope["user"]
 
-        if user.is_anonymous or (not message_text and not image_data):
+        if not message_text and not image_data:
+            return
+        await aclose_old_connections()
+        if not await is_member(self.room_id, user):
+            await self.close()
             return
+        presence.set_typing(self.room_id, user, False)
 
-        room = await self._get_room(self.room_id)
-        if not room:
+        if settings.CHAT_WRITE_BEHIND and not image_data:
+            await self._buffer_and_broadcast(user, message_text)
             return
 
-        image_file = None
         if image_data:
-            try:
-                header, encoded = image_data.split(';base64,')
-                ext = header.split('/')[-1]
-                file_name = f'chat_{self.room_id}_{timezone.now().timestamp()}.{ext}'
-                image_file = ContentFile(base64.b64decode(encoded), name=file_name)
-            except Exception as e:
-                print("Error decoding image:", e)
-
-        new_msg = await database_sync_to_async(Message.objects.create)(
-            room=room,
-            sender=user,
-            content=message_text,
-            image=image_file,
-            created_at=timezone.now()
-        )
+            await self._save_image_and_broadcast(user, message_text, image_data, decode_data_url)
+            return
+
+        await self._save_and_broadcast(user, message_text)
+
+    async def _reject_over_limit(self, scope, budget, retry_after, is_chunk):
+        """Drop a frame that exceeds a rate limit, disconnecting clients that keep exceeding them."""
+        rate_limiter.record_hit(scope, budget)
+        if is_chunk:
+            self._abort_upload()
+
+        if self.limits.is_abusive():
+            rate_limiter.record_disconnect()
+            logger.warning("Closing chat connection of user %s in room %s for exceeding rate limits",
+                           self.scope["user"].pk, self.room_id)
+            await self.close(code=CLOSE_POLICY_VIOLATION)
+            return
+
+        await self._send_error('rate_limited', f"Too many {budget} sent on this {scope}, slow down.", retry_after)
 
-        response = {
+    async def _receive_presence(self, data):
+        """Handle heartbeats, typing notifications and presence snapshot requests."""
+        user = self.scope["user"]
+        if data['type'] == 'typing':
+            presence.set_typing(self.room_id, user, bool(data.get('typing', True)))
+            return
+
+        presence.heartbeat(self.room_id, self.room_group_name, self.channel_name, user)
+        if data['type'] == 'presence':
+            await self.send(**encode_for(self.subprotocol, {
+                'type': 'presence',
+                **presence.snapshot(self.room_id),
+            }))
+
+    async def _start_upload(self, header):
+        """Begin a binary image upload announced by a JSON header frame."""
+        self._abort_upload()
+        try:
+            self.upload = ImageUpload(
+                self.room_id,
+                header.get('message', ''),
+                header.get('content_type'),
+                header.get('size'),
+            )
+        except UploadError as e:
+            await self._send_error('upload_rejected', str(e))
+
+    async def _receive_upload_chunk(self, chunk):
+        """Stream a binary frame into the pending upload and finish it when complete."""
+        upload = getattr(self, 'upload', None)
+        if upload is None:
+            await self._send_error('upload_rejected', "No upload in progress.")
+            return
+
+        try:
+            await sync_to_async(upload.write, thread_sensitive=False)(chunk)
+        except UploadError as e:
+            self._abort_upload()
+            await self._send_error('upload_rejected', str(e))
+            return
+
+        if not upload.complete:
+            return
+
+        self.upload = None
+        user = self.scope["user"]
+        try:
+            await aclose_old_connections()
+            if not await is_member(self.room_id, user):
+                await self.close()
+                return
+            await self._save_image_and_broadcast(user, upload.message, upload.file)
+        finally:
+            upload.close()
+
+    def _abort_upload(self):
+        """Discard any partially received upload."""
+        upload = getattr(self, 'upload', None)
+        if upload is not None:
+            upload.close()
+            self.upload = None
+
+    async def _save_image_and_broadcast(self, user, message_text, source, decode=None):
+        """Store an image and the message using it, then broadcast it.
+
+        Failures are reported to the client only.
+        """
+        new_msg = Message(room_id=self.room_id, sender=user, content=message_text, created_at=timezone.now())
+        await self._flush_buffered()
+        try:
+            await asave_with_image(new_msg, source, decode)
+        except ImageRejected as e:
+            await self._send_error('image_rejected', str(e))
+            return
+        except ImagePipelineBusy as e:
+            await self._send_error('server_busy', str(e))
+            return
+        except DatabaseError:
+            logger.exception("Could not save image message of user %s in room %s", user.pk, self.room_id)
+            await self._send_error('server_error', "Message could not be saved.")
+            return
+        metrics.messages.inc(storage='direct')
+        await routers.apin_primary(user.pk)
+        await self._broadcast(new_msg.to_payload())
+
+    async def _send_error(self, code, message, retry_after=None):
+        """Send a structured error frame to this client only."""
+        frame = {
+            'type': 'error',
+            'code': code,
+            'message': message,
+        }
+        if retry_after is not None:
+            frame['retry_after'] = round(min(retry_after, settings.CHAT_RATE_VIOLATION_WINDOW), 3)
+        await self.send(**encode_for(self.subprotocol, frame))
+
+    async def _flush_buffered(self):
+        """Write the room's buffered messages, so they get lower ids than a message inserted directly."""
+        if message_buffer.has_pending(self.room_id):
+            await message_buffer.flush()
+
+    async def _save_and_broadcast(self, user, message_text):
+        """Persist a text message and broadcast it to the room group."""
+        await self._flush_buffered()
+        with metrics.message_db_seconds.time(storage='direct'):
+            new_msg = await Message.objects.acreate(
+                room_id=self.room_id,
+                sender=user,
+                content=message_text,
+                created_at=timezone.now()
+            )
+        metrics.messages.inc(storage='direct')
+        await routers.apin_primary(user.pk)
+        await self._broadcast(new_msg.to_payload())
+
+    async def _buffer_and_broadcast(self, user, message_text):
+        """Broadcast a text message immediately and queue it for a batched insert."""
+        try:
+            provisional_id, created_at = message_buffer.add(self.room_id, user.pk, message_text)
+        except WriteBufferFull as e:
+            await self._send_error('server_busy', str(e))
+            return
+        metrics.messages.inc(storage='write_behind')
+        await routers.apin_primary(user.pk)
+        await self._broadcast({
+            'id': provisional_id,
             'sender': user.username,
             'message': message_text,
-            'timestamp': new_msg.created_at.isoformat(),
+            'timestamp': created_at.isoformat(),
+        })
+
+    async def _broadcast(self, response):
+        """Send a message payload to every member of the room group.
+
+        The frame is encoded here once per subprotocol and passed through
+        unchanged by chat_message, instead of being encoded again for every
+        recipient.
+        """
+        event = {
+            'type': 'chat_message',
+            **encode_message({
+                'id': response.get('id'),
+                'sender': response['sender'],
+                'message': response['message'],
+                'timestamp': response['timestamp'],
+                'image_url': response.get('image_url'),
+            }),
         }
-        if new_msg.image:
-            response['image_url'] = reverse('protected-media', kwargs={'message_id': new_msg.id})
+        with metrics.group_send_seconds.time():
+            await self.channel_layer.group_send(self.room_group_name, event)
 
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                **response,
-            }
-        )
+    async def presence_update(self, event):
+        """Send a coalesced presence change of the room to WebSocket."""
+        await self.send(**select_frame(self.subprotocol, event))
 
     async def chat_message(self, event):
         """Send message to WebSocket."""
-        await self.send(text_data=json.dumps({
-            'sender': event['sender'],
-            'message': event['message'],
-            'timestamp': event['timestamp'],
-            'image_url': event.get('image_url')
-        }))
-
-    @database_sync_to_async
-    def _get_room(self, room_id):
-        """Fetch room from DB."""
-        try:
-            return Room.objects.get(pk=room_id)
-        except Room.DoesNotExist:
-            return None
+        await self.send(**select_frame(self.subprotocol, event))
+        metrics.frames_sent.inc()
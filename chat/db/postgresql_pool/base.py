@@ -0,0 +1,73 @@
+import os
+import threading
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+
+from .pool import ConnectionPool
+
+
+# Pool settings read from OPTIONS, e.g. postgres-pool://...?pool_max_size=20&pool_timeout=5
+POOL_OPTIONS = {
+    'pool_max_size': ('max_size', int),
+    'pool_timeout': ('timeout', float),
+    'pool_max_idle': ('max_idle', float),
+    'pool_max_lifetime': ('max_lifetime', float),
+    'pool_check_interval': ('check_interval', float),
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL backend taking its psycopg2 connections from a bounded pool per process and alias.
+
+    With CONN_MAX_AGE = 0, Django closes connections at the end of every
+    request and around every database_sync_to_async call; closing returns the
+    connection to the pool instead. The async ORM does not close connections,
+    so ChatConsumer keeps its database thread's connection until the next
+    frame that queries calls aclose_old_connections().
+    """
+
+    _connection_pools = {}
+    _connection_pools_lock = threading.Lock()
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        for key in POOL_OPTIONS:
+            conn_params.pop(key, None)
+        return conn_params
+
+    def get_connection_pool(self, conn_params):
+        """Return the pool of this alias, replacing it when it cannot serve these parameters."""
+        if self.settings_dict['CONN_MAX_AGE'] != 0:
+            raise ImproperlyConfigured("Pooled connections do not support persistent connections (CONN_MAX_AGE).")
+        with self._connection_pools_lock:
+            params, pool = self._connection_pools.get(self.alias, (None, None))
+            # Pools are replaced when closed, when the parameters changed (as for
+            # test databases) and in forked processes, which must not share sockets
+            if pool is None or pool.closed or params != conn_params or pool.pid != os.getpid():
+                if pool is not None and pool.pid == os.getpid():
+                    pool.close()
+                options = self.settings_dict['OPTIONS']
+                pool = ConnectionPool(self.alias, **{
+                    name: cast(options[key]) for key, (name, cast) in POOL_OPTIONS.items() if key in options
+                })
+                self._connection_pools[self.alias] = conn_params, pool
+            return pool
+
+    def close_pool(self):
+        with self._connection_pools_lock:
+            _, pool = self._connection_pools.pop(self.alias, (None, None))
+        if pool is not None:
+            pool.close()
+
+    def get_new_connection(self, conn_params):
+        if self.alias == NO_DB_ALIAS:
+            return super().get_new_connection(conn_params)
+        self._pool = self.get_connection_pool(conn_params)
+        return self._pool.getconn(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+
+    def _close(self):
+        if self.connection is None or self.alias == NO_DB_ALIAS:
+            return super()._close()
+        with self.wrap_database_errors:
+            self._pool.putconn(self.connection)
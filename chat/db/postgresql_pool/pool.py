@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+
+from chat import metrics
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """Raised when no pooled connection becomes available in time."""
+
+
+class ConnectionPool:
+    """Bounded pool of open psycopg2 connections shared by the threads of one process.
+
+    Connections are opened on demand up to `max_size`; when all of them are in
+    use, callers wait up to `timeout` seconds for one to be returned. Idle
+    connections are reused newest first, so surplus ones stay idle until they
+    exceed `max_idle` and are closed. Connections older than `max_lifetime`
+    are replaced, and ones idle for more than `check_interval` are checked
+    with a round trip before being handed out.
+    """
+
+    def __init__(self, alias, max_size=10, timeout=30, max_idle=600, max_lifetime=3600, check_interval=10):
+        """Create an empty pool."""
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        self.pid = os.getpid()
+        self._idle = []
+        self._opened_at = {}
+        self._opening = 0
+        self._waiting = 0
+        self.closed = False
+        self._condition = threading.Condition()
+        metrics.db_pool_max_connections.set(max_size, alias=alias)
+        self._report()
+
+    def getconn(self, connect):
+        """Return a healthy connection, opening it with `connect` if none is idle."""
+        start = time.monotonic()
+        with self._condition:
+            self._waiting += 1
+            try:
+                while not self._idle and self.size >= self.max_size:
+                    remaining = start + self.timeout - time.monotonic()
+                    if remaining <= 0:
+                        metrics.db_pool_timeouts.inc(alias=self.alias)
+                        raise PoolTimeout(
+                            f"No connection of the {self.alias} pool became available within {self.timeout} s."
+                        )
+                    self._report()
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting -= 1
+            if self._idle:
+                connection, returned_at = self._idle.pop()
+            else:
+                connection = None
+                self._opening += 1
+        metrics.db_pool_wait_seconds.observe(time.monotonic() - start, alias=self.alias)
+
+        if connection is not None and not self._is_healthy(connection, returned_at):
+            connection = None
+        if connection is None:
+            connection = self._open(connect)
+        self._report()
+        return connection
+
+    def _open(self, connect):
+        try:
+            connection = connect()
+        except BaseException:
+            with self._condition:
+                self._opening -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._opening -= 1
+            self._opened_at[connection] = time.monotonic()
+        return connection
+
+    def _is_healthy(self, connection, returned_at):
+        """Return whether an idle connection can be reused, or discard it and keep its slot to open a new one."""
+        now = time.monotonic()
+        if now - self._opened_at[connection] > self.max_lifetime:
+            self._discard(connection, 'lifetime', reopen=True)
+            return False
+        if now - returned_at > self.max_idle:
+            self._discard(connection, 'idle', reopen=True)
+            return False
+        if now - returned_at > self.check_interval:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            except psycopg2.Error:
+                self._discard(connection, 'broken', reopen=True)
+                return False
+        return True
+
+    def putconn(self, connection):
+        """Take back a connection, rolling back an unfinished transaction."""
+        if connection not in self._opened_at:
+            connection.close()
+            return
+        if self.closed:
+            self._discard(connection, 'closed')
+            return
+        if connection.closed:
+            self._discard(connection, 'broken')
+            return
+        if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                self._discard(connection, 'broken')
+                return
+        if time.monotonic() - self._opened_at[connection] > self.max_lifetime:
+            self._discard(connection, 'lifetime')
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+        self._report()
+
+    def _discard(self, connection, reason, reopen=False):
+        """Close a connection and free its slot, or keep the slot for the connection replacing it."""
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self._condition:
+            self._opened_at.pop(connection, None)
+            if reopen:
+                self._opening += 1
+            else:
+                self._condition.notify()
+        metrics.db_pool_discarded.inc(alias=self.alias, reason=reason)
+        self._report()
+
+    def close(self):
+        """Close the idle connections; connections in use are closed when returned."""
+        with self._condition:
+            self.closed = True
+            idle, self._idle = self._idle, []
+            for connection, _ in idle:
+                self._opened_at.pop(connection, None)
+        for connection, _ in idle:
+            connection.close()
+        self._report()
+
+    @property
+    def size(self):
+        return len(self._opened_at) + self._opening
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def _report(self):
+        metrics.db_pool_connections.set(self.idle, alias=self.alias, state='idle')
+        metrics.db_pool_connections.set(self.size - self.idle, alias=self.alias, state='in_use')
+        metrics.db_pool_waiting.set(self._waiting, alias=self.alias)
@@ -0,0 +1,48 @@
+import json
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj).decode()
+
+
+JSON_BACKENDS = {
+    'json': (_json_dumps, json.loads),
+}
+if orjson is not None:
+    JSON_BACKENDS['orjson'] = (_orjson_dumps, orjson.loads)
+
+
+def get_json_backend():
+    """Return the (dumps, loads) pair selected by CHAT_JSON_BACKEND.
+
+    'auto' picks orjson when it is installed and falls back to the standard
+    library json module otherwise.
+    """
+    name = settings.CHAT_JSON_BACKEND
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in JSON_BACKENDS else 'json'
+    try:
+        return JSON_BACKENDS[name]
+    except KeyError:
+        raise ImproperlyConfigured(f"CHAT_JSON_BACKEND '{name}' is not available.")
+
+
+def dumps(obj):
+    """Encode an object as a compact JSON string."""
+    return get_json_backend()[0](obj)
+
+
+def loads(data):
+    """Decode a JSON string or bytes."""
+    return get_json_backend()[1](data)
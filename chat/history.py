@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+
+from . import archive, partitioning
+from .models import Message
+
+
+def parse_cursor(room, value):
+    """Turn a cursor value into a (created_at, id) position within a room.
+
+    The value may be a message id or an ISO 8601 timestamp. For timestamps the
+    id part is None. Raises ValueError for cursors that cannot be resolved.
+    """
+    if value.isdigit():
+        position = room.messages.filter(pk=int(value)).values_list('created_at', 'id').first()
+        if position is None and room.archived_through is not None:
+            message = archive.find_message(room, int(value))
+            if message is not None:
+                position = message.created_at, message.pk
+        if position is None:
+            raise ValueError("Unknown message id.")
+        return position
+
+    created_at = parse_datetime(value)
+    if created_at is None:
+        raise ValueError("Cursor must be a message id or an ISO 8601 timestamp.")
+    if timezone.is_naive(created_at):
+        created_at = timezone.make_aware(created_at)
+    return created_at, None
+
+
+def get_page(room, before=None, after=None, limit=20):
+    """Return a page of room messages in chronological order using keyset pagination.
+
+    Without cursors the newest messages are returned. `before` and `after` are
+    positions returned by parse_cursor. Returns a tuple of the messages and a
+    flag telling whether more messages exist in the paging direction.
+
+    Archived messages are older than every message in the table, so pages
+    continue into the room's archive once the table has no older messages.
+    """
+    messages = Message.objects.filter(room=room).select_related('sender')
+
+    if after is not None:
+        created_at, message_id = after
+        if message_id is None:
+            messages = messages.filter(created_at__gt=created_at)
+        else:
+            messages = messages.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id))
+        page = []
+        if room.archived_through is not None and not after[0] > room.archived_through:
+            page = archive.read_after(room, after, limit + 1)
+        if len(page) <= limit:
+            page += messages.order_by('created_at', 'id')[:limit + 1 - len(page)]
+        return page[:limit], len(page) > limit
+
+    if before is not None:
+        created_at, message_id = before
+        if message_id is None:
+            messages = messages.filter(created_at__lt=created_at)
+        else:
+            messages = messages.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id))
+    page = _newest_first(room, messages, before, limit + 1)
+    if len(page) <= limit and room.archived_through is not None:
+        position = (page[-1].created_at, page[-1].pk) if page else before
+        page += archive.read_before(room, position, limit + 1 - len(page))
+    return list(reversed(page[:limit])), len(page) > limit
+
+
+def _newest_first(room, messages, before, count):
+    """Return up to `count` of the given messages, newest first.
+
+    With message partitioning the query is bounded to the month of the
+    starting position, so it only reads the newest partitions; earlier months
+    are read in widening windows while the page is not full.
+    """
+    if not settings.CHAT_MESSAGE_PARTITIONING:
+        return list(messages.order_by('-created_at', '-id')[:count])
+    start = before[0] if before is not None else room.last_message_at
+    if start is None:
+        return []
+
+    # Older rows were archived or precede the room, so the window reaching
+    # their month is the last one and drops its lower bound
+    oldest = partitioning.month_start(max(filter(None, [room.created_at, room.archived_through])))
+    page = []
+    upper = None
+    lower = partitioning.month_start(start)
+    months = 1
+    while True:
+        window = messages if upper is None else messages.filter(created_at__lt=partitioning.month_bound(upper))
+        last = lower <= oldest
+        if not last:
+            window = window.filter(created_at__gte=partitioning.month_bound(lower))
+        page += window.order_by('-created_at', '-id')[:count - len(page)]
+        if len(page) >= count or last:
+            return page
+        upper, lower = lower, partitioning.add_months(lower, -months)
+        months *= 2
@@ -0,0 +1,233 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import metrics
+from .storage import acquire_blob, acquire_by_source
+
+
+# Accepted Pillow formats mapped to the extension used for stored files
+IMAGE_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'GIF': 'gif',
+    'WEBP': 'webp',
+}
+
+
+class ImageRejected(Exception):
+    """Raised when an uploaded image fails validation."""
+
+
+class ImagePipelineBusy(Exception):
+    """Raised when the image worker pool has no free queue slots."""
+
+
+def decode_data_url(image_data):
+    """Return the raw bytes of a base64 data URL."""
+    try:
+        _, encoded = image_data.split(';base64,')
+        if len(encoded) * 3 // 4 > settings.CHAT_MAX_UPLOAD_SIZE:
+            raise ImageRejected("Image exceeds the maximum upload size.")
+        return base64.b64decode(encoded, validate=True)
+    except (ValueError, binascii.Error):
+        raise ImageRejected("Malformed image data.")
+
+
+def process_image(data):
+    """Validate an image, strip its metadata and re-encode it.
+
+    Returns a tuple of the re-encoded bytes and the file extension.
+    """
+    if len(data) > settings.CHAT_MAX_UPLOAD_SIZE:
+        raise ImageRejected("Image exceeds the maximum upload size.")
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if img.format not in IMAGE_FORMATS:
+                raise ImageRejected("Unsupported image format.")
+            if img.width * img.height > settings.CHAT_MAX_IMAGE_PIXELS:
+                raise ImageRejected("Image dimensions are too large.")
+            img.verify()
+
+        # verify() leaves the image unusable, so it has to be opened again
+        with Image.open(io.BytesIO(data)) as img:
+            image_format = img.format
+            options = {}
+            if getattr(img, 'is_animated', False):
+                options['save_all'] = True
+                image = img
+            else:
+                # Bake the EXIF orientation into the pixels before dropping the metadata
+                image = ImageOps.exif_transpose(img)
+            if image_format == 'JPEG':
+                options['quality'] = settings.CHAT_IMAGE_JPEG_QUALITY
+            if img.info.get('icc_profile'):
+                options['icc_profile'] = img.info['icc_profile']
+
+            output = io.BytesIO()
+            image.save(output, format=image_format, **options)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, ValueError):
+        raise ImageRejected("File is not a valid image.")
+
+    encoded = output.getvalue()
+    if len(encoded) > settings.CHAT_MAX_UPLOAD_SIZE:
+        raise ImageRejected("Image exceeds the maximum upload size.")
+    return encoded, IMAGE_FORMATS[image_format]
+
+
+def store_image(source):
+    """Process an image and store it as a content-addressed blob.
+
+    The source may be raw bytes or a readable file object. Uploads whose bytes
+    match an earlier upload, or whose processed image matches a stored one,
+    only take a new reference to the existing file. Returns the stored file
+    name, suitable for assigning to Message.image; save_with_image ties the
+    reference to the message insert.
+    """
+    data, source_digest = read_image(source)
+    name = acquire_by_source(source_digest)
+    if name is not None:
+        return name
+
+    encoded, ext = process_image(data)
+    return acquire_blob(encoded, ext, source_digest)
+
+
+def read_image(source, decode=None):
+    """Return the bytes of an upload and their digest.
+
+    The source may be raw bytes, a readable file object, or anything `decode`
+    turns into bytes, such as a data URL with decode_data_url.
+    """
+    if decode is not None:
+        data = decode(source)
+    elif isinstance(source, bytes):
+        data = source
+    else:
+        source.seek(0)
+        data = source.read()
+    metrics.image_upload_bytes.observe(len(data))
+    return data, hashlib.sha256(data).hexdigest()
+
+
+def _save_reusing_blob(message, source_digest):
+    """Save a message with the blob of an identical earlier upload, or return False if there is none."""
+    with transaction.atomic():
+        name = acquire_by_source(source_digest)
+        if name is None:
+            return False
+        message.image = name
+        message.save()
+    return True
+
+
+def _save_with_new_blob(message, processed, source_digest):
+    encoded, ext = processed
+    with transaction.atomic():
+        message.image = acquire_blob(encoded, ext, source_digest)
+        message.save()
+
+
+def save_with_image(message, source):
+    """Store an image and save the message using it.
+
+    The blob reference is taken in the transaction of the message insert, so
+    it is rolled back with the message if saving fails. Returns the message.
+    """
+    data, source_digest = read_image(source)
+    if not _save_reusing_blob(message, source_digest):
+        _save_with_new_blob(message, process_image(data), source_digest)
+    return message
+
+
+async def asave_with_image(message, source, decode=None):
+    """Async version of save_with_image, with the source read as by read_image.
+
+    Decoding and processing run on the image worker pool, and the database
+    writes through database_sync_to_async, whose connections Django recycles.
+    """
+    data, source_digest = await image_pipeline.run(read_image, source, decode)
+    if not await database_sync_to_async(_save_reusing_blob)(message, source_digest):
+        processed = await image_pipeline.run(process_image, data)
+        await database_sync_to_async(_save_with_new_blob)(message, processed, source_digest)
+    return message
+
+
+def variant_path(path, variant, image_format):
+    """Return where a variant of an original image is cached on disk."""
+    return path.with_name(f'{path.stem}.{variant}.{IMAGE_FORMATS[image_format]}')
+
+
+def get_variant(path, variant, accept=''):
+    """Return the path of a downscaled variant of an image, generating it if needed.
+
+    The variant is encoded as WebP when the client accepts it, otherwise as
+    JPEG (or PNG for images with transparency). Variants are cached next to
+    the original file.
+    """
+    max_size = settings.CHAT_IMAGE_VARIANTS[variant]
+    webp = 'image/webp' in accept
+
+    with Image.open(path) as img:
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+        image_format = 'WEBP' if webp else ('PNG' if has_alpha else 'JPEG')
+        target = variant_path(path, variant, image_format)
+        if target.exists() and target.stat().st_mtime >= path.stat().st_mtime:
+            return target
+
+        img.thumbnail((max_size, max_size))
+        image = img.convert('RGBA' if has_alpha else 'RGB')
+        options = {'quality': settings.CHAT_IMAGE_VARIANT_QUALITY} if image_format != 'PNG' else {'optimize': True}
+
+        # Write to a temporary name first so concurrent requests never see a partial file
+        temp_path = target.with_name(f'.{target.name}.{os.getpid()}.{threading.get_ident()}')
+        try:
+            image.save(temp_path, format=image_format, **options)
+            os.replace(temp_path, target)
+        finally:
+            temp_path.unlink(missing_ok=True)
+    return target
+
+
+class ImagePipeline:
+    """Runs image processing on a bounded worker pool with a bounded queue."""
+
+    def __init__(self):
+        """Create the pipeline; the worker pool is started on first use."""
+        self._executor = None
+        self._pending = 0
+
+    @property
+    def executor(self):
+        """Return the worker pool, creating it if needed."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=settings.CHAT_IMAGE_WORKERS,
+                thread_name_prefix='chat-image',
+            )
+        return self._executor
+
+    async def run(self, func, *args):
+        """Run func on the worker pool, rejecting the call if the queue is full."""
+        if self._pending >= settings.CHAT_IMAGE_QUEUE_DEPTH:
+            raise ImagePipelineBusy("Too many images are being processed, try again later.")
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            self._pending -= 1
+
+
+image_pipeline = ImagePipeline()
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.archive import archive_room, retention_cutoff
+from chat.models import Room
+
+
+class Command(BaseCommand):
+    help = (
+        "Move messages older than each room's retention horizon (Room.retention_days or "
+        "CHAT_RETENTION_DAYS) into compressed archive segments. Safe to run repeatedly, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', type=int, action='append', help="Only archive this room; may be repeated.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Messages archived per transaction.")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be archived without moving anything.")
+
+    def handle(self, *args, **options):
+        rooms = Room.objects.order_by('pk')
+        if options['room']:
+            rooms = rooms.filter(pk__in=options['room'])
+
+        now = timezone.now()
+        total = 0
+        for room in rooms.iterator():
+            cutoff = retention_cutoff(room, now)
+            if cutoff is None:
+                continue
+            if options['dry_run']:
+                count = room.messages.filter(created_at__lt=cutoff).count()
+            else:
+                count = archive_room(room, cutoff, batch_size=options['batch_size'])
+            if count:
+                self.stdout.write(f"Room {room.pk}: {count} messages before {cutoff:%Y-%m-%d %H:%M}")
+            total += count
+
+        verb = "Would archive" if options['dry_run'] else "Archived"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {total} messages."))
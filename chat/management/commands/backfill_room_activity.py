@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from chat.activity import recompute_activity
+from chat.models import Room, Message
+
+
+class Command(BaseCommand):
+    help = "Recompute last_message_at, last_message_id and message_count of rooms from their messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of rooms updated per statement.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        room_ids = list(Room.objects.order_by('pk').values_list('pk', flat=True))
+        updated = 0
+        for start in range(0, len(room_ids), batch_size):
+            batch = room_ids[start:start + batch_size]
+            updated += recompute_activity(Room.objects.filter(pk__in=batch), Message.objects.all())
+        self.stdout.write(self.style.SUCCESS(f"Updated activity of {updated} rooms."))
@@ -0,0 +1,55 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.encoding import JSON_BACKENDS
+
+
+def encode_per_recipient(dumps, event, recipients):
+    """Rebuild and encode the frame for every recipient, as chat_message used to."""
+    for _ in range(recipients):
+        dumps({
+            'id': event.get('id'),
+            'sender': event['sender'],
+            'message': event['message'],
+            'timestamp': event['timestamp'],
+            'image_url': event.get('image_url'),
+        })
+
+
+def encode_once(dumps, event, recipients):
+    """Encode the frame once; recipients send the same text without further work."""
+    dumps(event)
+
+
+class Command(BaseCommand):
+    help = "Measure the CPU cost of encoding one broadcast chat message for rooms of different sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1, 10, 100, 500, 1000],
+            help="Room sizes (recipients in this process) to measure.",
+        )
+        parser.add_argument('--repeat', type=int, default=200, help="Broadcasts measured per room size.")
+
+    def handle(self, *args, **options):
+        event = {
+            'id': 123456,
+            'sender': 'benchmark',
+            'message': "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 3,
+            'timestamp': timezone.now().isoformat(),
+            'image_url': None,
+        }
+        # The first row is the previous behaviour, the others the current one per JSON backend
+        cases = [('per recipient', 'json.dumps', encode_per_recipient, json.dumps)]
+        cases += [('once', name, encode_once, dumps) for name, (dumps, _) in JSON_BACKENDS.items()]
+
+        self.stdout.write(f"{'recipients':>10}  {'encoded':<15}{'encoder':<12}{'us/broadcast':>14}")
+        for size in options['sizes']:
+            for strategy, name, func, dumps in cases:
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    func(dumps, event, size)
+                elapsed = (time.perf_counter() - start) / options['repeat'] * 1e6
+                self.stdout.write(f"{size:>10}  {strategy:<15}{name:<12}{elapsed:>14.1f}")
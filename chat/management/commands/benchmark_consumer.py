@@ -0,0 +1,92 @@
+import asyncio
+import time
+from uuid import uuid4
+from asgiref.sync import async_to_sync
+from channels.db import aclose_old_connections, database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.membership import load_members, membership_cache
+from chat.models import Room, Message
+from chat.routing import websocket_urlpatterns
+
+
+def sync_load_members(room_id):
+    """Return the member ids of a room with the sync ORM, as the consumer did before."""
+    owner_id = Room.objects.filter(pk=room_id).values_list('owner_id', flat=True).first()
+    guest_ids = Room.guests.through.objects.filter(room_id=room_id).values_list('user_id', flat=True)
+    return frozenset([owner_id, *guest_ids])
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure messages per second stored by one worker while many rooms send concurrently, "
+        "comparing database_sync_to_async with the async ORM path of ChatConsumer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=50, help="Number of rooms sending concurrently.")
+        parser.add_argument('--messages', type=int, default=20, help="Number of messages sent in each room.")
+        parser.add_argument(
+            '--mode', action='append', choices=['sync', 'async', 'consumer'],
+            help="Path to measure: 'sync' (database_sync_to_async), 'async' (async ORM) or "
+                 "'consumer' (full ChatConsumer over WebSockets). Repeat to run several; default sync and async.",
+        )
+
+    def handle(self, *args, **options):
+        modes = options['mode'] or ['sync', 'async']
+        user = User.objects.create_user(username=f'benchmark-{uuid4().hex[:12]}')
+        try:
+            rooms = Room.objects.bulk_create(
+                [Room(owner=user, name=f'Benchmark {i}') for i in range(options['rooms'])]
+            )
+            for mode in modes:
+                elapsed = async_to_sync(self.run_mode)(mode, user, rooms, options['messages'])
+                total = len(rooms) * options['messages']
+                self.stdout.write(
+                    f"{mode:>8}: {total} messages in {elapsed:.2f} s, {total / elapsed:.0f} messages/s"
+                )
+        finally:
+            user.delete()
+
+    async def run_mode(self, mode, user, rooms, count):
+        """Send `count` messages to every room concurrently and return the elapsed seconds."""
+        membership_cache.clear()
+        sender = getattr(self, f'send_{mode}')
+        start = time.perf_counter()
+        await asyncio.gather(*[sender(user, room, count) for room in rooms])
+        return time.perf_counter() - start
+
+    async def send_sync(self, user, room, count):
+        """Check membership and insert each message through database_sync_to_async."""
+        for i in range(count):
+            await database_sync_to_async(sync_load_members)(room.pk)
+            await database_sync_to_async(Message.objects.create)(
+                room_id=room.pk, sender=user, content=f'sync {i}', created_at=timezone.now(),
+            )
+
+    async def send_async(self, user, room, count):
+        """Check membership and insert each message through the async ORM."""
+        for i in range(count):
+            await aclose_old_connections()
+            await load_members(room.pk)
+            await Message.objects.acreate(
+                room_id=room.pk, sender=user, content=f'async {i}', created_at=timezone.now(),
+            )
+
+    async def send_consumer(self, user, room, count):
+        """Send messages through a ChatConsumer and wait for each broadcast."""
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/{room.pk}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        if not connected:
+            raise RuntimeError(f"Consumer rejected the connection to room {room.pk}.")
+        try:
+            for i in range(count):
+                await communicator.send_json_to({'message': f'consumer {i}'})
+                await communicator.receive_from(timeout=30)
+        finally:
+            await communicator.disconnect()
@@ -0,0 +1,173 @@
+import json
+import shutil
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from chat.activity import recompute_activity
+from chat.benchmarking import summarize
+from chat.models import Room, Message
+
+
+class Rollback(Exception):
+    """Raised to roll back a seeded dataset."""
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the room list, room detail and protected media views against seeded datasets of "
+        "increasing size, and fail when a query count or latency budget from CHAT_QUERY_BUDGETS is exceeded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10, 100, 1000],
+            help="Dataset sizes, as the number of rooms visible to the benchmark user.",
+        )
+        parser.add_argument('--messages', type=int, default=50, help="Messages seeded in every room.")
+        parser.add_argument('--repeat', type=int, default=20, help="Requests measured per view and size.")
+        parser.add_argument('--budgets', help="JSON file with budgets overriding CHAT_QUERY_BUDGETS.")
+        parser.add_argument('--output', help="Write the JSON results to this file instead of standard output.")
+        parser.add_argument('--label', default='', help="Free-form label stored in the results, e.g. a commit hash.")
+
+    def handle(self, *args, **options):
+        budgets = settings.CHAT_QUERY_BUDGETS
+        if options['budgets']:
+            with open(options['budgets']) as f:
+                budgets = json.load(f)
+
+        results = []
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root, ALLOWED_HOSTS=['*']):
+                for size in options['sizes']:
+                    results.extend(self.run_size(size, options['messages'], options['repeat']))
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        breaches = self.check_budgets(results, budgets)
+        report = json.dumps({
+            'label': options['label'],
+            'timestamp': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'results': results,
+            'breaches': breaches,
+        }, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(report)
+        else:
+            self.stdout.write(report)
+
+        for breach in breaches:
+            self.stderr.write(
+                f"{breach['view']}{' (cached)' if breach['cached'] else ''} at size {breach['size']}: "
+                f"{breach['metric']} {breach['value']} "
+                f"exceeds budget {breach['budget']}"
+            )
+        if breaches:
+            raise CommandError(f"{len(breaches)} view budget(s) exceeded.")
+
+    def run_size(self, size, messages, repeat):
+        """Seed a dataset of the given size, measure every view and roll the dataset back."""
+        results = []
+        try:
+            with transaction.atomic():
+                user, room, image_message = self.seed(size, messages)
+                client = Client()
+                client.force_login(user)
+                # Views are named by URL name, the room list once with and once without its cache
+                views = [
+                    ('home', reverse('home'), False),
+                    ('home', reverse('home'), True),
+                    ('room', reverse('room', kwargs={'pk': room.pk}), False),
+                    ('protected-media', reverse('protected-media', kwargs={'message_id': image_message.pk}), False),
+                ]
+                for name, url, cached in views:
+                    results.append({
+                        'view': name, 'cached': cached, 'size': size,
+                        **self.measure(client, url, repeat, cold=not cached),
+                    })
+                raise Rollback()
+        except Rollback:
+            pass
+        cache.clear()
+        return results
+
+    def seed(self, size, messages):
+        """Create a user who owns, has joined and can see public rooms, `size` rooms in total."""
+        user = User.objects.create(username='benchmark-views', password=make_password(None))
+        other = User.objects.create(username='benchmark-views-other', password=make_password(None))
+        rooms = Room.objects.bulk_create([
+            Room(owner=user if i % 3 == 0 else other, name=f'Room {i}', is_publicly_visible=i % 3 == 2)
+            for i in range(size)
+        ])
+        Room.guests.through.objects.bulk_create([
+            Room.guests.through(room_id=room.pk, user_id=user.pk) for i, room in enumerate(rooms) if i % 3 == 1
+        ])
+        Room.favorited_by.through.objects.bulk_create([
+            Room.favorited_by.through(room_id=room.pk, user_id=user.pk) for room in rooms[::10]
+        ])
+        Message.objects.bulk_create([
+            Message(room=room, sender=user if i % 2 else other, content=f'Message {i}')
+            for room in rooms for i in range(messages)
+        ])
+        recompute_activity(Room.objects.filter(pk__in=[room.pk for room in rooms]), Message.objects.all())
+
+        buffer = BytesIO()
+        Image.new('RGB', (640, 480), color='blue').save(buffer, format='JPEG')
+        image_path = Path(settings.MEDIA_ROOT) / 'message_images' / 'benchmark.jpg'
+        image_path.parent.mkdir(parents=True, exist_ok=True)
+        image_path.write_bytes(buffer.getvalue())
+        image_message = Message.objects.create(
+            room=rooms[0], sender=user, content='Image', image='message_images/benchmark.jpg',
+        )
+        return user, rooms[0], image_message
+
+    def measure(self, client, url, repeat, cold):
+        """Request a URL `repeat` times and return its latency percentiles and query count."""
+        client.get(url)
+        durations, queries = [], 0
+        for _ in range(repeat):
+            if cold:
+                cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = client.get(url)
+                if getattr(response, 'streaming', False):
+                    b''.join(response.streaming_content)
+                durations.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise CommandError(f"{url} returned status {response.status_code}.")
+            queries = max(queries, len(captured))
+        return {'queries': queries, **summarize(durations, points=(('p50', 0.5), ('p95', 0.95)))}
+
+    def check_budgets(self, results, budgets):
+        """Return the results that exceed their view's query or latency budget."""
+        breaches = []
+        for result in results:
+            budget = budgets.get(result['view'], {})
+            queries_key = 'cached_queries' if result['cached'] and 'cached_queries' in budget else 'queries'
+            for metric, limit_key in (('queries', queries_key), ('p95', 'p95_ms')):
+                limit = budget.get(limit_key)
+                if limit is not None and result[metric] > limit:
+                    breaches.append({
+                        'view': result['view'],
+                        'cached': result['cached'],
+                        'size': result['size'],
+                        'metric': limit_key,
+                        'value': result[metric],
+                        'budget': limit,
+                    })
+        return breaches
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from chat.partitioning import ensure_partitions, is_enabled, partition_messages
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the monthly message partitions of the coming months (CHAT_MESSAGE_PARTITIONS_AHEAD). "
+        "Run it regularly, e.g. daily from cron. Only used with CHAT_MESSAGE_PARTITIONING on PostgreSQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, help="Months to create after the current one.")
+        parser.add_argument(
+            '--convert', action='store_true',
+            help="First convert an unpartitioned message table, e.g. after enabling partitioning on a migrated database.",
+        )
+
+    def handle(self, *args, **options):
+        if not is_enabled(connection):
+            raise CommandError("Message partitioning requires CHAT_MESSAGE_PARTITIONING on PostgreSQL.")
+        if options['convert']:
+            with connection.schema_editor() as schema_editor:
+                partition_messages(schema_editor)
+        created = ensure_partitions(connection, ahead=options['months_ahead'])
+        for name in created:
+            self.stdout.write(f"Created {name}")
+        self.stdout.write(self.style.SUCCESS(f"Created {len(created)} partitions."))
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from importlib import import_module
+from uuid import uuid4
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from chat.benchmarking import summarize
+from chat.models import Room, Message
+from chat.persistence import message_buffer
+
+
+class CommunicatorClient:
+    """Simulated client talking to the ASGI application in this process."""
+
+    def __init__(self, application, room, user):
+        self.communicator = WebsocketCommunicator(application, f'/ws/{room.pk}/')
+        self.communicator.scope['user'] = user
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=30)
+        return connected
+
+    async def send(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def receive(self):
+        while True:
+            output = await self.communicator.receive_output(timeout=3600)
+            if output['type'] == 'websocket.close':
+                raise ConnectionError("Connection closed by the server.")
+            if output.get('text') is not None:
+                return output['text']
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class SocketClient:
+    """Simulated client talking to a running server over a real WebSocket."""
+
+    def __init__(self, url, room, session_key):
+        self.url = f"{url.rstrip('/')}/ws/{room.pk}/"
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={session_key}'
+        self.socket = None
+
+    async def connect(self):
+        import websockets
+
+        try:
+            self.socket = await websockets.connect(self.url, additional_headers={'Cookie': self.cookie})
+        except (OSError, websockets.exceptions.InvalidHandshake):
+            return False
+        return True
+
+    async def send(self, text):
+        await self.socket.send(text)
+
+    async def receive(self):
+        while True:
+            frame = await self.socket.recv()
+            if isinstance(frame, str):
+                return frame
+
+    async def close(self):
+        if self.socket is not None:
+            await self.socket.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Open simulated WebSocket clients across chat rooms, send messages at a fixed rate and report "
+        "connect time, delivery latency, throughput and database write rate."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100, help="Number of simulated clients.")
+        parser.add_argument('--rooms', type=int, default=10, help="Number of rooms the clients are spread across.")
+        parser.add_argument('--rate', type=float, default=1.0, help="Messages sent per second by each client.")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds during which clients send messages.")
+        parser.add_argument('--drain', type=float, default=2.0, help="Seconds to wait for in-flight messages afterwards.")
+        parser.add_argument(
+            '--url', help="Target a running server (e.g. ws://127.0.0.1:8000) instead of the in-process "
+                          "ASGI application. Requires the 'websockets' package.",
+        )
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['rooms'] < 1 or options['rate'] <= 0:
+            raise CommandError("--clients, --rooms and --rate must be positive.")
+        if options['url']:
+            try:
+                import websockets  # noqa: F401
+            except ImportError:
+                raise CommandError("--url requires the 'websockets' package.")
+
+        prefix = f'loadtest-{uuid4().hex[:8]}'
+        self.sessions = []
+        owner = User.objects.create(username=prefix, password=make_password(None))
+        try:
+            rooms = Room.objects.bulk_create(
+                [Room(owner=owner, name=f'Load test {i}') for i in range(options['rooms'])]
+            )
+            User.objects.bulk_create([
+                User(username=f'{prefix}-{i}', password=make_password(None)) for i in range(options['clients'])
+            ])
+            users = list(User.objects.filter(username__startswith=f'{prefix}-').order_by('pk'))
+            Room.guests.through.objects.bulk_create([
+                Room.guests.through(room_id=rooms[i % len(rooms)].pk, user_id=user.pk)
+                for i, user in enumerate(users)
+            ])
+            application = None if options['url'] else import_string(settings.ASGI_APPLICATION)
+            clients = [
+                self.make_client(application, options['url'], rooms[i % len(rooms)], user)
+                for i, user in enumerate(users)
+            ]
+            report = async_to_sync(self.run)(clients, rooms, options)
+        finally:
+            for session in self.sessions:
+                session.delete()
+            owner.delete()
+            User.objects.filter(username__startswith=f'{prefix}-').delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.write_report(report)
+
+    def make_client(self, application, url, room, user):
+        """Return a client of the selected transport for a user in a room."""
+        if url is None:
+            return CommunicatorClient(application, room, user)
+
+        # Log the user in with a session the server can read from the cookie
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        self.sessions.append(session)
+        return SocketClient(url, room, session.session_key)
+
+    async def run(self, clients, rooms, options):
+        """Connect every client, drive the send phase and collect measurements."""
+        stats = {'connect': [], 'latency': [], 'sent': 0, 'delivered': 0, 'errors': Counter(), 'closed': 0}
+
+        async def connect(client):
+            start = time.perf_counter()
+            if await client.connect():
+                stats['connect'].append(time.perf_counter() - start)
+                return client
+            stats['errors']['connect_failed'] += 1
+            return None
+
+        connected = [client for client in await asyncio.gather(*map(connect, clients)) if client]
+        if not connected:
+            raise CommandError("No client could connect.")
+        room_ids = [room.pk for room in rooms]
+        messages_before = await database_sync_to_async(Message.objects.filter(room_id__in=room_ids).count)()
+
+        start = time.perf_counter()
+        send_until = start + options['duration']
+        receivers = [asyncio.ensure_future(self.receive_loop(client, stats)) for client in connected]
+        await asyncio.gather(*[
+            self.send_loop(client, index, options['rate'], send_until, stats) for index, client in enumerate(connected)
+        ])
+        send_elapsed = time.perf_counter() - start
+        await asyncio.sleep(options['drain'])
+        for receiver in receivers:
+            receiver.cancel()
+        await asyncio.gather(*receivers, return_exceptions=True)
+
+        if settings.CHAT_WRITE_BEHIND:
+            await message_buffer.flush()
+        messages_after = await database_sync_to_async(Message.objects.filter(room_id__in=room_ids).count)()
+        await asyncio.gather(*[client.close() for client in connected], return_exceptions=True)
+
+        written = messages_after - messages_before
+        return {
+            'clients': len(clients),
+            'connected': len(connected),
+            'rooms': len(rooms),
+            'duration_s': round(send_elapsed, 3),
+            'connect_ms': summarize(stats['connect']),
+            'latency_ms': summarize(stats['latency']),
+            'sent': stats['sent'],
+            'delivered': stats['delivered'],
+            'sent_per_s': round(stats['sent'] / send_elapsed, 1),
+            'delivered_per_s': round(stats['delivered'] / send_elapsed, 1),
+            'db_writes': written,
+            'db_writes_per_s': round(written / send_elapsed, 1),
+            'errors': dict(stats['errors']),
+            'closed_by_server': stats['closed'],
+        }
+
+    async def send_loop(self, client, index, rate, send_until, stats):
+        """Send timestamped messages at `rate` per second until the send phase ends."""
+        interval = 1 / rate
+        # Spread the first messages so clients do not send in lockstep
+        await asyncio.sleep(random.uniform(0, interval))
+        sequence = 0
+        while time.perf_counter() < send_until:
+            sequence += 1
+            text = json.dumps({'message': f'lt {index} {sequence} {time.perf_counter():.6f}'})
+            try:
+                await client.send(text)
+            except Exception:
+                stats['errors']['send_failed'] += 1
+                return
+            stats['sent'] += 1
+            await asyncio.sleep(interval)
+
+    async def receive_loop(self, client, stats):
+        """Record the delivery latency of every load test message the client receives."""
+        while True:
+            try:
+                frame = json.loads(await client.receive())
+            except ConnectionError:
+                stats['closed'] += 1
+                return
+            if frame.get('type') == 'error':
+                stats['errors'][frame.get('code', 'error')] += 1
+                continue
+            parts = str(frame.get('message', '')).split(' ')
+            if len(parts) == 4 and parts[0] == 'lt':
+                stats['delivered'] += 1
+                stats['latency'].append(time.perf_counter() - float(parts[3]))
+
+    def write_report(self, report):
+        """Print the report as aligned text."""
+        def percentiles(values):
+            return ', '.join(f"{name} {value if value is not None else '-'}" for name, value in values.items())
+
+        self.stdout.write(
+            f"Clients:      {report['connected']}/{report['clients']} connected across {report['rooms']} rooms"
+        )
+        self.stdout.write(f"Connect:      {percentiles(report['connect_ms'])} ms")
+        self.stdout.write(f"Latency:      {percentiles(report['latency_ms'])} ms")
+        self.stdout.write(
+            f"Throughput:   {report['sent_per_s']} sent/s, {report['delivered_per_s']} delivered/s "
+            f"over {report['duration_s']} s"
+        )
+        self.stdout.write(f"DB writes:    {report['db_writes']} rows, {report['db_writes_per_s']} rows/s")
+        if report['errors'] or report['closed_by_server']:
+            self.stdout.write(
+                self.style.WARNING(f"Errors:       {report['errors']}, closed by server: {report['closed_by_server']}")
+            )
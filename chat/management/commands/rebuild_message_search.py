@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import NotSupportedError
+
+from chat.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of message contents from the messages table."
+
+    def handle(self, *args, **options):
+        try:
+            rebuild_search_index()
+        except NotSupportedError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS("Rebuilt the message search index."))
@@ -0,0 +1,245 @@
+import bisect
+import csv
+import math
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+from io import BytesIO, StringIO
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from PIL import Image
+
+from chat import room_index
+from chat.activity import recompute_activity
+from chat.imaging import store_image
+from chat.models import Room, Message, ImageBlob
+from chat.storage import release_blob
+
+
+WORDS = (
+    "hi hello thanks yes no ok maybe later today tomorrow meeting lunch code review deploy build test bug fix "
+    "release branch merge coffee weekend plan idea question answer link photo call ping sorry great nice done "
+    "working on it looks good to me see you soon the a is are we you they this that what when where why how"
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a deterministic synthetic dataset of users, rooms with skewed guest counts, favourites "
+        "and messages spread over time, and report the insert throughput of every step."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help="Number of users to create.")
+        parser.add_argument('--rooms', type=int, default=2000, help="Number of rooms to create.")
+        parser.add_argument('--messages', type=int, default=1000000, help="Number of messages to create.")
+        parser.add_argument('--days', type=float, default=365, help="Period, ending now, the messages are spread over.")
+        parser.add_argument('--image-fraction', type=float, default=0.02, help="Fraction of messages carrying an image.")
+        parser.add_argument('--images', type=int, default=20, help="Number of distinct images shared by image messages.")
+        parser.add_argument('--public-fraction', type=float, default=0.2, help="Fraction of publicly visible rooms.")
+        parser.add_argument('--max-guests', type=int, default=1000, help="Upper bound of a room's guest count.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; equal seeds produce equal datasets.")
+        parser.add_argument('--prefix', default='seed', help="Username prefix of the generated users.")
+        parser.add_argument('--password', help="Give every generated user this password instead of an unusable one.")
+        parser.add_argument('--batch-size', type=int, default=10000, help="Rows inserted per statement or COPY.")
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['rooms'], options['batch_size']) < 1 or options['messages'] < 0:
+            raise CommandError("--users, --rooms and --batch-size must be positive.")
+        if User.objects.filter(username__startswith=f"{options['prefix']}-").exists():
+            raise CommandError(f"Users prefixed '{options['prefix']}-' already exist; choose another --prefix.")
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.end = timezone.now()
+        self.start = self.end - timedelta(days=options['days'])
+
+        self.timed('users', lambda: self.create_users(options))
+        self.timed('rooms', lambda: self.create_rooms(options))
+        self.timed('guests', lambda: self.create_guests(options))
+        self.timed('favourites', self.create_favourites)
+        self.timed('messages', lambda: self.create_messages(options))
+        self.timed('activity', self.update_rooms)
+
+    def timed(self, name, step):
+        """Run a step returning its number of inserted rows, and report its insert throughput."""
+        start = time.perf_counter()
+        rows = step()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{name:<12}{rows:>12} rows {elapsed:>9.2f} s {rows / elapsed if elapsed else 0:>12.0f} rows/s"
+        )
+
+    def batches(self, items):
+        """Split a list into lists of at most batch_size items."""
+        for i in range(0, len(items), self.batch_size):
+            yield items[i:i + self.batch_size]
+
+    def create_users(self, options):
+        """Create the users."""
+        password = make_password(options['password'])
+        prefix = options['prefix']
+        users = [
+            User(username=f'{prefix}-{i}', password=password, date_joined=self.start)
+            for i in range(options['users'])
+        ]
+        for batch in self.batches(users):
+            User.objects.bulk_create(batch)
+        self.user_ids = list(
+            User.objects.filter(username__startswith=f'{prefix}-').order_by('pk').values_list('pk', flat=True)
+        )
+        return len(users)
+
+    def create_rooms(self, options):
+        """Create rooms owned by random users."""
+        rooms = [
+            Room(
+                name=f'Room {i}',
+                owner_id=self.rng.choice(self.user_ids),
+                is_publicly_visible=self.rng.random() < options['public_fraction'],
+                is_owner_only_editable=self.rng.random() < 0.8,
+            )
+            for i in range(options['rooms'])
+        ]
+        self.rooms = []
+        for batch in self.batches(rooms):
+            self.rooms.extend(Room.objects.bulk_create(batch))
+        if any(room.is_publicly_visible for room in self.rooms):
+            with transaction.atomic():
+                room_index.public_rooms_changed()
+        return len(rooms)
+
+    def create_guests(self, options):
+        """Add a Pareto-distributed number of guests to every room."""
+        self.members, rows = {}, []
+        limit = min(options['max_guests'], len(self.user_ids) - 1)
+        for room in self.rooms:
+            # Most rooms are small, a few are very large
+            count = min(limit, int(self.rng.paretovariate(1.1)) - 1)
+            guests = [
+                user_id for user_id in self.rng.sample(self.user_ids, count + 1) if user_id != room.owner_id
+            ][:count]
+            self.members[room.pk] = [room.owner_id, *guests]
+            rows.extend(Room.guests.through(room_id=room.pk, user_id=user_id) for user_id in guests)
+        for batch in self.batches(rows):
+            Room.guests.through.objects.bulk_create(batch)
+        return len(rows)
+
+    def create_favourites(self):
+        """Let every member favourite each of their rooms with a 10% chance."""
+        rows = [
+            Room.favorited_by.through(room_id=room_id, user_id=user_id)
+            for room_id, user_ids in self.members.items() for user_id in user_ids if self.rng.random() < 0.1
+        ]
+        for batch in self.batches(rows):
+            Room.favorited_by.through.objects.bulk_create(batch)
+        return len(rows)
+
+    def create_images(self, count):
+        """Store distinct images as blobs and return their file names."""
+        names = []
+        for _ in range(count):
+            buffer = BytesIO()
+            color = tuple(self.rng.randrange(256) for _ in range(3))
+            Image.new('RGB', (self.rng.randrange(200, 1200), self.rng.randrange(200, 900)), color).save(
+                buffer, format='JPEG'
+            )
+            names.append(store_image(buffer.getvalue()))
+        return names
+
+    def timestamps(self, count):
+        """Yield `count` increasing message times with growing activity and a daily cycle."""
+        span = (self.end - self.start).total_seconds()
+        chunk = self.batch_size
+        for offset in range(0, count, chunk):
+            size = min(chunk, count - offset)
+            # Draw quantiles from this chunk's slice of [0, 1) so the whole sequence is sorted
+            quantiles = sorted((offset + self.rng.random() * size) / count for _ in range(size))
+            for quantile in quantiles:
+                # Message volume grows linearly over the period
+                seconds = span * math.sqrt(quantile)
+                # Squeeze every day's messages towards noon with a monotonic warp
+                day, fraction = divmod(seconds / 86400, 1)
+                fraction += 0.8 * math.sin(2 * math.pi * fraction) / (2 * math.pi)
+                yield self.start + timedelta(seconds=min(span, (day + fraction) * 86400))
+
+    def create_messages(self, options):
+        """Insert messages in time order, in rooms chosen with a skewed popularity."""
+        count = options['messages']
+        image_count = options['images'] if options['image_fraction'] > 0 and count else 0
+        images = self.create_images(image_count)
+        image_uses = Counter()
+
+        rooms, members = self.rooms, self.members
+        weights = [self.rng.paretovariate(1.2) * len(members[room.pk]) for room in rooms]
+        cum_weights = []
+        total = 0
+        for weight in weights:
+            total += weight
+            cum_weights.append(total)
+
+        times = self.timestamps(count)
+        batch = []
+        for _ in range(count):
+            room = rooms[bisect.bisect_left(cum_weights, self.rng.random() * total)]
+            sender_id = self.rng.choice(members[room.pk])
+            created_at = next(times)
+            if images and self.rng.random() < options['image_fraction']:
+                image = self.rng.choice(images)
+                image_uses[image] += 1
+                content = ''
+            else:
+                image = ''
+                content = ' '.join(self.rng.choices(WORDS, k=min(60, int(self.rng.expovariate(0.15)) + 1)))
+            batch.append((room.pk, sender_id, content, image, created_at))
+            if len(batch) >= self.batch_size:
+                self.insert_messages(batch)
+                batch = []
+        if batch:
+            self.insert_messages(batch)
+
+        # Each stored image holds one reference; add one per further use
+        for name in images:
+            if image_uses[name]:
+                ImageBlob.objects.filter(name=name).update(ref_count=F('ref_count') + image_uses[name] - 1)
+            else:
+                with transaction.atomic():
+                    release_blob(name)
+        return count
+
+    def insert_messages(self, rows):
+        """Insert message rows directly, keeping their generated creation times."""
+        table = connection.ops.quote_name(Message._meta.db_table)
+        columns = ['room_id', 'sender_id', 'content', 'image', 'created_at']
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql' and hasattr(cursor, 'copy_expert'):
+                buffer = StringIO()
+                csv.writer(buffer).writerows(
+                    (room_id, sender_id, content, image, created_at.isoformat())
+                    for room_id, sender_id, content, image, created_at in rows
+                )
+                buffer.seek(0)
+                cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+                return
+            adapt = connection.ops.adapt_datetimefield_value
+            cursor.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                [(room_id, sender_id, content, image, adapt(created_at))
+                 for room_id, sender_id, content, image, created_at in rows],
+            )
+
+    def update_rooms(self):
+        """Date rooms by their first message and recompute their activity columns."""
+        rooms = Room.objects.filter(pk__in=[room.pk for room in self.rooms])
+        first_message = Message.objects.filter(room=OuterRef('pk')).order_by().values('room').annotate(
+            first=Min('created_at')
+        ).values('first')
+        with transaction.atomic():
+            rooms.update(created_at=Coalesce(Subquery(first_message), self.start))
+            return recompute_activity(rooms, Message.objects.all())
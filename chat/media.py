@@ -0,0 +1,121 @@
+import mimetypes
+import re
+from pathlib import Path
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+RANGE_BLOCK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a Range header lies entirely outside the file."""
+
+
+def parse_range(header, size):
+    """Parse a single byte range and return an inclusive (start, end) tuple.
+
+    Returns None when the header should be ignored (malformed or multiple
+    ranges), in which case the whole file is served.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or size == 0:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+
+    if not start:
+        # Suffix range: the last N bytes of the file
+        length = int(end)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _read_range(path, start, length):
+    """Yield `length` bytes of a file starting at `start`."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(RANGE_BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _range_applies(request, etag, last_modified):
+    """Return True unless an If-Range precondition says the client's copy is outdated."""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _file_response(request, path, size, etag, last_modified, content_type):
+    """Serve the file from Python, honouring single byte ranges."""
+    range_header = request.headers.get('Range')
+    if range_header and request.method in ('GET', 'HEAD') and _range_applies(request, etag, last_modified):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(_read_range(path, start, length), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(length)
+            return response
+
+    return FileResponse(open(path, 'rb'), content_type=content_type)
+
+
+def serve_media(request, path):
+    """Return a response delivering a file from MEDIA_ROOT to an already authorized user.
+
+    Depending on CHAT_MEDIA_DELIVERY the bytes are sent by Django ('file') or
+    by the front proxy via X-Accel-Redirect (nginx) or X-Sendfile (Apache,
+    lighttpd). Conditional requests are answered with 304 in every mode.
+    """
+    path = Path(path)
+    stat = path.stat()
+    last_modified = int(stat.st_mtime)
+    etag = quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        delivery = settings.CHAT_MEDIA_DELIVERY
+        if delivery == 'x-accel-redirect':
+            relative_path = path.relative_to(Path(settings.MEDIA_ROOT)).as_posix()
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = settings.CHAT_MEDIA_ACCEL_PREFIX + quote(relative_path)
+        elif delivery == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = str(path)
+        else:
+            response = _file_response(request, path, stat.st_size, etag, last_modified, content_type)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    patch_cache_control(response, private=True, max_age=settings.CHAT_MEDIA_MAX_AGE)
+    return response
@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+from .models import Room
+from .routers import primary_reads
+
+
+class RoomMembershipCache:
+    """Bounded LRU cache of room member ids, with a time-to-live per entry.
+
+    Entries are invalidated by the signal handlers in chat.signals whenever a
+    room or its guest list changes in this process; the TTL bounds how long
+    changes made by other processes can go unnoticed.
+    """
+
+    def __init__(self):
+        """Create an empty cache."""
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, room_id):
+        """Return the cached member ids of a room, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(room_id)
+            if entry is None:
+                return None
+            expires_at, members = entry
+            if expires_at < time.monotonic():
+                del self._entries[room_id]
+                return None
+            self._entries.move_to_end(room_id)
+            return members
+
+    def set(self, room_id, members):
+        """Store the member ids of a room, evicting the least recently used entries."""
+        with self._lock:
+            self._entries[room_id] = (time.monotonic() + settings.CHAT_MEMBERSHIP_CACHE_TTL, members)
+            self._entries.move_to_end(room_id)
+            while len(self._entries) > settings.CHAT_MEMBERSHIP_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, room_id):
+        """Drop the cached members of a room."""
+        with self._lock:
+            self._entries.pop(room_id, None)
+
+    def clear(self):
+        """Drop all cached entries."""
+        with self._lock:
+            self._entries.clear()
+
+
+membership_cache = RoomMembershipCache()
+
+
+async def load_members(room_id):
+    """Return the ids of the owner and guests of a room (empty if it does not exist)."""
+    with primary_reads():
+        owner_id = await Room.objects.filter(pk=room_id).values_list('owner_id', flat=True).afirst()
+        if owner_id is None:
+            return frozenset()
+        guests = Room.guests.through.objects.filter(room_id=room_id).values_list('user_id', flat=True)
+        return frozenset([owner_id] + [guest_id async for guest_id in guests])
+
+
+async def is_member(room_id, user):
+    """Return True if the user owns or is a guest of the room."""
+    if user.is_anonymous:
+        return False
+    members = membership_cache.get(room_id)
+    if members is None:
+        members = await load_members(room_id)
+        membership_cache.set(room_id, members)
+    return user.pk in members
@@ -0,0 +1,387 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Values are kept per process. When CHAT_METRICS_DIR is set, every process
+# writes a snapshot of its values to that directory at most once per
+# CHAT_METRICS_FLUSH_INTERVAL, and the metrics endpoint adds up the snapshots
+# of all processes. Counters and histograms of exited processes keep counting:
+# a live process folds them into its own values and removes their snapshot,
+# and their gauges are dropped.
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(8))
+
+
+class Metric:
+    """A named metric whose values are keyed by label values."""
+
+    kind = None
+
+    def __init__(self, registry, name, help, labels=()):
+        """Create a metric without values."""
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Add to the count of the given labels."""
+        self.registry.update(self.name, self._key(labels), lambda value: (value or 0) + amount)
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        """Add to the value of the given labels."""
+        self.registry.update(self.name, self._key(labels), lambda value: (value or 0) + amount)
+
+    def dec(self, amount=1, **labels):
+        """Subtract from the value of the given labels."""
+        self.inc(-amount, **labels)
+
+    def set(self, amount, **labels):
+        """Replace the value of the given labels."""
+        self.registry.update(self.name, self._key(labels), lambda value: amount)
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labels=(), buckets=TIME_BUCKETS):
+        """Create a histogram with the given upper bucket bounds."""
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, amount, **labels):
+        """Record a value for the given labels."""
+        def add(value):
+            value = value or {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    value['buckets'][i] += 1
+                    break
+            value['sum'] += amount
+            value['count'] += 1
+            return value
+
+        self.registry.update(self.name, self._key(labels), add)
+
+    def time(self, **labels):
+        """Return a context manager observing the duration of its block in seconds."""
+        return Timer(self, labels)
+
+
+class Timer:
+    """Context manager observing elapsed time into a histogram."""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    """Metrics of this process, optionally shared with other processes through a directory."""
+
+    def __init__(self):
+        """Create a registry without metrics."""
+        self.metrics = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self._written = 0
+        self._timer = None
+        self._writer_pid = None
+
+    def counter(self, name, help, labels=()):
+        """Register and return a counter."""
+        return self._register(Counter(self, name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        """Register and return a gauge."""
+        return self._register(Gauge(self, name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        """Register and return a histogram."""
+        return self._register(Histogram(self, name, help, labels, buckets))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        self._values[metric.name] = {}
+        return metric
+
+    def update(self, name, key, func):
+        """Replace the value of a metric's labels with func(current value)."""
+        with self._lock:
+            values = self._values[name]
+            values[key] = func(values.get(key))
+        if settings.CHAT_METRICS_DIR:
+            self._schedule_write()
+
+    def clear(self):
+        """Reset every metric of this process."""
+        with self._lock:
+            for values in self._values.values():
+                values.clear()
+
+    def snapshot(self):
+        """Return the values of this process in a JSON-serializable form."""
+        with self._lock:
+            return {
+                name: [[list(key), _copy(value)] for key, value in values.items()]
+                for name, values in self._values.items()
+            }
+
+    def _schedule_write(self):
+        """Start a timer writing the snapshot once CHAT_METRICS_FLUSH_INTERVAL has passed since the last write.
+
+        Updates happen on request threads and the event loop, so the file is
+        only ever written from the timer thread.
+        """
+        with self._lock:
+            if self._timer is not None:
+                return
+            delay = max(0, self._written + settings.CHAT_METRICS_FLUSH_INTERVAL - time.monotonic())
+            self._timer = threading.Timer(delay, self._timed_write)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_write(self):
+        with self._lock:
+            self._timer = None
+            self._written = time.monotonic()
+        self.write()
+
+    def write(self):
+        """Write this process's snapshot to the shared directory, logging failures."""
+        if not settings.CHAT_METRICS_DIR:
+            return
+        self._written = time.monotonic()
+        directory = Path(settings.CHAT_METRICS_DIR)
+        path = directory / f'{os.getpid()}.json'
+        temp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            # A snapshot under our id before our first write was left by an exited process
+            if self._writer_pid != os.getpid():
+                self._retire(path)
+                self._writer_pid = os.getpid()
+            temp_path.write_text(json.dumps(self.snapshot()))
+            os.replace(temp_path, path)
+        except OSError:
+            logger.exception("Failed to write the metrics snapshot to %s", path)
+            temp_path.unlink(missing_ok=True)
+
+    def _fold(self, path):
+        """Add the counters and histograms of a snapshot file to this process's values and remove the file."""
+        try:
+            snapshot = json.loads(path.read_text())
+        except FileNotFoundError:
+            return
+        except ValueError:
+            snapshot = {}
+        with self._lock:
+            for name, items in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None or metric.kind == 'gauge':
+                    continue
+                values = self._values[name]
+                for key, value in items:
+                    key = tuple(key)
+                    values[key] = _add(values.get(key), value)
+        path.unlink(missing_ok=True)
+
+    def _retire(self, path):
+        """Fold the snapshot of an exited process into this process's values."""
+        # Renaming first makes sure the snapshot is folded only once
+        claimed = path.with_suffix(f'.{os.getpid()}.retired')
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return
+        self._fold(claimed)
+
+    def collect(self):
+        """Return the values of all processes, keyed by metric name and label values."""
+        if not settings.CHAT_METRICS_DIR:
+            with self._lock:
+                return {
+                    name: {key: _copy(value) for key, value in values.items()}
+                    for name, values in self._values.items()
+                }
+
+        directory = Path(settings.CHAT_METRICS_DIR)
+        for path in directory.glob('*.json'):
+            if path.stem.isdigit() and not _is_alive(int(path.stem)):
+                try:
+                    self._retire(path)
+                except OSError:
+                    logger.exception("Failed to fold the metrics snapshot %s", path)
+        self.write()
+        merged = {name: {} for name in self.metrics}
+        for path in directory.glob('*.json'):
+            try:
+                snapshot = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            for name, items in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                for key, value in items:
+                    key = tuple(key)
+                    merged[name][key] = _add(merged[name].get(key), value)
+        return merged
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        values = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for key, value in sorted(values.get(name, {}).items()):
+                labels = list(zip(metric.labels, key))
+                if metric.kind != 'histogram':
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets, value['buckets']):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + [('le', _number(bound))])} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels + [('le', '+Inf')])} {value['count']}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value['sum'])}")
+                lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+def _is_alive(pid):
+    """Return whether a process of this host with the given id is running."""
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _copy(value):
+    # Histogram values are updated in place, so they are copied under the lock
+    if isinstance(value, dict):
+        return dict(value, buckets=list(value['buckets']))
+    return value
+
+
+def _add(total, value):
+    if total is None:
+        return value
+    if isinstance(value, dict):
+        return {
+            'buckets': [a + b for a, b in zip(total['buckets'], value['buckets'])],
+            'sum': total['sum'] + value['sum'],
+            'count': total['count'] + value['count'],
+        }
+    return total + value
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _number(value):
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+open_sockets = registry.gauge('chat_open_sockets', "WebSocket connections currently open.")
+connections = registry.counter(
+    'chat_connections_total', "WebSocket connection attempts by outcome.", labels=('outcome',),
+)
+frames_received = registry.counter(
+    'chat_frames_received_total', "WebSocket frames received from clients by kind.", labels=('kind',),
+)
+messages = registry.counter('chat_messages_total', "Chat messages accepted and broadcast.", labels=('storage',))
+frames_sent = registry.counter('chat_frames_sent_total', "Chat message frames delivered to clients.")
+group_send_seconds = registry.histogram('chat_group_send_seconds', "Time spent in group_send per broadcast.")
+message_db_seconds = registry.histogram(
+    'chat_message_db_seconds', "Database time spent storing a chat message.", labels=('storage',),
+)
+image_upload_bytes = registry.histogram(
+    'chat_image_upload_bytes', "Size of uploaded images before processing.", buckets=SIZE_BUCKETS,
+)
+media_requests = registry.counter(
+    'chat_media_requests_total', "Protected media requests by image variant.", labels=('variant',),
+)
+rate_limit_hits = registry.counter(
+    'chat_rate_limit_hits_total', "Frames rejected by a rate limit.", labels=('scope', 'budget'),
+)
+rate_limit_disconnects = registry.counter(
+    'chat_rate_limit_disconnects_total', "Connections closed for exceeding rate limits.",
+)
+write_behind_flushed = registry.counter(
+    'chat_write_behind_flushed_total', "Buffered messages written by write-behind flushes.",
+)
+write_behind_flush_seconds = registry.histogram(
+    'chat_write_behind_flush_seconds', "Time spent writing one write-behind batch.",
+)
+http_request_seconds = registry.histogram(
+    'http_request_duration_seconds', "Time spent handling HTTP requests.", labels=('view', 'method', 'status'),
+)
+db_pool_connections = registry.gauge(
+    'db_pool_connections', "Pooled database connections by state.", labels=('alias', 'state'),
+)
+db_pool_max_connections = registry.gauge(
+    'db_pool_max_connections', "Upper bound of pooled database connections.", labels=('alias',),
+)
+db_pool_waiting = registry.gauge(
+    'db_pool_waiting', "Threads waiting for a pooled database connection.", labels=('alias',),
+)
+db_pool_wait_seconds = registry.histogram(
+    'db_pool_wait_seconds', "Time spent waiting for a pooled database connection.", labels=('alias',),
+)
+db_pool_timeouts = registry.counter(
+    'db_pool_timeouts_total', "Requests for a pooled database connection that timed out.", labels=('alias',),
+)
+db_pool_discarded = registry.counter(
+    'db_pool_discarded_total', "Pooled database connections closed by reason.", labels=('alias', 'reason'),
+)
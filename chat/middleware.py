@@ -0,0 +1,67 @@
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics, profiling, routers
+
+
+class RequestTimingMiddleware:
+    """Records the duration of every HTTP request by view, method and status."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - start,
+            view=match.view_name if match else 'unmatched',
+            method=request.method,
+            status=response.status_code,
+        )
+        return response
+
+
+class QueryProfilerMiddleware:
+    """Profiles the queries of every request and checks them against CHAT_QUERY_BUDGETS.
+
+    Only active with CHAT_PROFILER enabled. Results are added to the response
+    headers and logged to the chat.profiling logger.
+    """
+
+    def __init__(self, get_response):
+        if not settings.CHAT_PROFILER:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with profiling.profile(request.path) as query_profile:
+            response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and match.url_name:
+            query_profile.name = match.url_name
+        for header, value in query_profile.headers().items():
+            response[header] = value
+        query_profile.report()
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """Pins users to the primary database for a while after requests that wrote to it.
+
+    Only active when read replicas are configured in CHAT_DATABASE_REPLICAS.
+    """
+
+    def __init__(self, get_response):
+        if not settings.CHAT_DATABASE_REPLICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with routers.routing() as state:
+            response = self.get_response(request)
+        if state.wrote and request.user.is_authenticated:
+            routers.pin_primary(request.user.pk)
+        return response
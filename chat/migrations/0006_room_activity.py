@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+from chat.activity import recompute_activity
+
+
+def backfill_activity(apps, schema_editor):
+    Room = apps.get_model('chat', 'Room')
+    Message = apps.get_model('chat', 'Message')
+    recompute_activity(Room.objects.all(), Message.objects.all())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_room_recent_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_activity, migrations.RunPython.noop),
+    ]
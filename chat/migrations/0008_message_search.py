@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:12
+
+from django.db import migrations
+
+from chat.search import install_search_index, uninstall_search_index
+
+
+def install(apps, schema_editor):
+    install_search_index(schema_editor)
+
+
+def uninstall(apps, schema_editor):
+    uninstall_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_imageblob'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:40
+
+from django.db import migrations
+
+from chat.partitioning import partition_messages, unpartition_messages
+
+
+def partition(apps, schema_editor):
+    partition_messages(schema_editor)
+
+
+def unpartition(apps, schema_editor):
+    unpartition_messages(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_message_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
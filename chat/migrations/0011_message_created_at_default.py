@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_message_partitioning'),
+    ]
+
+    operations = [
+        # The default is applied by Django only, and rebuilding the table on
+        # SQLite would drop the search triggers of chat_message
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='message',
+                    name='created_at',
+                    field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+                ),
+            ],
+        ),
+    ]
@@ -1,5 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
 
 
 class Room(models.Model):
@@ -12,10 +16,54 @@ class Room(models.Model):
     is_publicly_visible = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Activity of the rows in the message table, maintained by record_messages and remove_messages
+    last_message_at = models.DateTimeField(blank=True, null=True, editable=False)
+    last_message_id = models.BigIntegerField(blank=True, null=True, editable=False)
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+    # Messages older than the retention horizon are moved to the archive (see chat.archive)
+    retention_days = models.PositiveIntegerField(blank=True, null=True)
+    archived_through = models.DateTimeField(blank=True, null=True, editable=False)
 
     def __str__(self):
         return f"{self.name} (owner: {self.owner.username})"
 
+    @staticmethod
+    def record_messages(room_id, last_message_at, last_message_id, count=1):
+        """Atomically add new messages to the activity columns of a room."""
+        is_newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=last_message_at)
+        Room.objects.filter(pk=room_id).update(
+            message_count=F('message_count') + count,
+            last_message_at=Case(
+                When(is_newer, then=Value(last_message_at, output_field=models.DateTimeField())),
+                default=F('last_message_at'),
+            ),
+            last_message_id=Case(
+                When(is_newer, then=Value(last_message_id, output_field=models.BigIntegerField())),
+                default=F('last_message_id'),
+            ),
+        )
+
+    @staticmethod
+    def remove_messages(room_id, message_ids):
+        """Take deleted or archived messages out of the activity columns of a room.
+
+        The latest message is looked up again among the remaining rows only if
+        it was one of the removed messages.
+        """
+        removed_last = Q(last_message_id__in=message_ids)
+        latest = Message.objects.filter(room=OuterRef('pk')).order_by('-created_at', '-id')
+        Room.objects.filter(pk=room_id).update(
+            message_count=Greatest(F('message_count') - len(message_ids), 0),
+            last_message_at=Case(
+                When(removed_last, then=Subquery(latest.values('created_at')[:1])),
+                default=F('last_message_at'),
+            ),
+            last_message_id=Case(
+                When(removed_last, then=Subquery(latest.values('id')[:1])),
+                default=F('last_message_id'),
+            ),
+        )
+
     class Meta:
         """Meta options for the Room model."""
         ordering = ["-created_at"]
@@ -29,12 +77,19 @@ class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name="sent_messages")
     content = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to='message_images/', blank=True, null=True, default=None)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, so buffered messages keep the time they were sent
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # True for messages read back from the retention archive, which are not saved rows
+    archived = False
 
     def save(self, *args, **kwargs):
         if not self.content and not self.image:
             raise ValueError("Message must contain text or image.")
-        super().save(*args, **kwargs)
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                Room.record_messages(self.room_id, self.created_at, self.pk)
 
     def __str__(self):
         if self.image:
@@ -42,8 +97,73 @@ class Message(models.Model):
         else:
             return f"User '{self.sender.username}' in room '{self.room.name}' at {self.created_at.strftime('%Y-%m-%d %H:%M:%S')}: {self.content[:15]}"
 
+    def to_payload(self):
+        """Return the message in the format sent to chat clients."""
+        return {
+            'id': self.id,
+            'sender': self.sender.username,
+            'message': self.content or '',
+            'timestamp': self.created_at.isoformat(),
+            'image_url': self.image_url,
+        }
+
+    @property
+    def image_url(self):
+        """Return the URL serving the message's image to room members, or None."""
+        if not self.image:
+            return None
+        if self.archived:
+            return reverse('archive-media', kwargs={'pk': self.room_id, 'message_id': self.id})
+        return reverse('protected-media', kwargs={'message_id': self.id})
+
     class Meta:
         """Meta options for Message model."""
         ordering = ["-created_at"]
         verbose_name = "Message"
         verbose_name_plural = "Messages"
+        indexes = [
+            # Serves keyset pagination over the newest messages of a room
+            models.Index(fields=["room", "-created_at", "-id"], name="chat_msg_room_recent_idx"),
+        ]
+
+
+class ImageBlob(models.Model):
+    """Model representing a content-addressed image file shared by all messages that use it."""
+    digest = models.CharField(max_length=64, unique=True)
+    source_digest = models.CharField(max_length=64, db_index=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} references)"
+
+    class Meta:
+        """Meta options for ImageBlob model."""
+        verbose_name = "Image blob"
+        verbose_name_plural = "Image blobs"
+
+
+class ArchiveSegment(models.Model):
+    """Model representing one room's archived messages of one month, stored as compressed blocks."""
+    room = models.ForeignKey("Room", on_delete=models.CASCADE, related_name="archive_segments")
+    month = models.DateField()
+    path = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    message_count = models.PositiveIntegerField(default=0)
+    # Offset index: one entry per block with its byte range, message count and first/last positions
+    blocks = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.room_id}/{self.month:%Y-%m} ({self.message_count} messages)"
+
+    class Meta:
+        """Meta options for ArchiveSegment model."""
+        ordering = ["-month"]
+        verbose_name = "Archive segment"
+        verbose_name_plural = "Archive segments"
+        constraints = [
+            models.UniqueConstraint(fields=["room", "month"], name="chat_archive_room_month_uniq"),
+        ]
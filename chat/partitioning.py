@@ -0,0 +1,210 @@
+import re
+from datetime import date, datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection as default_connection, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+# With CHAT_MESSAGE_PARTITIONING on PostgreSQL, chat_message is a table
+# partitioned by created_at month. Converting an existing table does not copy
+# rows: the old table is attached as the partition of everything before the
+# next month, monthly partitions follow it, and a default partition catches
+# rows outside them so inserts never fail when partitions were not created
+# in time. PostgreSQL requires the partition key in the primary key, so the
+# key becomes (id, created_at); ids stay unique through their sequence.
+#
+# The conversion is not cheap: attaching the old table builds a unique
+# (id, created_at) index on it and scans it to validate the partition bound,
+# all under the ACCESS EXCLUSIVE lock taken first, so messages can be neither
+# read nor written for a time proportional to the size of the table.
+#
+# Other databases keep a single table, and the migration does nothing there.
+TABLE = 'chat_message'
+LEGACY = 'chat_message_legacy'
+DEFAULT = 'chat_message_default'
+
+POSTGRESQL_CONVERT = [
+    f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE",
+    f"ALTER TABLE {TABLE} RENAME TO {LEGACY}",
+    f"ALTER TABLE {LEGACY} RENAME CONSTRAINT {TABLE}_pkey TO {LEGACY}_pkey",
+    f"ALTER INDEX chat_msg_room_recent_idx RENAME TO {LEGACY}_recent_idx",
+    f"ALTER INDEX IF EXISTS chat_msg_search_idx RENAME TO {LEGACY}_search_idx",
+    f"""CREATE TABLE {TABLE} (
+        LIKE {LEGACY} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING IDENTITY
+    ) PARTITION BY RANGE (created_at)""",
+    f"""SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'),
+        (SELECT coalesce(max(id), 0) + 1 FROM {LEGACY}), false)""",
+    f"ALTER TABLE {LEGACY} ALTER COLUMN id DROP IDENTITY IF EXISTS",
+    f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, created_at)",
+    f"CREATE INDEX chat_msg_room_recent_idx ON {TABLE} (room_id, created_at DESC, id DESC)",
+    f"CREATE INDEX chat_message_room_idx ON {TABLE} (room_id)",
+    f"CREATE INDEX chat_message_sender_idx ON {TABLE} (sender_id)",
+    f"""ALTER TABLE {TABLE} ADD CONSTRAINT chat_message_room_fk FOREIGN KEY (room_id)
+        REFERENCES chat_room (id) DEFERRABLE INITIALLY DEFERRED""",
+    f"""ALTER TABLE {TABLE} ADD CONSTRAINT chat_message_sender_fk FOREIGN KEY (sender_id)
+        REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED""",
+    f"ALTER TABLE {TABLE} ATTACH PARTITION {LEGACY} FOR VALUES FROM (MINVALUE) TO (%s)",
+    f"CREATE TABLE {DEFAULT} PARTITION OF {TABLE} DEFAULT",
+]
+POSTGRESQL_SEARCH_INDEX = f"CREATE INDEX chat_msg_search_idx ON {TABLE} USING GIN (search_vector)"
+
+POSTGRESQL_UNPARTITION = [
+    f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE",
+    f"ALTER TABLE {TABLE} RENAME TO chat_message_partitioned",
+    f"""CREATE TABLE {TABLE} (
+        LIKE chat_message_partitioned INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING IDENTITY
+    )""",
+    f"INSERT INTO {TABLE} ({{columns}}) SELECT {{columns}} FROM chat_message_partitioned",
+    f"""SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'),
+        (SELECT coalesce(max(id), 0) + 1 FROM {TABLE}), false)""",
+    "DROP TABLE chat_message_partitioned CASCADE",
+    f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id)",
+    f"CREATE INDEX chat_msg_room_recent_idx ON {TABLE} (room_id, created_at DESC, id DESC)",
+    f"CREATE INDEX chat_message_room_idx ON {TABLE} (room_id)",
+    f"CREATE INDEX chat_message_sender_idx ON {TABLE} (sender_id)",
+    f"""ALTER TABLE {TABLE} ADD CONSTRAINT chat_message_room_fk FOREIGN KEY (room_id)
+        REFERENCES chat_room (id) DEFERRABLE INITIALLY DEFERRED""",
+    f"""ALTER TABLE {TABLE} ADD CONSTRAINT chat_message_sender_fk FOREIGN KEY (sender_id)
+        REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED""",
+]
+
+POSTGRESQL_PARTITIONS = """
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = %s::regclass
+"""
+UPPER_BOUND_RE = re.compile(r"TO \('([^']+)'\)")
+
+
+def month_start(value):
+    """Return the first day of the UTC month of a datetime or date."""
+    if isinstance(value, datetime):
+        value = value.astimezone(dt_timezone.utc)
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    """Return the first day of the month `count` months after (or before) `month`."""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_bound(month):
+    """Return the aware UTC datetime at which a month starts."""
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month:%Y_%m}'
+
+
+def _bound(month):
+    return f'{month:%Y-%m-%d} 00:00:00+00'
+
+
+def upper_bound(expression):
+    """Return the month a partition bound expression ends at, or None for the default partition."""
+    match = UPPER_BOUND_RE.search(expression or '')
+    # PostgreSQL prints bounds as '2026-11-01 00:00:00+00', which fromisoformat() rejects before Python 3.11
+    return month_start(parse_datetime(match.group(1))) if match else None
+
+
+def is_enabled(connection=default_connection):
+    """Return whether messages are partitioned on this database."""
+    return settings.CHAT_MESSAGE_PARTITIONING and connection.vendor == 'postgresql'
+
+
+def is_partitioned(cursor):
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", [TABLE])
+    return cursor.fetchone()[0]
+
+
+def partition_messages(schema_editor, now=None):
+    """Convert chat_message into a partitioned table, if partitioning is enabled for its database."""
+    connection = schema_editor.connection
+    if not is_enabled(connection):
+        return
+    with connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return
+        columns = {column.name for column in connection.introspection.get_table_description(cursor, TABLE)}
+
+    boundary = add_months(month_start(now or timezone.now()), 1)
+    for sql in POSTGRESQL_CONVERT:
+        schema_editor.execute(sql, [_bound(boundary)] if '%s' in sql else None)
+    if 'search_vector' in columns:
+        schema_editor.execute(POSTGRESQL_SEARCH_INDEX)
+    ensure_partitions(connection, now)
+
+
+def unpartition_messages(schema_editor):
+    """Copy a partitioned chat_message back into a single table."""
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return
+        columns = [column.name for column in connection.introspection.get_table_description(cursor, TABLE)]
+
+    search = 'search_vector' in columns
+    # Generated columns are computed again by the new table
+    columns = ', '.join(connection.ops.quote_name(column) for column in columns if column != 'search_vector')
+    for sql in POSTGRESQL_UNPARTITION:
+        schema_editor.execute(sql.format(columns=columns))
+    if search:
+        schema_editor.execute(POSTGRESQL_SEARCH_INDEX)
+
+
+def ensure_partitions(connection=default_connection, now=None, ahead=None):
+    """Create the monthly partitions from the current month up to `ahead` months later.
+
+    Months already covered by a partition are skipped. Returns the names of
+    the created partitions.
+    """
+    if not is_enabled(connection):
+        return []
+    ahead = settings.CHAT_MESSAGE_PARTITIONS_AHEAD if ahead is None else ahead
+    current = month_start(now or timezone.now())
+    created = []
+    with connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return []
+        cursor.execute(POSTGRESQL_PARTITIONS, [TABLE])
+        covered = [month for _, bound in cursor.fetchall() for month in [upper_bound(bound)] if month]
+        month = max([current, *covered])
+        while month <= add_months(current, ahead):
+            name = partition_name(month)
+            bounds = [_bound(month), _bound(add_months(month, 1))]
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT} WHERE created_at >= %s AND created_at < %s)", bounds)
+            if cursor.fetchone()[0]:
+                _create_from_default(connection, cursor, name, bounds)
+            else:
+                cursor.execute(f"CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)", bounds)
+            created.append(name)
+            month = add_months(month, 1)
+    return created
+
+
+def _create_from_default(connection, cursor, name, bounds):
+    """Create a partition for a range the default partition already holds rows of.
+
+    PostgreSQL refuses to create such a partition, so the default partition is
+    detached while the rows are moved into the new one.
+    """
+    columns = [column.name for column in connection.introspection.get_table_description(cursor, TABLE)]
+    # Generated columns are computed again on insert
+    columns = ', '.join(connection.ops.quote_name(column) for column in columns if column != 'search_vector')
+    in_range = "created_at >= %s AND created_at < %s"
+    with transaction.atomic(using=connection.alias):
+        cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT}")
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)", bounds)
+        cursor.execute(f"INSERT INTO {TABLE} ({columns}) SELECT {columns} FROM {DEFAULT} WHERE {in_range}", bounds)
+        cursor.execute(f"DELETE FROM {DEFAULT} WHERE {in_range}", bounds)
+        cursor.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT} DEFAULT")
+
+
+def create_partitions_after_migrate(sender, using, **kwargs):
+    """Create upcoming partitions whenever the chat app is migrated."""
+    ensure_partitions(connections[using])
@@ -0,0 +1,165 @@
+import asyncio
+import atexit
+import itertools
+import logging
+import os
+import threading
+import time
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.utils import timezone
+
+from . import metrics, room_index
+from .models import Room, Message
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBufferFull(Exception):
+    """Raised when CHAT_WRITE_BEHIND_MAX_PENDING messages are already waiting to be written."""
+
+
+class MessageWriteBuffer:
+    """Buffers text messages in memory and inserts them in batches.
+
+    Messages are written in the order they were added, with the time they
+    were added, and the buffer is flushed when it reaches
+    CHAT_WRITE_BEHIND_BATCH_SIZE messages, after CHAT_WRITE_BEHIND_INTERVAL
+    seconds, or when the process exits. A failed flush is retried after the
+    same interval, and new messages are refused while
+    CHAT_WRITE_BEHIND_MAX_PENDING messages are waiting or being written.
+    """
+
+    def __init__(self):
+        """Create an empty buffer."""
+        self._pending = []
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._timer = None
+        self._atexit_registered = False
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.flushed_total = 0
+
+    def __len__(self):
+        """Return the number of messages waiting to be written."""
+        with self._lock:
+            return len(self._pending)
+
+    def add(self, room_id, sender_id, content):
+        """Queue a text message and return its provisional id and the time it is stored with."""
+        message = Message(room_id=room_id, sender_id=sender_id, content=content, created_at=timezone.now())
+        with self._lock:
+            if len(self._pending) + self._in_flight >= settings.CHAT_WRITE_BEHIND_MAX_PENDING:
+                raise WriteBufferFull("Too many messages are waiting to be saved, try again later.")
+            self._pending.append(message)
+            size = len(self._pending)
+
+        if not self._atexit_registered:
+            atexit.register(self.flush_sync)
+            self._atexit_registered = True
+
+        self._schedule_flush(immediate=size >= settings.CHAT_WRITE_BEHIND_BATCH_SIZE)
+        return f'p{os.getpid()}-{next(self._ids)}', message.created_at
+
+    def has_pending(self, room_id):
+        """Return whether messages of a room are waiting to be written."""
+        with self._lock:
+            return any(message.room_id == room_id for message in self._pending)
+
+    def _schedule_flush(self, immediate=False):
+        """Arrange for the buffer to be flushed on the running event loop, if any."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        if immediate:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            loop.create_task(self.flush())
+        elif self._timer is None:
+            self._timer = loop.call_later(
+                settings.CHAT_WRITE_BEHIND_INTERVAL,
+                lambda: loop.create_task(self.flush()),
+            )
+
+    async def flush(self):
+        """Write all buffered messages without blocking the event loop."""
+        self._timer = None
+        written = await database_sync_to_async(self.flush_sync)()
+        # Messages put back by a failed flush must not wait for the next add()
+        if len(self):
+            self._schedule_flush()
+        return written
+
+    def flush_sync(self):
+        """Write all buffered messages to the database and return how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._in_flight = len(batch)
+            if not batch:
+                return 0
+
+            start = time.monotonic()
+            try:
+                written = self._write(batch)
+            except DatabaseError:
+                # Put the batch back in front of newer messages to keep the order
+                with self._lock:
+                    self._pending[:0] = batch
+                    self._in_flight = 0
+                logger.exception("Failed to flush %d buffered messages", len(batch))
+                return 0
+            with self._lock:
+                self._in_flight = 0
+
+            self.last_batch_size = written
+            self.last_flush_ms = (time.monotonic() - start) * 1000
+            self.flushed_total += written
+            metrics.write_behind_flushed.inc(written)
+            metrics.write_behind_flush_seconds.observe(self.last_flush_ms / 1000)
+            logger.info("Flushed %d buffered messages in %.1f ms", written, self.last_flush_ms)
+            return written
+
+    def _write(self, batch):
+        """Insert a batch, falling back to single inserts if a row is rejected."""
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(batch)
+                self._record_activity(batch)
+            return len(batch)
+        except IntegrityError:
+            logger.warning("Batch insert rejected, retrying %d messages one by one", len(batch))
+
+        written = 0
+        for message in batch:
+            try:
+                with transaction.atomic():
+                    Message.objects.bulk_create([message])
+                    self._record_activity([message])
+                written += 1
+            except IntegrityError:
+                logger.warning("Dropping buffered message for room %s", message.room_id)
+        return written
+
+    def _record_activity(self, messages):
+        """Update the activity columns of every room that received messages."""
+        rooms = {}
+        for message in messages:
+            count, latest = rooms.get(message.room_id, (0, message))
+            if (message.created_at, message.pk or 0) >= (latest.created_at, latest.pk or 0):
+                latest = message
+            rooms[message.room_id] = (count + 1, latest)
+        for room_id, (count, latest) in rooms.items():
+            Room.record_messages(room_id, latest.created_at, latest.pk, count=count)
+        room_index.rooms_changed(*rooms)
+
+
+message_buffer = MessageWriteBuffer()
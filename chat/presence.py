@@ -0,0 +1,190 @@
+import asyncio
+import time
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .protocol import encode_control
+
+
+class RoomPresence:
+    """Connections, typing users and unsent changes of one room in this process."""
+
+    def __init__(self, group):
+        """Create an empty room bound to a channel layer group."""
+        self.group = group
+        self.connections = {}
+        self.usernames = {}
+        self.typing = {}
+        self.joined = {}
+        self.left = {}
+        self.typing_changed = False
+
+    def online(self):
+        """Return the ids of users with at least one connection."""
+        return {user_id for user_id, _ in self.connections.values()}
+
+    def add(self, channel_name, user_id, username, now):
+        """Register a connection, recording the user as joined if it is their first."""
+        was_online = user_id in self.online()
+        self.connections[channel_name] = (user_id, now)
+        self.usernames[user_id] = username
+        if not was_online:
+            if self.left.pop(user_id, None) is None:
+                self.joined[user_id] = username
+
+    def remove(self, channel_name):
+        """Drop a connection, recording the user as left if it was their last."""
+        entry = self.connections.pop(channel_name, None)
+        if entry is None:
+            return
+        user_id = entry[0]
+        if user_id in self.online():
+            return
+        username = self.usernames.pop(user_id)
+        if self.typing.pop(user_id, None) is not None:
+            self.typing_changed = True
+        if self.joined.pop(user_id, None) is None:
+            self.left[user_id] = username
+
+    def snapshot(self):
+        """Return the full presence state of the room."""
+        online = self.online()
+        limit = settings.CHAT_PRESENCE_MAX_NAMES
+        return {
+            'online_count': len(online),
+            'online': sorted(self.usernames[user_id] for user_id in online) if len(online) <= limit else [],
+            **self._typing_state(),
+        }
+
+    def delta(self):
+        """Return the changes since the previous delta, or None if nothing changed."""
+        if not self.joined and not self.left and not self.typing_changed:
+            return None
+        online_count = len(self.online())
+        # Large rooms only receive the count, so payload size stays bounded
+        names = online_count <= settings.CHAT_PRESENCE_MAX_NAMES
+        delta = {
+            'online_count': online_count,
+            'joined': sorted(self.joined.values()) if names else [],
+            'left': sorted(self.left.values()) if names else [],
+            **self._typing_state(),
+        }
+        self.joined, self.left, self.typing_changed = {}, {}, False
+        return delta
+
+    def _typing_state(self):
+        names = sorted(self.usernames[user_id] for user_id in self.typing)
+        return {'typing': names[:settings.CHAT_PRESENCE_MAX_NAMES], 'typing_count': len(names)}
+
+
+class PresenceTracker:
+    """Tracks who is online and typing in each room served by this process.
+
+    Changes are not sent as they happen. A periodic tick on the event loop
+    sends at most one presence_update per room every CHAT_PRESENCE_INTERVAL
+    seconds, and drops connections that have not sent a heartbeat within
+    CHAT_PRESENCE_TIMEOUT seconds as well as typing states older than
+    CHAT_TYPING_TIMEOUT seconds. The state covers connections of this process
+    only, so it supports a single worker: with several, each one sends the
+    whole group its own online count and clients see conflicting values.
+    """
+
+    def __init__(self):
+        """Create a tracker with no rooms."""
+        self._rooms = {}
+        self._timer = None
+        self._loop = None
+
+    def join(self, room_id, group, channel_name, user):
+        """Add a connection to a room."""
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = self._rooms[room_id] = RoomPresence(group)
+        room.add(channel_name, user.pk, user.username, time.monotonic())
+        self._ensure_ticking()
+
+    def snapshot(self, room_id):
+        """Return the current presence of a room."""
+        room = self._rooms.get(room_id)
+        if room is None:
+            return {'online_count': 0, 'online': [], 'typing': [], 'typing_count': 0}
+        return room.snapshot()
+
+    def leave(self, room_id, channel_name):
+        """Remove a connection from a room."""
+        room = self._rooms.get(room_id)
+        if room is not None:
+            room.remove(channel_name)
+
+    def heartbeat(self, room_id, group, channel_name, user):
+        """Mark a connection as alive, adding it back if it had expired."""
+        room = self._rooms.get(room_id)
+        if room is not None and channel_name in room.connections:
+            room.connections[channel_name] = (user.pk, time.monotonic())
+        else:
+            self.join(room_id, group, channel_name, user)
+
+    def set_typing(self, room_id, user, is_typing):
+        """Start or stop the typing state of a connected user."""
+        room = self._rooms.get(room_id)
+        if room is None or user.pk not in room.usernames:
+            return
+        if is_typing:
+            if user.pk not in room.typing:
+                room.typing_changed = True
+            room.typing[user.pk] = time.monotonic() + settings.CHAT_TYPING_TIMEOUT
+        elif room.typing.pop(user.pk, None) is not None:
+            room.typing_changed = True
+
+    def collect(self, now=None):
+        """Expire stale state and return (group, delta) pairs of rooms that changed."""
+        now = time.monotonic() if now is None else now
+        stale_before = now - settings.CHAT_PRESENCE_TIMEOUT
+        updates = []
+        for room_id, room in list(self._rooms.items()):
+            for channel_name, (_, last_seen) in list(room.connections.items()):
+                if last_seen < stale_before:
+                    room.remove(channel_name)
+            for user_id, expires_at in list(room.typing.items()):
+                if expires_at < now:
+                    del room.typing[user_id]
+                    room.typing_changed = True
+
+            delta = room.delta()
+            if delta is not None:
+                updates.append((room.group, delta))
+            if not room.connections:
+                del self._rooms[room_id]
+        return updates
+
+    def clear(self):
+        """Forget every room."""
+        self._rooms.clear()
+
+    def _ensure_ticking(self):
+        """Schedule the next tick on the running event loop unless one is pending."""
+        loop = asyncio.get_running_loop()
+        if self._timer is None or self._loop is not loop:
+            self._loop = loop
+            self._timer = loop.call_later(settings.CHAT_PRESENCE_INTERVAL, self._tick)
+
+    def _tick(self):
+        """Send coalesced presence updates and keep ticking while rooms have connections."""
+        self._timer = None
+        updates = self.collect()
+        if updates:
+            self._loop.create_task(self._send(updates))
+        if self._rooms:
+            self._timer = self._loop.call_later(settings.CHAT_PRESENCE_INTERVAL, self._tick)
+
+    async def _send(self, updates):
+        """Broadcast presence deltas to their room groups, each encoded once."""
+        channel_layer = get_channel_layer()
+        for group, delta in updates:
+            await channel_layer.group_send(group, {
+                'type': 'presence_update',
+                **encode_control({'type': 'presence', **delta}),
+            })
+
+
+presence = PresenceTracker()
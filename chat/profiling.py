@@ -0,0 +1,152 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+logger = logging.getLogger(__name__)
+
+# The profile of the request or WebSocket frame being handled. Context
+# variables are copied into sync_to_async threads, so queries the consumer
+# runs on the database thread are recorded in the frame's profile as well.
+_current = ContextVar('chat_query_profile', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised in strict mode when a request runs more queries than its budget."""
+
+
+class QueryProfile:
+    """Queries and timings recorded while handling one request or WebSocket frame."""
+
+    def __init__(self, name):
+        """Create an empty profile for the named URL or consumer event."""
+        self.name = name
+        self.queries = []
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def add(self, sql, params, duration):
+        """Record an executed statement."""
+        self.queries.append((sql, repr(params), duration))
+
+    def finish(self):
+        """Stop the wall clock of the profile."""
+        self.duration = time.perf_counter() - self.start
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duplicates(self):
+        """Return how many statements repeated an earlier one with the same parameters."""
+        return self.count - len({(sql, params) for sql, params, _ in self.queries})
+
+    @property
+    def similar(self):
+        """Return how many statements repeated an earlier one with other parameters, as N+1 loops do."""
+        return sum(count - 1 for count in Counter(sql for sql, _, _ in self.queries).values())
+
+    @property
+    def db_time(self):
+        return sum(duration for _, _, duration in self.queries)
+
+    @property
+    def slowest(self):
+        """Return the (sql, duration) of the slowest statement, or None."""
+        if not self.queries:
+            return None
+        sql, _, duration = max(self.queries, key=lambda query: query[2])
+        return sql, duration
+
+    @property
+    def budget(self):
+        return settings.CHAT_QUERY_BUDGETS.get(self.name, {}).get('queries')
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.count > self.budget
+
+    def headers(self):
+        """Return response headers summarizing the profile."""
+        headers = {
+            'X-Query-Count': str(self.count),
+            'X-Query-Duplicates': str(self.duplicates),
+            'X-Query-Similar': str(self.similar),
+            'X-Query-Time-Ms': f'{self.db_time * 1000:.2f}',
+            'X-Request-Time-Ms': f'{self.duration * 1000:.2f}',
+        }
+        if self.budget is not None:
+            headers['X-Query-Budget'] = str(self.budget)
+        return headers
+
+    def report(self):
+        """Log the profile, as a warning when it exceeds its budget, and raise in strict mode."""
+        slowest = self.slowest
+        logger.log(
+            logging.WARNING if self.over_budget else logging.INFO,
+            "%s: %d queries (%d duplicate, %d similar, budget %s), db %.2f ms, total %.2f ms, slowest %.2f ms: %s",
+            self.name, self.count, self.duplicates, self.similar, self.budget,
+            self.db_time * 1000, self.duration * 1000,
+            slowest[1] * 1000 if slowest else 0, slowest[0] if slowest else '-',
+        )
+        if self.over_budget and settings.CHAT_PROFILER_STRICT:
+            raise QueryBudgetExceeded(
+                f"{self.name} ran {self.count} queries, over its budget of {self.budget}."
+            )
+
+
+@contextmanager
+def profile(name):
+    """Record the queries run within the block, in this context and threads it hands work to."""
+    query_profile = QueryProfile(name)
+    token = _current.set(query_profile)
+    try:
+        yield query_profile
+    finally:
+        _current.reset(token)
+        query_profile.finish()
+
+
+@contextmanager
+def profiled(name):
+    """Profile the block and report it, if the profiler is enabled."""
+    if not settings.CHAT_PROFILER:
+        yield None
+        return
+    with profile(name) as query_profile:
+        yield query_profile
+    query_profile.report()
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding statements to the current profile, if any."""
+    query_profile = _current.get()
+    if query_profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        query_profile.add(sql, params, time.perf_counter() - start)
+
+
+def install(connection):
+    """Add the profiler to a database connection, once."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def install_on_new_connection(sender, connection, **kwargs):
+    """Add the profiler to every new database connection.
+
+    Outside a profile the wrapper only looks up the context variable, so it
+    is installed even while the profiler is disabled.
+    """
+    install(connection)
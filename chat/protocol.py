@@ -0,0 +1,96 @@
+from datetime import datetime
+
+from . import encoding
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# WebSocket subprotocols in order of server preference. Clients that offer
+# none of them are served the legacy JSON frames without a subprotocol.
+MSGPACK = 'chat.v1.msgpack'
+COMPACT = 'chat.v1.compact'
+JSON = 'chat.v1.json'
+PROTOCOLS = (MSGPACK, COMPACT, JSON) if msgpack is not None else (COMPACT, JSON)
+
+# Compact protocols shorten the keys of chat messages and send timestamps as
+# milliseconds since the epoch. Other frames keep their keys.
+COMPACT_KEYS = {
+    'id': 'i',
+    'sender': 's',
+    'message': 'm',
+    'timestamp': 't',
+    'image_url': 'u',
+}
+EXPANDED_KEYS = {short: key for key, short in COMPACT_KEYS.items()}
+
+
+def negotiate(offered):
+    """Return the preferred subprotocol among those offered by the client, or None."""
+    for name in PROTOCOLS:
+        if name in offered:
+            return name
+    return None
+
+
+def compact_message(message):
+    """Return a chat message with short keys, without empty fields."""
+    compact = {}
+    for key, value in message.items():
+        if value is None:
+            continue
+        if key == 'timestamp':
+            value = int(datetime.fromisoformat(value).timestamp() * 1000)
+        compact[COMPACT_KEYS.get(key, key)] = value
+    return compact
+
+
+def expand_message(data):
+    """Return an incoming frame with compact keys replaced by their full names."""
+    return {EXPANDED_KEYS.get(key, key): value for key, value in data.items()}
+
+
+def encode_message(message):
+    """Encode a chat message once for every protocol, for use in a group event."""
+    compact = compact_message(message)
+    frames = {'text': encoding.dumps(message), 'compact': encoding.dumps(compact)}
+    if msgpack is not None:
+        frames['bytes'] = msgpack.packb(compact)
+    return frames
+
+
+def encode_control(frame):
+    """Encode a control frame (error, presence) for every protocol, for use in a group event."""
+    frames = {'text': encoding.dumps(frame)}
+    if msgpack is not None:
+        frames['bytes'] = msgpack.packb(frame)
+    return frames
+
+
+def encode_for(protocol, frame):
+    """Return the send() arguments delivering a control frame to a single client."""
+    if protocol == MSGPACK:
+        return {'bytes_data': msgpack.packb(frame)}
+    return {'text_data': encoding.dumps(frame)}
+
+
+def select_frame(protocol, frames):
+    """Return the send() arguments delivering pre-encoded frames to a client of the given protocol."""
+    if protocol == MSGPACK and 'bytes' in frames:
+        return {'bytes_data': frames['bytes']}
+    if protocol in (MSGPACK, COMPACT) and 'compact' in frames:
+        return {'text_data': frames['compact']}
+    return {'text_data': frames['text']}
+
+
+def decode(protocol, text_data=None, bytes_data=None):
+    """Decode an incoming JSON text frame, or a MessagePack binary frame, into a message dict."""
+    if bytes_data is not None:
+        data = msgpack.unpackb(bytes_data)
+    else:
+        data = encoding.loads(text_data)
+    if protocol in (MSGPACK, COMPACT):
+        data = expand_message(data)
+    return data
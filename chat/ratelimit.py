@@ -0,0 +1,125 @@
+import math
+import time
+from collections import Counter, deque
+from django.conf import settings
+
+from . import metrics
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `burst` tokens."""
+
+    def __init__(self, rate, burst):
+        """Create a full bucket."""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount, now):
+        """Return how long to wait until `amount` tokens are available (0 if they are)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if amount <= self.tokens:
+            return 0
+        if amount > self.burst or self.rate <= 0:
+            return math.inf
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        """Remove tokens after wait_time() reported them as available."""
+        self.tokens -= amount
+
+
+class ConnectionLimits:
+    """Message and byte budgets of one WebSocket connection and its user."""
+
+    def __init__(self, user_limits):
+        """Create full budgets for a new connection sharing `user_limits` with the user's other sockets."""
+        self.user_limits = user_limits
+        self.buckets = {
+            'messages': TokenBucket(settings.CHAT_RATE_MESSAGES, settings.CHAT_RATE_MESSAGE_BURST),
+            'bytes': TokenBucket(settings.CHAT_RATE_BYTES, settings.CHAT_RATE_BYTE_BURST),
+        }
+        self.violations = deque()
+
+    def check(self, size, message=True):
+        """Charge a frame to the connection and user budgets.
+
+        Returns None if the frame is allowed, or a (scope, budget, retry_after)
+        tuple describing the first budget it exceeds; nothing is charged then.
+        """
+        now = time.monotonic()
+        costs = {'messages': 1 if message else 0, 'bytes': size}
+        for scope, buckets in (('connection', self.buckets), ('user', self.user_limits.buckets)):
+            for budget, amount in costs.items():
+                retry_after = buckets[budget].wait_time(amount, now)
+                if retry_after:
+                    self.violations.append(now)
+                    return scope, budget, retry_after
+        for buckets in (self.buckets, self.user_limits.buckets):
+            for budget, amount in costs.items():
+                buckets[budget].take(amount)
+        return None
+
+    def is_abusive(self):
+        """Return True once the connection kept exceeding its budgets within the violation window."""
+        window_start = time.monotonic() - settings.CHAT_RATE_VIOLATION_WINDOW
+        while self.violations and self.violations[0] < window_start:
+            self.violations.popleft()
+        return len(self.violations) > settings.CHAT_RATE_MAX_VIOLATIONS
+
+
+class UserLimits:
+    """Budgets shared by all connections of one user in this process."""
+
+    def __init__(self):
+        """Create full budgets for a user."""
+        self.buckets = {
+            'messages': TokenBucket(settings.CHAT_RATE_USER_MESSAGES, settings.CHAT_RATE_USER_MESSAGE_BURST),
+            'bytes': TokenBucket(settings.CHAT_RATE_USER_BYTES, settings.CHAT_RATE_USER_BYTE_BURST),
+        }
+        self.connections = 0
+
+
+class RateLimiter:
+    """Hands out connection budgets and counts limiter hits for metrics.
+
+    Per-user budgets are shared by the sockets a user has open in this
+    process; they are dropped when the user's last socket closes.
+    """
+
+    def __init__(self):
+        """Create a limiter without users."""
+        self._users = {}
+        self.hits = Counter()
+        self.disconnects = 0
+
+    def open(self, user_id):
+        """Return the budgets of a new connection of a user."""
+        user_limits = self._users.get(user_id)
+        if user_limits is None:
+            user_limits = self._users[user_id] = UserLimits()
+        user_limits.connections += 1
+        return ConnectionLimits(user_limits)
+
+    def close(self, user_id):
+        """Release the budgets of a closed connection of a user."""
+        user_limits = self._users.get(user_id)
+        if user_limits is not None:
+            user_limits.connections -= 1
+            if user_limits.connections <= 0:
+                del self._users[user_id]
+
+    def record_hit(self, scope, budget):
+        """Count a frame rejected by a budget."""
+        self.hits[(scope, budget)] += 1
+        metrics.rate_limit_hits.inc(scope=scope, budget=budget)
+
+    def record_disconnect(self):
+        """Count a connection closed for exceeding its budgets."""
+        self.disconnects += 1
+        metrics.rate_limit_disconnects.inc()
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,115 @@
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Room
+from .routers import primary_reads
+
+
+# Cache entries are validated against version tokens: one per user (membership
+# and favourites), one per room (settings, guests and activity) and one shared
+# by all users for the set of public rooms. Changing a token invalidates every
+# entry that was built with the previous one.
+PUBLIC_VERSION_KEY = 'chat:rooms:public'
+
+
+def _user_key(user_id):
+    return f'chat:rooms:user:{user_id}'
+
+
+def _room_key(room_id):
+    return f'chat:rooms:room:{room_id}'
+
+
+def _index_key(user_id):
+    return f'chat:rooms:index:{user_id}'
+
+
+def _bump(keys):
+    """Give the version keys new tokens once the current transaction commits."""
+    keys = list(keys)
+    if keys:
+        transaction.on_commit(lambda: cache.set_many({key: uuid4().hex for key in keys}, None))
+
+
+def user_changed(*user_ids):
+    """Invalidate the room index of the given users."""
+    _bump(_user_key(user_id) for user_id in user_ids)
+
+
+def rooms_changed(*room_ids):
+    """Invalidate every room index that contains one of the given rooms."""
+    _bump(_room_key(room_id) for room_id in room_ids)
+
+
+def public_rooms_changed():
+    """Invalidate every room index, as the set of public rooms changed."""
+    _bump([PUBLIC_VERSION_KEY])
+
+
+def build_room_index(user):
+    """Return the owned, joined and public rooms of a user, fetched with a single query."""
+    is_guest = Room.guests.through.objects.filter(room_id=OuterRef('pk'), user_id=user.pk)
+    is_favourite = Room.favorited_by.through.objects.filter(room_id=OuterRef('pk'), user_id=user.pk)
+    guest_count = Room.guests.through.objects.filter(
+        room_id=OuterRef('pk')
+    ).order_by().values('room_id').annotate(total=Count('pk')).values('total')
+
+    rooms = Room.objects.filter(
+        Q(owner=user) | Q(Exists(is_guest)) | Q(is_publicly_visible=True)
+    ).annotate(
+        is_guest=Exists(is_guest),
+        is_favourite=Exists(is_favourite),
+        participant_count=Coalesce(Subquery(guest_count), 0) + 1,
+    ).order_by('-is_favourite', F('last_message_at').desc(nulls_last=True), '-created_at')
+
+    index = {'my_rooms': [], 'joined_rooms': [], 'public_rooms': []}
+    with primary_reads():
+        rooms = list(rooms)
+    for room in rooms:
+        if room.owner_id == user.pk:
+            index['my_rooms'].append(room)
+        elif room.is_guest:
+            index['joined_rooms'].append(room)
+        else:
+            index['public_rooms'].append(room)
+    return index
+
+
+def get_room_index(user):
+    """Return the room index of a user from the cache, rebuilding it if it is stale."""
+    user_key = _user_key(user.pk)
+    versions = cache.get_many([user_key, PUBLIC_VERSION_KEY])
+    entry = cache.get(_index_key(user.pk))
+
+    if entry is not None and entry['versions'] == versions and len(versions) == 2:
+        room_keys = [_room_key(room_id) for room_id in entry['room_versions']]
+        if cache.get_many(room_keys) == {
+            _room_key(room_id): version for room_id, version in entry['room_versions'].items()
+        }:
+            return entry['index']
+
+    # Missing tokens are created before the query, so changes made while the
+    # index is being built replace them and invalidate the new entry
+    missing = {key: uuid4().hex for key in (user_key, PUBLIC_VERSION_KEY) if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+
+    index = build_room_index(user)
+    room_ids = [room.pk for rooms in index.values() for room in rooms]
+    room_versions = cache.get_many([_room_key(room_id) for room_id in room_ids])
+    missing = {_room_key(room_id): uuid4().hex for room_id in room_ids if _room_key(room_id) not in room_versions}
+    if missing:
+        cache.set_many(missing, None)
+        room_versions.update(missing)
+
+    cache.set(_index_key(user.pk), {
+        'versions': versions,
+        'room_versions': {room_id: room_versions[_room_key(room_id)] for room_id in room_ids},
+        'index': index,
+    }, settings.CHAT_ROOM_INDEX_CACHE_TTL)
+    return index
@@ -0,0 +1,121 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+
+# Reads go to a replica only within replica_reads(), which the room page and
+# media views use; every other query and all writes use the primary. Reads
+# that fill a shared cache (room indexes, room members) run in primary_reads()
+# so that replication lag is never cached past it. A user who wrote is pinned to the primary for
+# CHAT_REPLICA_STICKY_SECONDS through a cache key, so pages loaded right after
+# posting, joining or leaving do not miss changes the replicas have not yet
+# received. Context variables are copied into sync_to_async threads, so the
+# state is shared with the database thread of async code.
+_state = ContextVar('chat_db_routing', default=None)
+
+
+class RoutingState:
+    """Routing of the database queries of one request or WebSocket frame."""
+
+    def __init__(self):
+        """Create a state reading from the primary."""
+        self.user_id = None
+        self.replicas = False
+        self.wrote = False
+        self.sticky = None
+
+
+@contextmanager
+def routing():
+    """Track the writes of the block in a fresh routing state."""
+    state = RoutingState()
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def replica_reads(user_id):
+    """Send the reads of the block to a replica, unless the user recently wrote."""
+    state = _state.get()
+    token = None
+    if state is None:
+        state = RoutingState()
+        token = _state.set(state)
+    previous = state.user_id, state.replicas, state.sticky
+    if user_id != state.user_id:
+        state.sticky = None
+    state.user_id, state.replicas = user_id, True
+    try:
+        yield state
+    finally:
+        state.user_id, state.replicas, state.sticky = previous
+        if token is not None:
+            _state.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Send the reads of the block to the primary, even within replica_reads()."""
+    outer = _state.get()
+    state = RoutingState()
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+        if outer is not None and state.wrote:
+            outer.wrote = True
+
+
+def _sticky_key(user_id):
+    return f'chat:primary:{user_id}'
+
+
+def pin_primary(user_id):
+    """Keep the reads of a user on the primary for CHAT_REPLICA_STICKY_SECONDS."""
+    if settings.CHAT_DATABASE_REPLICAS:
+        cache.set(_sticky_key(user_id), 1, settings.CHAT_REPLICA_STICKY_SECONDS)
+
+
+async def apin_primary(user_id):
+    """Async version of pin_primary."""
+    if settings.CHAT_DATABASE_REPLICAS:
+        await cache.aset(_sticky_key(user_id), 1, settings.CHAT_REPLICA_STICKY_SECONDS)
+
+
+class ReplicaRouter:
+    """Sends replica_reads() reads to CHAT_DATABASE_REPLICAS and everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replicas or state.wrote or not settings.CHAT_DATABASE_REPLICAS:
+            return DEFAULT_DB_ALIAS
+        if state.sticky is None:
+            state.sticky = state.user_id is not None and cache.get(_sticky_key(state.user_id)) is not None
+        if state.sticky:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.CHAT_DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.CHAT_DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema from the primary
+        if db in settings.CHAT_DATABASE_REPLICAS:
+            return False
+        return None
@@ -0,0 +1,187 @@
+import re
+from django.db import NotSupportedError, connection
+
+from .models import Message
+
+
+# SQLite keeps an external-content FTS5 table in sync with chat_message through
+# triggers. PostgreSQL stores a generated tsvector column with a GIN index. In
+# both cases the database updates the index itself, so bulk inserts made by the
+# write-behind buffer and cascading deletes are covered as well. On SQLite a
+# migration that rebuilds chat_message drops the triggers, so it has to
+# install the index again.
+SQLITE_INSTALL = [
+    """CREATE VIRTUAL TABLE chat_message_fts USING fts5(
+        content, content='chat_message', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER chat_message_fts_insert AFTER INSERT ON chat_message
+    WHEN new.content IS NOT NULL BEGIN
+        INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER chat_message_fts_delete AFTER DELETE ON chat_message
+    WHEN old.content IS NOT NULL BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER chat_message_fts_update AFTER UPDATE OF content ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content)
+            SELECT 'delete', old.id, old.content WHERE old.content IS NOT NULL;
+        INSERT INTO chat_message_fts(rowid, content)
+            SELECT new.id, new.content WHERE new.content IS NOT NULL;
+    END""",
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+]
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_update",
+    "DROP TRIGGER IF EXISTS chat_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_message_fts_insert",
+    "DROP TABLE IF EXISTS chat_message_fts",
+]
+SQLITE_REBUILD = [
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('optimize')",
+]
+
+POSTGRESQL_INSTALL = [
+    """ALTER TABLE chat_message ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED""",
+    "CREATE INDEX chat_msg_search_idx ON chat_message USING GIN (search_vector)",
+]
+POSTGRESQL_UNINSTALL = [
+    "DROP INDEX IF EXISTS chat_msg_search_idx",
+    "ALTER TABLE chat_message DROP COLUMN IF EXISTS search_vector",
+]
+POSTGRESQL_REBUILD = [
+    "REINDEX INDEX chat_msg_search_idx",
+]
+
+# Both queries return (id, score) pairs where a higher score is a better match
+SQLITE_QUERY = """
+    SELECT id, score FROM (
+        SELECT m.id AS id, -bm25(chat_message_fts) AS score, m.room_id AS room_id
+        FROM chat_message_fts JOIN chat_message m ON m.id = chat_message_fts.rowid
+        WHERE chat_message_fts MATCH %s
+    ) WHERE {where}
+    ORDER BY score DESC, id DESC
+    LIMIT %s
+"""
+POSTGRESQL_QUERY = """
+    SELECT id, score FROM (
+        SELECT m.id AS id, ts_rank_cd(m.search_vector, q.query)::float8 AS score, m.room_id AS room_id
+        FROM chat_message m, to_tsquery('simple', %s) AS q(query)
+        WHERE m.search_vector @@ q.query
+    ) AS matches WHERE {where}
+    ORDER BY score DESC, id DESC
+    LIMIT %s
+"""
+
+TERM_RE = re.compile(r'\w+')
+SEARCH_VENDORS = ('sqlite', 'postgresql')
+
+
+def _statements(vendor, sqlite, postgresql):
+    if vendor == 'sqlite':
+        return sqlite
+    if vendor == 'postgresql':
+        return postgresql
+    raise NotSupportedError(f"Message search is not available on {vendor}.")
+
+
+def install_search_index(schema_editor):
+    """Create the full-text index of message contents and fill it with existing messages."""
+    vendor = schema_editor.connection.vendor
+    if vendor not in SEARCH_VENDORS:
+        return
+    for sql in _statements(vendor, SQLITE_INSTALL, POSTGRESQL_INSTALL):
+        schema_editor.execute(sql)
+
+
+def uninstall_search_index(schema_editor):
+    """Drop the full-text index of message contents."""
+    vendor = schema_editor.connection.vendor
+    if vendor not in SEARCH_VENDORS:
+        return
+    for sql in _statements(vendor, SQLITE_UNINSTALL, POSTGRESQL_UNINSTALL):
+        schema_editor.execute(sql)
+
+
+def rebuild_search_index():
+    """Rebuild the full-text index from the messages table."""
+    with connection.cursor() as cursor:
+        for sql in _statements(connection.vendor, SQLITE_REBUILD, POSTGRESQL_REBUILD):
+            cursor.execute(sql)
+
+
+def parse_terms(query):
+    """Return the lower-cased words of a search query."""
+    return TERM_RE.findall(query.lower())
+
+
+def _match_expression(vendor, terms):
+    """Build a backend query matching all terms, the last one as a prefix."""
+    if vendor == 'sqlite':
+        return ' '.join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+    return ' & '.join([f"'{term}'" for term in terms[:-1]] + [f"'{terms[-1]}':*"])
+
+
+def encode_cursor(score, message_id):
+    """Return the cursor of the page following a result."""
+    return f'{score!r}:{message_id}'
+
+
+def parse_cursor(value):
+    """Turn a search cursor into a (score, id) position. Raises ValueError for invalid cursors."""
+    score, _, message_id = value.rpartition(':')
+    try:
+        return float(score), int(message_id)
+    except ValueError:
+        raise ValueError("Invalid search cursor.")
+
+
+def search_messages(query, room=None, user=None, after=None, limit=20):
+    """Return messages matching a query, best matches first, using keyset pagination.
+
+    The search is limited to one room, or to every room the user owns or has
+    joined. `after` is a position returned by parse_cursor. Returns a tuple of
+    the messages, each with a `search_score` attribute, and the cursor of the
+    next page or None.
+    """
+    if room is None and user is None:
+        raise ValueError("Search requires a room or a user.")
+    terms = parse_terms(query)
+    if not terms:
+        return [], None
+
+    vendor = connection.vendor
+    sql = _statements(vendor, SQLITE_QUERY, POSTGRESQL_QUERY)
+    where, params = [], [_match_expression(vendor, terms)]
+    if room is not None:
+        where.append('room_id = %s')
+        params.append(room.pk)
+    if user is not None:
+        where.append(
+            'room_id IN (SELECT id FROM chat_room WHERE owner_id = %s'
+            ' UNION SELECT room_id FROM chat_room_guests WHERE user_id = %s)'
+        )
+        params.extend([user.pk, user.pk])
+    if after is not None:
+        where.append('(score < %s OR (score = %s AND id < %s))')
+        params.extend([after[0], after[0], after[1]])
+    params.append(limit + 1)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(where=' AND '.join(where)), params)
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    found = Message.objects.select_related('sender').in_bulk([message_id for message_id, _ in rows])
+    messages = []
+    for message_id, score in rows:
+        message = found.get(message_id)
+        if message is not None:
+            message.search_score = score
+            messages.append(message)
+    if not has_more:
+        return messages, None
+    last_id, last_score = rows[-1]
+    return messages, encode_cursor(last_score, last_id)
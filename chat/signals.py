@@ -0,0 +1,120 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.db import transaction
+from django.contrib.auth.models import User
+from django.dispatch import receiver
+
+from . import archive, room_index
+from .activity import recompute_activity
+from .membership import membership_cache
+from .models import ArchiveSegment, Room, Message
+from .storage import release_blob
+
+
+@receiver(m2m_changed, sender=Room.guests.through)
+def invalidate_room_guests(sender, instance, action, reverse, pk_set, **kwargs):
+    """Drop cached membership and room indexes of rooms whose guest list changed."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        membership_cache.invalidate(instance.pk)
+        room_index.rooms_changed(instance.pk)
+        room_index.user_changed(*(pk_set or ()))
+    elif pk_set:
+        for room_id in pk_set:
+            membership_cache.invalidate(room_id)
+        room_index.rooms_changed(*pk_set)
+        room_index.user_changed(instance.pk)
+    else:
+        # A user's rooms were cleared without the room ids being reported
+        membership_cache.clear()
+        room_index.user_changed(instance.pk)
+        room_index.public_rooms_changed()
+
+
+@receiver(m2m_changed, sender=Room.favorited_by.through)
+def invalidate_room_favourites(sender, instance, action, reverse, pk_set, **kwargs):
+    """Drop the room indexes of users whose favourites changed."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        room_index.user_changed(instance.pk)
+    elif pk_set:
+        room_index.user_changed(*pk_set)
+    else:
+        room_index.rooms_changed(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Room)
+def invalidate_room(sender, instance, **kwargs):
+    """Drop cached membership of a room that was saved or deleted."""
+    membership_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Room)
+def invalidate_saved_room_index(sender, instance, created, **kwargs):
+    """Drop the room indexes affected by a created or updated room."""
+    room_index.user_changed(instance.owner_id)
+    room_index.rooms_changed(instance.pk)
+    # An update may have changed visibility, so it affects every user
+    if instance.is_publicly_visible or not created:
+        room_index.public_rooms_changed()
+
+
+@receiver(pre_delete, sender=Room)
+def invalidate_deleted_room_index(sender, instance, **kwargs):
+    """Drop the room indexes containing a room that is about to be deleted."""
+    room_index.rooms_changed(instance.pk)
+
+
+@receiver(post_delete, sender=Message)
+def release_message_image(sender, instance, **kwargs):
+    """Drop the deleted message's reference to its image blob."""
+    # Archived messages keep referencing their images
+    if instance.image and not archive.is_archiving():
+        release_blob(instance.image.name)
+
+
+@receiver(post_delete, sender=Message)
+def remove_message_activity(sender, instance, origin=None, **kwargs):
+    """Take a message deleted on its own out of its room's activity columns."""
+    # Messages deleted with their room need no update, and the archive and
+    # user deletion update every affected room at once
+    if origin is not instance:
+        return
+    Room.remove_messages(instance.room_id, [instance.pk])
+    room_index.rooms_changed(instance.room_id)
+
+
+@receiver(post_save, sender=Message)
+def invalidate_message_room_index(sender, instance, created, **kwargs):
+    """Drop the room indexes of the room that received a new message."""
+    if created:
+        room_index.rooms_changed(instance.room_id)
+
+
+@receiver(pre_delete, sender=User)
+def remove_archived_messages(sender, instance, **kwargs):
+    """Remove the archived messages of a user who is about to be deleted."""
+    archive.remove_sender(instance)
+    # Remembered for recompute_sender_rooms, as the messages are deleted next
+    instance._message_room_ids = list(
+        Room.objects.filter(messages__sender=instance).exclude(owner=instance).values_list('pk', flat=True).distinct()
+    )
+
+
+@receiver(post_delete, sender=User)
+def recompute_sender_rooms(sender, instance, **kwargs):
+    """Recompute the activity of the rooms a deleted user had written in with one update."""
+    room_ids = getattr(instance, '_message_room_ids', None)
+    if room_ids:
+        recompute_activity(Room.objects.filter(pk__in=room_ids), Message.objects.all())
+        room_index.rooms_changed(*room_ids)
+
+
+@receiver(post_delete, sender=ArchiveSegment)
+def release_archive_segment(sender, instance, **kwargs):
+    """Drop the image references of a deleted segment's messages and remove its file."""
+    for message in archive.iter_segment(instance):
+        if message.image:
+            release_blob(message.image.name)
+    transaction.on_commit(lambda: archive.delete_segment_file(instance))
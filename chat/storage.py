@@ -0,0 +1,88 @@
+import hashlib
+import os
+from pathlib import Path
+from uuid import uuid4
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+
+from .models import ImageBlob
+
+
+# Every reference change locks the blob row, so a blob can never be removed
+# from disk while another upload is taking a new reference to it. New files
+# are written once the blob row commits, so a rolled back insert leaves no
+# file behind.
+
+
+def blob_name(digest, ext):
+    """Return the hash-sharded storage name of an image with the given digest."""
+    return f'message_images/{digest[:2]}/{digest[2:4]}/{digest}.{ext}'
+
+
+def acquire_by_source(source_digest):
+    """Take a reference to an existing blob created from identical upload bytes.
+
+    Returns the blob's file name, or None if no such blob exists.
+    """
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(source_digest=source_digest).first()
+        if blob is None or not default_storage.exists(blob.name):
+            return None
+        ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        return blob.name
+
+
+def acquire_blob(data, ext, source_digest):
+    """Take a reference to the blob holding `data`, writing the file only if it is new.
+
+    Returns the blob's file name, suitable for assigning to Message.image.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    with transaction.atomic():
+        blob, _ = ImageBlob.objects.get_or_create(
+            digest=digest,
+            defaults={'source_digest': source_digest, 'name': blob_name(digest, ext), 'size': len(data)},
+        )
+        blob = ImageBlob.objects.select_for_update().get(pk=blob.pk)
+        if not default_storage.exists(blob.name):
+            transaction.on_commit(lambda: write_blob_file(blob.name, data))
+        ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        return blob.name
+
+
+def write_blob_file(name, data):
+    """Write the file of a blob unless it exists, never exposing a partial file."""
+    path = Path(settings.MEDIA_ROOT) / name
+    if path.exists():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f'.{path.name}.{uuid4().hex}')
+    try:
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def release_blob(name):
+    """Drop a reference to a blob and delete its files once nothing uses it."""
+    blob_id = ImageBlob.objects.filter(name=name).values_list('pk', flat=True).first()
+    if blob_id is None:
+        return
+    ImageBlob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    transaction.on_commit(lambda: collect_blob(blob_id))
+
+
+def collect_blob(blob_id):
+    """Delete an unreferenced blob together with its file and cached variants."""
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(pk=blob_id, ref_count=0).first()
+        if blob is None:
+            return
+        path = Path(settings.MEDIA_ROOT) / blob.name
+        for variant in path.parent.glob(f'{path.stem}.*.*'):
+            variant.unlink(missing_ok=True)
+        default_storage.delete(blob.name)
+        blob.delete()
@@ -0,0 +1,174 @@
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from pathlib import Path
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from chat.archive import archive_room, find_message, read_before
+from chat.history import get_page, parse_cursor
+from chat.imaging import store_image
+from chat.models import ArchiveSegment, ImageBlob, Room, Message
+from chat.tests.test_storage import make_png_bytes
+
+
+class TestMessageArchive(TestCase):
+    def setUp(self):
+        """Create a room with 30 old messages over two months and 5 recent ones."""
+        self.archive_root = tempfile.mkdtemp()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = self.settings(
+            CHAT_ARCHIVE_ROOT=self.archive_root, MEDIA_ROOT=self.media_root, CHAT_ARCHIVE_BLOCK_SIZE=4,
+        )
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='owner', password='pass')
+        self.room = Room.objects.create(owner=self.user, name='Archive Room')
+
+        start = datetime(2025, 1, 20, tzinfo=dt_timezone.utc)
+        for i in range(30):
+            message = Message.objects.create(room=self.room, sender=self.user, content=f'Old {i}')
+            Message.objects.filter(pk=message.pk).update(created_at=start + timedelta(days=i))
+        for i in range(5):
+            Message.objects.create(room=self.room, sender=self.user, content=f'New {i}')
+        self.cutoff = datetime(2025, 3, 1, tzinfo=dt_timezone.utc)
+
+    def tearDown(self):
+        """Remove the temporary archive and media directories."""
+        self.settings_override.disable()
+        shutil.rmtree(self.archive_root, ignore_errors=True)
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def archive(self):
+        archived = archive_room(self.room, self.cutoff, batch_size=7)
+        self.room.refresh_from_db()
+        return archived
+
+    def test_archive_moves_old_messages_into_monthly_segments(self):
+        """Test that old messages leave the table for one compressed segment per month."""
+        self.assertEqual(self.archive(), 30)
+
+        self.assertEqual(list(self.room.messages.values_list('content', flat=True).order_by('pk')),
+                         [f'New {i}' for i in range(5)])
+        self.assertEqual(self.room.message_count, 5)
+        self.assertEqual(self.room.last_message_id, self.room.messages.latest('created_at', 'pk').pk)
+        self.assertEqual(self.room.archived_through, datetime(2025, 2, 18, tzinfo=dt_timezone.utc))
+        segments = {segment.month.month: segment for segment in ArchiveSegment.objects.all()}
+        self.assertEqual({month: segment.message_count for month, segment in segments.items()}, {1: 12, 2: 18})
+        for segment in segments.values():
+            self.assertEqual((Path(self.archive_root) / segment.path).stat().st_size, segment.size)
+            self.assertTrue(all(block['count'] <= 4 for block in segment.blocks))
+        self.assertEqual(self.archive(), 0)
+
+    def test_archiving_every_message_clears_room_activity(self):
+        """Test that the activity columns describe only the messages left in the table."""
+        self.cutoff = datetime.now(dt_timezone.utc) + timedelta(days=1)
+        self.assertEqual(self.archive(), 35)
+        self.assertEqual(self.room.message_count, 0)
+        self.assertIsNone(self.room.last_message_id)
+        self.assertIsNone(self.room.last_message_at)
+        page, _ = get_page(self.room, limit=2)
+        self.assertEqual([message.content for message in page], ['New 3', 'New 4'])
+
+    def test_history_pages_continue_into_archive(self):
+        """Test that paging backwards past the table returns archived messages, and forwards back again."""
+        self.archive()
+        newest, has_more = get_page(self.room, limit=8)
+        self.assertTrue(has_more)
+        self.assertEqual([message.content for message in newest], [f'Old {i}' for i in range(27, 30)] + [f'New {i}' for i in range(5)])
+        self.assertTrue(newest[0].archived)
+
+        before = parse_cursor(self.room, str(newest[0].pk))
+        older, has_more = get_page(self.room, before=before, limit=30)
+        self.assertFalse(has_more)
+        self.assertEqual([message.content for message in older], [f'Old {i}' for i in range(27)])
+
+        after, has_more = get_page(self.room, after=(older[-2].created_at, older[-2].pk), limit=4)
+        self.assertTrue(has_more)
+        self.assertEqual([message.content for message in after], ['Old 26', 'Old 27', 'Old 28', 'Old 29'])
+        after, _ = get_page(self.room, after=(after[-1].created_at, after[-1].pk), limit=2)
+        self.assertEqual([message.content for message in after], ['New 0', 'New 1'])
+
+    def test_interrupted_append_is_truncated(self):
+        """Test that bytes left behind by an interrupted run are dropped before the next append."""
+        archive_room(self.room, datetime(2025, 1, 25, tzinfo=dt_timezone.utc))
+        segment = ArchiveSegment.objects.get()
+        with open(Path(self.archive_root) / segment.path, 'ab') as f:
+            f.write(b'partial block')
+
+        self.archive()
+        segment = ArchiveSegment.objects.get(month__month=1)
+        self.assertEqual((Path(self.archive_root) / segment.path).stat().st_size, segment.size)
+        self.assertEqual([message.content for message in read_before(self.room, None, 3)], ['Old 29', 'Old 28', 'Old 27'])
+
+    def test_archived_images_keep_references_and_are_served(self):
+        """Test that archiving keeps image blobs, which are served by the archive media view until the room is deleted."""
+        with self.captureOnCommitCallbacks(execute=True):
+            name = store_image(make_png_bytes())
+        message = Message.objects.create(room=self.room, sender=self.user, image=name)
+        Message.objects.filter(pk=message.pk).update(created_at=datetime(2025, 2, 25, tzinfo=dt_timezone.utc))
+        self.archive()
+
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+        archived = find_message(self.room, message.pk)
+        self.assertEqual(archived.image_url, reverse('archive-media', kwargs={'pk': self.room.pk, 'message_id': message.pk}))
+        self.client.login(username='owner', password='pass')
+        self.assertEqual(self.client.get(archived.image_url).status_code, 200)
+        self.assertEqual(self.client.get(reverse('protected-media', kwargs={'message_id': message.pk})).status_code, 404)
+        outsider = User.objects.create_user(username='outsider', password='pass')
+        self.client.force_login(outsider)
+        self.assertEqual(self.client.get(archived.image_url).status_code, 404)
+
+        segment_paths = [Path(self.archive_root) / segment.path for segment in ArchiveSegment.objects.all()]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(any(path.exists() for path in segment_paths))
+
+    def test_deleted_user_is_removed_from_archive(self):
+        """Test that deleting a user rewrites the segments holding their messages and releases their images."""
+        guest = User.objects.create_user(username='guest', password='pass')
+        self.room.guests.add(guest)
+        for created_at in (datetime(2025, 1, 21, 12, tzinfo=dt_timezone.utc), datetime(2025, 2, 2, tzinfo=dt_timezone.utc)):
+            message = Message.objects.create(room=self.room, sender=guest, content='Guest', image=store_image(make_png_bytes()))
+            Message.objects.filter(pk=message.pk).update(created_at=created_at)
+        self.archive()
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+        old_paths = {segment.month.month: Path(self.archive_root) / segment.path for segment in ArchiveSegment.objects.all()}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            guest.delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(any(path.exists() for path in old_paths.values()))
+        segments = {segment.month.month: segment for segment in ArchiveSegment.objects.all()}
+        self.assertEqual({month: segment.message_count for month, segment in segments.items()}, {1: 12, 2: 18})
+        page, _ = get_page(self.room, limit=35)
+        self.assertEqual([message.content for message in page], [f'Old {i}' for i in range(30)] + [f'New {i}' for i in range(5)])
+
+    def test_room_detail_shows_archived_messages(self):
+        """Test that the room page fills its first page from the archive when few messages are left."""
+        self.archive()
+        self.client.login(username='owner', password='pass')
+        response = self.client.get(reverse('room', kwargs={'pk': self.room.pk}))
+        self.assertContains(response, 'Old 29')
+        self.assertTrue(response.context['has_older_messages'])
+
+    def test_command_uses_room_retention(self):
+        """Test that the command archives by each room's horizon and reports in dry-run mode without changes."""
+        other = Room.objects.create(owner=self.user, name='Kept Room')
+        Message.objects.create(room=other, sender=self.user, content='Kept')
+        Message.objects.filter(room=other).update(created_at=datetime(2020, 1, 1, tzinfo=dt_timezone.utc))
+        Room.objects.filter(pk=self.room.pk).update(retention_days=30)
+
+        out = StringIO()
+        with self.settings(CHAT_RETENTION_DAYS=0):
+            call_command('archive_messages', dry_run=True, stdout=out)
+            self.assertIn("Would archive 30 messages.", out.getvalue())
+            self.assertEqual(Message.objects.count(), 36)
+            call_command('archive_messages', stdout=out)
+
+        self.assertIn("Archived 30 messages.", out.getvalue())
+        self.assertEqual(Message.objects.count(), 6)
+        self.assertTrue(other.messages.exists())
@@ -0,0 +1,197 @@
+import json
+import shutil
+import tempfile
+from io import StringIO
+from django.core.management import CommandError, call_command
+from unittest import skipUnless
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.contrib.auth.models import User
+
+from chat.models import Room, Message, ImageBlob
+from chat.search import search_messages
+
+
+class TestBackfillRoomActivityCommand(TestCase):
+    def test_backfill_recomputes_activity(self):
+        """Test that the command restores activity columns from the messages table."""
+        user = User.objects.create_user(username="owner", password="pw")
+        busy = Room.objects.create(owner=user, name="Busy Room")
+        empty = Room.objects.create(owner=user, name="Empty Room")
+        Message.objects.create(room=busy, sender=user, content="one")
+        last = Message.objects.create(room=busy, sender=user, content="two")
+        Room.objects.update(message_count=0, last_message_at=None, last_message_id=None)
+
+        out = StringIO()
+        call_command('backfill_room_activity', batch_size=1, stdout=out)
+
+        busy.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual(busy.message_count, 2)
+        self.assertEqual(busy.last_message_id, last.pk)
+        self.assertEqual(busy.last_message_at, last.created_at)
+        self.assertEqual(empty.message_count, 0)
+        self.assertIsNone(empty.last_message_at)
+        self.assertIn("Updated activity of 2 rooms", out.getvalue())
+
+
+@skipUnless(connection.vendor == 'sqlite', "Empties the SQLite FTS5 table directly.")
+class TestRebuildMessageSearchCommand(TestCase):
+    def test_rebuild_indexes_existing_messages(self):
+        """Test that the command makes messages searchable after the index was emptied."""
+        user = User.objects.create_user(username="owner", password="pw")
+        room = Room.objects.create(owner=user, name="Room")
+        message = Message.objects.create(room=room, sender=user, content="needle")
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO chat_message_fts(chat_message_fts) VALUES ('delete-all')")
+        self.assertEqual(search_messages("needle", room=room)[0], [])
+
+        out = StringIO()
+        call_command('rebuild_message_search', stdout=out)
+
+        self.assertEqual(search_messages("needle", room=room)[0], [message])
+        self.assertIn("Rebuilt the message search index", out.getvalue())
+
+
+class TestBenchmarkConsumerCommand(TransactionTestCase):
+    def test_benchmark_reports_every_mode_and_cleans_up(self):
+        """Test that the benchmark reports throughput per mode and removes its rooms and messages."""
+        out = StringIO()
+        call_command('benchmark_consumer', rooms=2, messages=2, mode=['sync', 'async', 'consumer'], stdout=out)
+
+        for mode in ('sync', 'async', 'consumer'):
+            self.assertIn(f"{mode}: 4 messages in", out.getvalue())
+        self.assertFalse(Room.objects.exists())
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+
+class TestBenchmarkBroadcastCommand(TestCase):
+    def test_benchmark_reports_each_room_size(self):
+        """Test that the benchmark prints a row per room size and encoding strategy."""
+        out = StringIO()
+        call_command('benchmark_broadcast', sizes=[1, 50], repeat=2, stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertIn("us/broadcast", lines[0])
+        self.assertTrue(any(line.split()[:3] == ['50', 'per', 'recipient'] for line in lines))
+        self.assertTrue(any(line.split()[:3] == ['50', 'once', 'json'] for line in lines))
+
+
+class TestLoadtestChatCommand(TransactionTestCase):
+    def test_loadtest_reports_latency_throughput_and_writes(self):
+        """Test that the load test delivers its messages in-process, reports them and cleans up."""
+        out = StringIO()
+        call_command('loadtest_chat', clients=4, rooms=2, rate=20, duration=0.3, drain=0.5, json=True, stdout=out)
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['connected'], 4)
+        self.assertGreater(report['sent'], 0)
+        # Every message reaches both clients of its room
+        self.assertEqual(report['delivered'], 2 * report['sent'])
+        self.assertEqual(report['db_writes'], report['sent'])
+        self.assertIsNotNone(report['latency_ms']['p99'])
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Room.objects.exists())
+
+    def test_url_mode_requires_websockets_package(self):
+        """Test that targeting a URL without the websockets package fails with a clear error."""
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            with self.assertRaisesMessage(CommandError, "websockets"):
+                call_command('loadtest_chat', url='ws://127.0.0.1:1', stdout=StringIO())
+        else:
+            self.skipTest("websockets is installed.")
+
+
+class TestBenchmarkViewsCommand(TestCase):
+    def test_benchmark_reports_json_and_rolls_back_datasets(self):
+        """Test that the view benchmark emits JSON results per view and size and leaves no data behind."""
+        out = StringIO()
+        call_command('benchmark_views', sizes=[3, 6], messages=2, repeat=2, label='test', stdout=out)
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['label'], 'test')
+        self.assertEqual(report['breaches'], [])
+        self.assertEqual(
+            {(result['view'], result['cached'], result['size']) for result in report['results']},
+            {(view, cached, size)
+             for view, cached in (('home', False), ('home', True), ('room', False), ('protected-media', False))
+             for size in (3, 6)},
+        )
+        self.assertTrue(all(result['queries'] > 0 and result['p95'] is not None for result in report['results']))
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Message.objects.exists())
+
+    def test_exceeded_budget_fails(self):
+        """Test whether a query budget below the measured count makes the command fail."""
+        with self.settings(CHAT_QUERY_BUDGETS={'room': {'queries': 1}}):
+            with self.assertRaisesMessage(CommandError, "1 view budget(s) exceeded"):
+                call_command('benchmark_views', sizes=[3], messages=1, repeat=1, stdout=StringIO(), stderr=StringIO())
+
+
+class TestSeedChatCommand(TestCase):
+    def setUp(self):
+        """Use a temporary MEDIA_ROOT for the generated images."""
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        """Remove the temporary MEDIA_ROOT."""
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def seed(self, prefix, seed=1):
+        """Generate a small dataset and return the printed report."""
+        out = StringIO()
+        call_command(
+            'seed_chat', users=30, rooms=8, messages=400, images=2, image_fraction=0.1,
+            seed=seed, prefix=prefix, batch_size=64, stdout=out,
+        )
+        return out.getvalue()
+
+    def messages(self, prefix):
+        """Return the contents of the dataset's messages in creation order."""
+        return list(
+            Message.objects.filter(sender__username__startswith=f'{prefix}-')
+            .order_by('pk').values_list('content', 'image', 'created_at')
+        )
+
+    def test_seed_creates_dataset_and_reports_throughput(self):
+        """Test that the dataset has the requested size, ordered timestamps and consistent activity columns."""
+        report = self.seed('a')
+
+        self.assertIn("rows/s", report)
+        self.assertEqual(User.objects.filter(username__startswith='a-').count(), 30)
+        self.assertEqual(Room.objects.count(), 8)
+        messages = self.messages('a')
+        self.assertEqual(len(messages), 400)
+        self.assertEqual([created_at for _, _, created_at in messages], sorted(created_at for _, _, created_at in messages))
+        image_names = [image for _, image, _ in messages if image]
+        self.assertTrue(image_names)
+        for blob in ImageBlob.objects.all():
+            self.assertEqual(blob.ref_count, image_names.count(blob.name))
+        for room in Room.objects.all():
+            self.assertEqual(room.message_count, room.messages.count())
+
+    def test_equal_seeds_generate_equal_datasets(self):
+        """Test whether the same seed produces the same messages and a different seed different ones."""
+        self.seed('a')
+        self.seed('b')
+        self.seed('c', seed=2)
+
+        contents = {prefix: [content for content, _, _ in self.messages(prefix)] for prefix in 'abc'}
+        self.assertEqual(contents['a'], contents['b'])
+        self.assertNotEqual(contents['a'], contents['c'])
+        # Datasets sharing images share their blobs, which count every use
+        images = list(Message.objects.exclude(image='').values_list('image', flat=True))
+        for blob in ImageBlob.objects.all():
+            self.assertEqual(blob.ref_count, images.count(blob.name))
+
+    def test_existing_prefix_is_rejected(self):
+        """Test that seeding twice with one prefix fails instead of mixing datasets."""
+        User.objects.create(username='a-0')
+        with self.assertRaisesMessage(CommandError, "already exist"):
+            self.seed('a')
@@ -3,17 +3,29 @@ import base64
 import tempfile
 import os
 import asyncio
+from io import BytesIO
+from unittest import skipUnless
+from PIL import Image
 from django.test import TransactionTestCase
 from django.contrib.auth.models import User
 from django.urls import path, reverse
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
+from channels.layers import get_channel_layer
 from channels.testing import WebsocketCommunicator
 
+from chat import protocol
 from chat.consumers import ChatConsumer
 from chat.models import Room, Message
 
 
+def make_png_bytes(size=(4, 4)):
+    """Return the bytes of a small valid PNG image."""
+    buffer = BytesIO()
+    Image.new("RGB", size, color="red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
 # Reusable ASGI application for WebSocket tests
 application = ProtocolTypeRouter({
     "websocket": AuthMiddlewareStack(
@@ -96,7 +108,7 @@ class TestChatConsumer(TransactionTestCase):
             user = User.objects.create_user(username="imguser", password="pwdimg")
             room = Room.objects.create(owner=user, name="Image Room")
 
-            raw = b"imagebytes"
+            raw = make_png_bytes()
             encoded = base64.b64encode(raw).decode()
             image_data = f"data:image/png;base64,{encoded}"
 
@@ -125,6 +137,153 @@ class TestChatConsumer(TransactionTestCase):
 
             self.run_async(inner())
 
+    def test_write_behind_broadcasts_provisional_id_and_flushes(self):
+        """Test that in write-behind mode a text message is broadcast first and inserted on flush with the broadcast time."""
+        user = User.objects.create_user(username="wbuser", password="pw")
+        room = Room.objects.create(owner=user, name="Write Behind Room")
+
+        from chat.persistence import message_buffer
+
+        async def inner():
+            communicator = WebsocketCommunicator(
+                self.application, f"/ws/chat/{room.id}/"
+            )
+            communicator.scope["user"] = user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            await communicator.send_json_to({"message": "Buffered hello"})
+            response = await communicator.receive_json_from()
+            self.assertEqual(response["message"], "Buffered hello")
+            self.assertTrue(str(response["id"]).startswith("p"))
+            self.timestamp = response["timestamp"]
+
+            await message_buffer.flush()
+            await communicator.disconnect()
+
+        with self.settings(CHAT_WRITE_BEHIND=True):
+            self.run_async(inner())
+        message = Message.objects.get(room=room)
+        self.assertEqual(message.content, "Buffered hello")
+        self.assertEqual(message.created_at.isoformat(), self.timestamp)
+
+    def test_direct_insert_flushes_buffered_messages_first(self):
+        """Test that an image message sent after buffered text is stored after it."""
+        temp_media = tempfile.mkdtemp()
+        user = User.objects.create_user(username="wbimage", password="pw")
+        room = Room.objects.create(owner=user, name="Write Behind Room")
+        image_data = f"data:image/png;base64,{base64.b64encode(make_png_bytes()).decode()}"
+
+        async def inner():
+            communicator = WebsocketCommunicator(
+                self.application, f"/ws/chat/{room.id}/"
+            )
+            communicator.scope["user"] = user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            await communicator.send_json_to({"message": "Buffered first"})
+            await communicator.receive_json_from()
+            await communicator.send_json_to({"image": image_data})
+            response = await communicator.receive_json_from()
+            self.assertIsInstance(response["id"], int)
+            await communicator.disconnect()
+
+        with self.settings(CHAT_WRITE_BEHIND=True, CHAT_WRITE_BEHIND_INTERVAL=60, MEDIA_ROOT=temp_media):
+            self.run_async(inner())
+        messages = list(Message.objects.filter(room=room).order_by("id"))
+        self.assertEqual(messages[0].content, "Buffered first")
+        self.assertTrue(messages[1].image)
+        self.assertLess(messages[0].created_at, messages[1].created_at)
+
+    def test_receive_binary_image_upload_creates_file_and_broadcast(self):
+        """Test that an upload header followed by binary chunks saves the image and broadcasts an image URL."""
+        temp_media = tempfile.mkdtemp()
+        with self.settings(MEDIA_ROOT=temp_media):
+            user = User.objects.create_user(username="binuser", password="pwdbin")
+            room = Room.objects.create(owner=user, name="Binary Room")
+            raw = make_png_bytes((32, 32))
+
+            from channels.db import database_sync_to_async
+
+            async def inner():
+                communicator = WebsocketCommunicator(
+                    self.application, f"/ws/chat/{room.id}/"
+                )
+                communicator.scope["user"] = user
+                connected, _ = await communicator.connect()
+                self.assertTrue(connected)
+
+                await communicator.send_json_to({
+                    "type": "upload",
+                    "message": "Caption",
+                    "content_type": "image/png",
+                    "size": len(raw),
+                })
+                await communicator.send_to(bytes_data=raw[:40])
+                await communicator.send_to(bytes_data=raw[40:])
+                response = await communicator.receive_json_from()
+                self.assertEqual(response["sender"], user.username)
+                self.assertEqual(response["message"], "Caption")
+                self.assertIn("image_url", response)
+
+                await communicator.disconnect()
+
+                msg = await database_sync_to_async(Message.objects.get)(room=room, sender=user)
+                file_path = os.path.join(temp_media, msg.image.name)
+                with Image.open(file_path) as img:
+                    self.assertEqual(img.size, (32, 32))
+
+            self.run_async(inner())
+
+    def test_binary_upload_exceeding_announced_size_is_rejected(self):
+        """Test that sending more bytes than announced returns an error frame and saves nothing."""
+        user = User.objects.create_user(username="overuser", password="pw")
+        room = Room.objects.create(owner=user, name="Overflow Room")
+
+        async def inner():
+            communicator = WebsocketCommunicator(
+                self.application, f"/ws/chat/{room.id}/"
+            )
+            communicator.scope["user"] = user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            await communicator.send_json_to({"type": "upload", "content_type": "image/png", "size": 4})
+            await communicator.send_to(bytes_data=b"too many bytes")
+            response = await communicator.receive_json_from()
+            self.assertEqual(response["type"], "error")
+            self.assertEqual(response["code"], "upload_rejected")
+
+            await communicator.disconnect()
+
+        self.run_async(inner())
+        self.assertFalse(Message.objects.filter(room=room).exists())
+
+    def test_invalid_image_is_rejected_with_error_frame(self):
+        """Test that data which is not a valid image returns an error frame and saves nothing."""
+        user = User.objects.create_user(username="badimguser", password="pw")
+        room = Room.objects.create(owner=user, name="Bad Image Room")
+        image_data = f"data:image/png;base64,{base64.b64encode(b'not an image').decode()}"
+
+        async def inner():
+            communicator = WebsocketCommunicator(
+                self.application, f"/ws/chat/{room.id}/"
+            )
+            communicator.scope["user"] = user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            await communicator.send_json_to({"message": "Look", "image": image_data})
+            response = await communicator.receive_json_from()
+            self.assertEqual(response["type"], "error")
+            self.assertEqual(response["code"], "image_rejected")
+
+            await communicator.disconnect()
+
+        self.run_async(inner())
+        self.assertFalse(Message.objects.filter(room=room).exists())
+
     def test_receive_empty_payload_no_action(self):
         """Test that empty payload does not save or broadcast any messages."""
         user = User.objects.create_user(username="emptyuser", password="pw")
@@ -147,8 +306,127 @@ class TestChatConsumer(TransactionTestCase):
         self.run_async(inner())
         self.assertFalse(Message.objects.filter(room=room).exists())
 
-    def test_anonymous_user_cannot_send(self):
-        """Test that anonymous users can connect but cannot send messages."""
+    def test_typing_and_presence_are_coalesced(self):
+        """Test that repeated typing notifications reach other members as a single presence frame."""
+        guest = User.objects.create_user(username="guest", password="pw")
+        room = Room.objects.create(owner=self.owner, name="Presence Room")
+        room.guests.add(guest)
+
+        async def inner():
+            owner_socket = WebsocketCommunicator(self.application, f"/ws/chat/{room.id}/")
+            owner_socket.scope["user"] = self.owner
+            guest_socket = WebsocketCommunicator(self.application, f"/ws/chat/{room.id}/")
+            guest_socket.scope["user"] = guest
+            self.assertTrue((await owner_socket.connect())[0])
+            self.assertTrue((await guest_socket.connect())[0])
+
+            for _ in range(5):
+                await guest_socket.send_json_to({"type": "typing"})
+            update = await owner_socket.receive_json_from(timeout=2)
+            self.assertEqual(update["type"], "presence")
+            self.assertEqual(update["joined"], ["guest", "owner"])
+            self.assertEqual(update["typing"], ["guest"])
+            self.assertTrue(await owner_socket.receive_nothing(timeout=1))
+
+            await owner_socket.send_json_to({"type": "presence"})
+            snapshot = await owner_socket.receive_json_from()
+            self.assertEqual(snapshot["online"], ["guest", "owner"])
+
+            await guest_socket.disconnect()
+            await owner_socket.disconnect()
+
+        self.run_async(inner())
+
+    def test_chat_message_event_is_sent_as_encoded(self):
+        """Test that chat_message sends the pre-encoded frame of the event without re-encoding it."""
+        room = Room.objects.create(owner=self.owner, name="Frame Room")
+
+        async def inner():
+            communicator = WebsocketCommunicator(self.application, f"/ws/chat/{room.id}/")
+            communicator.scope["user"] = self.owner
+            self.assertTrue((await communicator.connect())[0])
+
+            await get_channel_layer().group_send(f"chat_{room.id}", {'type': 'chat_message', 'text': '{"id":1}'})
+            self.assertEqual(await communicator.receive_from(), '{"id":1}')
+
+            await communicator.disconnect()
+
+        self.run_async(inner())
+
+    @skipUnless(protocol.msgpack, "msgpack is not installed.")
+    def test_subprotocols_receive_their_own_frames(self):
+        """Test that legacy, compact and MessagePack clients in one room each get their format."""
+        room = Room.objects.create(owner=self.owner, name="Protocol Room")
+
+        async def inner():
+            legacy = WebsocketCommunicator(self.application, f"/ws/chat/{room.id}/")
+            compact = WebsocketCommunicator(self.application, f"/ws/chat/{room.id}/", subprotocols=["chat.v1.compact"])
+            binary = WebsocketCommunicator(
+                self.application, f"/ws/chat/{room.id}/", subprotocols=["chat.v1.msgpack", "chat.v1.json"]
+            )
+            for communicator in (legacy, compact, binary):
+                communicator.scope["user"] = self.owner
+            self.assertEqual(await legacy.connect(), (True, None))
+            self.assertEqual(await compact.connect(), (True, "chat.v1.compact"))
+            self.assertEqual(await binary.connect(), (True, "chat.v1.msgpack"))
+
+            await binary.send_to(bytes_data=protocol.msgpack.packb({"m": "Hello"}))
+            self.assertEqual((await legacy.receive_json_from())["message"], "Hello")
+            self.assertEqual(set(await compact.receive_json_from()), {"i", "s", "m", "t"})
+            frame = protocol.msgpack.unpackb(await binary.receive_from())
+            self.assertEqual((frame["s"], frame["m"]), ("owner", "Hello"))
+
+            for communicator in (legacy, compact, binary):
+                await communicator.disconnect()
+
+        self.run_async(inner())
+        self.assertTrue(Message.objects.filter(room=room, content="Hello").exists())
+
+    def test_rate_limited_frames_get_error_and_abusers_are_closed(self):
+        """Test that frames over the budget are rejected with an error and sustained abuse closes the socket."""
+        room = Room.objects.create(owner=self.owner, name="Limited Room")
+
+        async def inner():
+            communicator = WebsocketCommunicator(self.application, f"/ws/chat/{room.id}/")
+            communicator.scope["user"] = self.owner
+            self.assertTrue((await communicator.connect())[0])
+
+            await communicator.send_json_to({"message": "first"})
+            self.assertEqual((await communicator.receive_json_from())["message"], "first")
+            await communicator.send_json_to({"message": "second"})
+            error = await communicator.receive_json_from()
+            self.assertEqual(error["code"], "rate_limited")
+            self.assertGreater(error["retry_after"], 0)
+
+            await communicator.send_json_to({"message": "third"})
+            self.assertEqual(await communicator.receive_output(), {"type": "websocket.close", "code": 1008})
+            await communicator.disconnect()
+
+        with self.settings(CHAT_RATE_MESSAGE_BURST=1, CHAT_RATE_MESSAGES=0.01, CHAT_RATE_MAX_VIOLATIONS=1):
+            self.run_async(inner())
+        self.assertEqual(list(Message.objects.filter(room=room).values_list("content", flat=True)), ["first"])
+
+    def test_byte_budget_counts_encoded_text(self):
+        """Test that text frames are charged by their UTF-8 size rather than their length in characters."""
+        room = Room.objects.create(owner=self.owner, name="Byte Room")
+
+        async def inner():
+            communicator = WebsocketCommunicator(self.application, f"/ws/chat/{room.id}/")
+            communicator.scope["user"] = self.owner
+            self.assertTrue((await communicator.connect())[0])
+
+            # 75 characters, but 135 bytes
+            await communicator.send_to(text_data=json.dumps({"message": "ż" * 60}, ensure_ascii=False))
+            error = await communicator.receive_json_from()
+            self.assertEqual(error["code"], "rate_limited")
+            await communicator.disconnect()
+
+        with self.settings(CHAT_RATE_BYTE_BURST=100, CHAT_RATE_BYTES=0):
+            self.run_async(inner())
+        self.assertFalse(Message.objects.filter(room=room).exists())
+
+    def test_anonymous_user_cannot_connect(self):
+        """Test that anonymous users are rejected at connect time."""
         room = Room.objects.create(owner=self.owner, name="Anon Room")
 
         async def inner():
@@ -156,13 +434,39 @@ class TestChatConsumer(TransactionTestCase):
                 self.application, f"/ws/chat/{room.id}/"
             )
             connected, _ = await communicator.connect()
-            self.assertTrue(connected)
+            self.assertFalse(connected)
 
-            await communicator.send_json_to({"message": "Hi"})
-            with self.assertRaises(Exception):
-                await communicator.receive_json_from(timeout=0.5)
+        self.run_async(inner())
+        self.assertFalse(Message.objects.exists())
+
+    def test_non_member_cannot_connect(self):
+        """Test that a user who neither owns nor is a guest of the room is rejected."""
+        room = Room.objects.create(owner=self.owner, name="Private Room")
+        outsider = User.objects.create_user(username="outsider", password="pw")
+
+        async def inner():
+            communicator = WebsocketCommunicator(
+                self.application, f"/ws/chat/{room.id}/"
+            )
+            communicator.scope["user"] = outsider
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+
+        self.run_async(inner())
+
+    def test_guest_can_connect(self):
+        """Test that a guest of the room is accepted."""
+        room = Room.objects.create(owner=self.owner, name="Guest Room")
+        guest = User.objects.create_user(username="guest", password="pw")
+        room.guests.add(guest)
 
+        async def inner():
+            communicator = WebsocketCommunicator(
+                self.application, f"/ws/chat/{room.id}/"
+            )
+            communicator.scope["user"] = guest
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
             await communicator.disconnect()
 
         self.run_async(inner())
-        self.assertFalse(Message.objects.exists())
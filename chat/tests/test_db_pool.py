@@ -0,0 +1,218 @@
+import threading
+from unittest import skipUnless
+import environ
+import psycopg2
+from psycopg2 import extensions
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+
+from chat import metrics
+from chat.db.postgresql_pool.base import DatabaseWrapper
+from chat.db.postgresql_pool.pool import ConnectionPool, PoolTimeout
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, sql):
+        if self.connection.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+
+class FakeConnection:
+    """Stand-in for a psycopg2 connection."""
+
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class TestConnectionPool(SimpleTestCase):
+    def setUp(self):
+        """Set up a pool of two connections opened by a counting factory."""
+        metrics.registry.clear()
+        self.opened = []
+        self.pool = ConnectionPool('test', max_size=2, timeout=0.05)
+
+    def connect(self):
+        connection = FakeConnection()
+        self.opened.append(connection)
+        return connection
+
+    def test_connections_are_reused(self):
+        """Test that returned connections are handed out again instead of opening new ones."""
+        connection = self.pool.getconn(self.connect)
+        self.pool.putconn(connection)
+        self.assertIs(self.pool.getconn(self.connect), connection)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_exhausted_pool_times_out(self):
+        """Test that requests beyond the pool size wait and then fail with PoolTimeout."""
+        self.pool.getconn(self.connect)
+        self.pool.getconn(self.connect)
+        with self.assertRaises(PoolTimeout):
+            self.pool.getconn(self.connect)
+        self.assertEqual(len(self.opened), 2)
+        values = metrics.registry.collect()
+        self.assertEqual(values['db_pool_timeouts_total'][('test',)], 1)
+        self.assertEqual(values['db_pool_connections'][('test', 'in_use')], 2)
+
+    def test_waiter_gets_returned_connection(self):
+        """Test that a waiting thread receives a connection returned by another thread."""
+        pool = ConnectionPool('test', max_size=1, timeout=5)
+        connection = pool.getconn(self.connect)
+        timer = threading.Timer(0.05, pool.putconn, [connection])
+        timer.start()
+        self.assertIs(pool.getconn(self.connect), connection)
+        timer.join()
+        self.assertGreater(metrics.registry.collect()['db_pool_wait_seconds'][('test',)]['sum'], 0.04)
+
+    def test_unfinished_transaction_is_rolled_back(self):
+        """Test that a connection returned inside a transaction is rolled back before reuse."""
+        connection = self.pool.getconn(self.connect)
+        connection.status = extensions.TRANSACTION_STATUS_INTRANS
+        self.pool.putconn(connection)
+        self.assertEqual(connection.rollbacks, 1)
+        self.assertEqual(self.pool.idle, 1)
+
+    def test_broken_connection_is_replaced(self):
+        """Test whether an idle connection failing its health check is replaced by a new one."""
+        pool = ConnectionPool('test', max_size=1, check_interval=0)
+        connection = pool.getconn(self.connect)
+        pool.putconn(connection)
+        connection.broken = True
+
+        replacement = pool.getconn(self.connect)
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size, 1)
+        self.assertEqual(metrics.registry.collect()['db_pool_discarded_total'][('test', 'broken')], 1)
+
+    def test_expired_connection_is_replaced(self):
+        """Test that connections past their lifetime are closed instead of reused."""
+        pool = ConnectionPool('test', max_size=1, max_lifetime=0)
+        connection = pool.getconn(self.connect)
+        pool.putconn(connection)
+        self.assertTrue(connection.closed)
+        self.assertIsNot(pool.getconn(self.connect), connection)
+
+    def test_failed_connect_frees_slot(self):
+        """Test that a connection attempt that fails does not use up the pool."""
+        def fail():
+            raise psycopg2.OperationalError("could not connect")
+
+        with self.assertRaises(psycopg2.OperationalError):
+            self.pool.getconn(fail)
+        self.assertEqual(self.pool.size, 0)
+
+    def test_close(self):
+        """Test that closing the pool closes idle connections and those returned later."""
+        idle = self.pool.getconn(self.connect)
+        in_use = self.pool.getconn(self.connect)
+        self.pool.putconn(idle)
+        self.pool.close()
+        self.assertTrue(idle.closed)
+        self.pool.putconn(in_use)
+        self.assertTrue(in_use.closed)
+        self.assertEqual(self.pool.size, 0)
+
+
+class TestPooledBackend(SimpleTestCase):
+    def wrapper(self, url, **settings):
+        settings_dict = {
+            'TIME_ZONE': None, 'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'AUTOCOMMIT': True,
+            'ATOMIC_REQUESTS': False, 'OPTIONS': {}, 'TEST': {},
+            **environ.Env.db_url_config(url), **settings,
+        }
+        return DatabaseWrapper(settings_dict, alias='pooled')
+
+    def test_url_scheme(self):
+        """Test that postgres-pool URLs select the pooled backend and keep the pool options."""
+        config = environ.Env.db_url_config('postgres-pool://user:pw@db:5432/chat?pool_max_size=20&pool_timeout=2.5')
+        self.assertEqual(config['ENGINE'], 'chat.db.postgresql_pool')
+        self.assertEqual(config['OPTIONS'], {'pool_max_size': 20, 'pool_timeout': '2.5'})
+
+    def test_pool_options_are_not_connection_parameters(self):
+        """Test that pool options configure the pool instead of being passed to psycopg2."""
+        wrapper = self.wrapper('postgres-pool://user:pw@db:5432/chat?pool_max_size=20&pool_timeout=2.5')
+        conn_params = wrapper.get_connection_params()
+        self.assertNotIn('pool_max_size', conn_params)
+        self.assertEqual(conn_params['dbname'], 'chat')
+
+        pool = wrapper.get_connection_pool(conn_params)
+        self.addCleanup(wrapper.close_pool)
+        self.assertEqual((pool.max_size, pool.timeout), (20, 2.5))
+        self.assertIs(wrapper.get_connection_pool(conn_params), pool)
+        self.assertIsNot(wrapper.get_connection_pool({**conn_params, 'dbname': 'test_chat'}), pool)
+
+    def test_persistent_connections_are_rejected(self):
+        """Test that pooling refuses a non-zero CONN_MAX_AGE."""
+        wrapper = self.wrapper('postgres-pool://user:pw@db:5432/chat', CONN_MAX_AGE=60)
+        with self.assertRaises(ImproperlyConfigured):
+            wrapper.get_connection_pool(wrapper.get_connection_params())
+
+
+@skipUnless(isinstance(connection, DatabaseWrapper), "Requires the pooled PostgreSQL backend.")
+class TestPooledPostgresql(TestCase):
+    def setUp(self):
+        """Set up a second connection to the test database, outside the test transaction."""
+        self.other = connection.copy()
+        self.addCleanup(self.other.close)
+
+    def test_reused_connection_is_initialized(self):
+        """Test that a reused connection gets its session state reset by init_connection_state."""
+        self.other.ensure_connection()
+        raw = self.other.connection
+        with self.other.cursor() as cursor:
+            cursor.execute("SET TIME ZONE 'America/New_York'")
+        self.other.close()
+        self.assertFalse(raw.closed)
+
+        self.other.ensure_connection()
+        self.assertIs(self.other.connection, raw)
+        self.assertEqual(raw.info.parameter_status('TimeZone'), 'UTC')
+        with self.other.cursor() as cursor:
+            cursor.execute("SELECT now()")
+            self.assertEqual(cursor.fetchone()[0].utcoffset().total_seconds(), 0)
+
+    def test_connections_of_a_replaced_pool_are_closed(self):
+        """Test that switching databases, as the test runner does, replaces the pool and closes its connections."""
+        self.other.ensure_connection()
+        raw, pool = self.other.connection, self.other._pool
+
+        switched = connection.copy()
+        switched.settings_dict['NAME'] = 'postgres'
+        self.addCleanup(switched.close)
+        switched.ensure_connection()
+        self.assertIsNot(switched._pool, pool)
+        self.assertTrue(pool.closed)
+        with switched.cursor() as cursor:
+            cursor.execute("SELECT current_database()")
+            self.assertEqual(cursor.fetchone()[0], 'postgres')
+
+        self.other.close()
+        self.assertTrue(raw.closed)
+        self.assertNotIn(raw, pool._opened_at)
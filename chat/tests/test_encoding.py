@@ -0,0 +1,28 @@
+from unittest import skipUnless
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+
+from chat import encoding
+
+
+class TestJsonBackend(SimpleTestCase):
+    def test_json_backend_round_trips_compactly(self):
+        """Test that the standard library backend encodes without whitespace and decodes back."""
+        with self.settings(CHAT_JSON_BACKEND='json'):
+            text = encoding.dumps({'message': "zażółć", 'id': [1, 2]})
+            self.assertNotIn(' ', text)
+            self.assertEqual(encoding.loads(text), {'message': "zażółć", 'id': [1, 2]})
+
+    @skipUnless(encoding.orjson, "orjson is not installed.")
+    def test_auto_prefers_orjson(self):
+        """Test that 'auto' selects orjson when it is installed and it returns text."""
+        with self.settings(CHAT_JSON_BACKEND='auto'):
+            self.assertIs(encoding.get_json_backend(), encoding.JSON_BACKENDS['orjson'])
+            self.assertEqual(encoding.loads(encoding.dumps({'a': [1, None]})), {'a': [1, None]})
+            self.assertIsInstance(encoding.dumps({}), str)
+
+    def test_unknown_backend_is_rejected(self):
+        """Test that an unavailable backend raises ImproperlyConfigured."""
+        with self.settings(CHAT_JSON_BACKEND='simdjson'):
+            with self.assertRaises(ImproperlyConfigured):
+                encoding.dumps({})
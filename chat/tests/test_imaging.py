@@ -0,0 +1,88 @@
+import asyncio
+import os
+import tempfile
+from io import BytesIO
+from pathlib import Path
+from django.test import SimpleTestCase
+from PIL import Image
+
+from chat.imaging import ImagePipelineBusy, ImageRejected, get_variant, image_pipeline, process_image, variant_path
+
+
+def make_image_bytes(image_format="JPEG", size=(8, 6), exif=None):
+    """Return the bytes of a small image in the given format."""
+    buffer = BytesIO()
+    options = {"exif": exif} if exif is not None else {}
+    Image.new("RGB", size, color="blue").save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+class TestProcessImage(SimpleTestCase):
+    def test_exif_metadata_is_stripped(self):
+        """Test that EXIF data is removed and orientation is applied to the pixels."""
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90 CW
+        exif[0x010F] = "Camera maker"
+        data, ext = process_image(make_image_bytes(exif=exif.tobytes()))
+
+        self.assertEqual(ext, "jpg")
+        with Image.open(BytesIO(data)) as img:
+            self.assertEqual(len(img.getexif()), 0)
+            self.assertEqual(img.size, (6, 8))
+
+    def test_invalid_data_is_rejected(self):
+        """Test that bytes which are not an image raise ImageRejected."""
+        with self.assertRaises(ImageRejected):
+            process_image(b"definitely not an image")
+
+    def test_unsupported_format_is_rejected(self):
+        """Test that formats outside the allowed list raise ImageRejected."""
+        with self.assertRaises(ImageRejected):
+            process_image(make_image_bytes("BMP"))
+
+    def test_pixel_cap_is_enforced(self):
+        """Test that images above CHAT_MAX_IMAGE_PIXELS are rejected."""
+        with self.settings(CHAT_MAX_IMAGE_PIXELS=100):
+            with self.assertRaises(ImageRejected):
+                process_image(make_image_bytes("PNG", size=(20, 20)))
+
+    def test_size_cap_is_enforced(self):
+        """Test that data above CHAT_MAX_UPLOAD_SIZE is rejected before decoding."""
+        with self.settings(CHAT_MAX_UPLOAD_SIZE=10):
+            with self.assertRaises(ImageRejected):
+                process_image(make_image_bytes("PNG"))
+
+
+class TestVariants(SimpleTestCase):
+    def test_failed_variant_leaves_no_temporary_file(self):
+        """Test that the temporary file of a variant is removed when it cannot be put in place."""
+        with tempfile.TemporaryDirectory() as directory:
+            original = Path(directory) / "image.jpg"
+            original.write_bytes(make_image_bytes(size=(40, 30)))
+            # A directory in the way of the variant makes the final rename fail
+            target = variant_path(original, "thumb", "JPEG")
+            (target / "blocker").mkdir(parents=True)
+            os.utime(target, (0, 0))
+
+            with self.assertRaises(OSError):
+                get_variant(original, "thumb")
+            self.assertEqual(sorted(path.name for path in Path(directory).iterdir()), ["image.jpg", target.name])
+
+
+class TestImagePipeline(SimpleTestCase):
+    def test_full_queue_rejects_work(self):
+        """Test that the pipeline raises ImagePipelineBusy when its queue is full."""
+        async def inner():
+            with self.settings(CHAT_IMAGE_QUEUE_DEPTH=0):
+                with self.assertRaises(ImagePipelineBusy):
+                    await image_pipeline.run(process_image, make_image_bytes())
+
+        asyncio.run(inner())
+
+    def test_runs_work_on_pool(self):
+        """Test that the pipeline returns the result computed by the worker."""
+        async def inner():
+            return await image_pipeline.run(process_image, make_image_bytes("PNG"))
+
+        data, ext = asyncio.run(inner())
+        self.assertEqual(ext, "png")
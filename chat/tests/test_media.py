@@ -0,0 +1,33 @@
+from django.test import SimpleTestCase
+
+from chat.media import RangeNotSatisfiable, parse_range
+
+
+class TestParseRange(SimpleTestCase):
+    def test_closed_range(self):
+        """Test that a start-end range is returned unchanged."""
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+
+    def test_open_ended_range(self):
+        """Test that a range without an end runs to the end of the file."""
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+
+    def test_suffix_range(self):
+        """Test that a suffix range selects the last bytes of the file."""
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-500', 100), (0, 99))
+
+    def test_end_is_clamped_to_file_size(self):
+        """Test that an end past the file is clamped to the last byte."""
+        self.assertEqual(parse_range('bytes=50-500', 100), (50, 99))
+
+    def test_malformed_or_multiple_ranges_are_ignored(self):
+        """Test that unsupported headers result in None so the full file is served."""
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range('items=0-1', 100))
+        self.assertIsNone(parse_range('bytes=9-5', 100))
+
+    def test_unsatisfiable_range(self):
+        """Test that a range starting past the end raises RangeNotSatisfiable."""
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=100-', 100)
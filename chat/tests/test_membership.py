@@ -0,0 +1,60 @@
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from chat.membership import RoomMembershipCache, load_members, membership_cache
+from chat.models import Room
+
+
+class TestRoomMembershipCache(TestCase):
+    def test_entries_expire_after_ttl(self):
+        """Test that an entry is no longer returned once its TTL has passed."""
+        cache = RoomMembershipCache()
+        with self.settings(CHAT_MEMBERSHIP_CACHE_TTL=-1):
+            cache.set(1, frozenset({1}))
+        self.assertIsNone(cache.get(1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """Test that the cache keeps at most CHAT_MEMBERSHIP_CACHE_SIZE entries."""
+        cache = RoomMembershipCache()
+        with self.settings(CHAT_MEMBERSHIP_CACHE_SIZE=2):
+            cache.set(1, frozenset({1}))
+            cache.set(2, frozenset({2}))
+            cache.get(1)
+            cache.set(3, frozenset({3}))
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), frozenset({1}))
+        self.assertEqual(cache.get(3), frozenset({3}))
+
+
+class TestMembershipInvalidation(TestCase):
+    def setUp(self):
+        """Set up a room with an owner and a cached membership entry."""
+        self.owner = User.objects.create_user(username="owner", password="pw")
+        self.guest = User.objects.create_user(username="guest", password="pw")
+        self.room = Room.objects.create(owner=self.owner, name="Cached Room")
+        membership_cache.set(self.room.pk, async_to_sync(load_members)(self.room.pk))
+
+    def test_load_members_includes_owner_and_guests(self):
+        """Test that load_members returns the owner and every guest."""
+        self.room.guests.add(self.guest)
+        self.assertEqual(async_to_sync(load_members)(self.room.pk), frozenset({self.owner.pk, self.guest.pk}))
+
+    def test_adding_guest_invalidates_room(self):
+        """Test that adding a guest drops the cached entry."""
+        self.room.guests.add(self.guest)
+        self.assertIsNone(membership_cache.get(self.room.pk))
+
+    def test_reverse_guest_change_invalidates_room(self):
+        """Test that changing guest_rooms from the user side drops the cached entry."""
+        self.guest.guest_rooms.add(self.room)
+        self.assertIsNone(membership_cache.get(self.room.pk))
+
+    def test_room_save_and_delete_invalidate_room(self):
+        """Test that saving or deleting a room drops its cached entry."""
+        self.room.save()
+        self.assertIsNone(membership_cache.get(self.room.pk))
+        membership_cache.set(self.room.pk, frozenset())
+        room_id = self.room.pk
+        self.room.delete()
+        self.assertIsNone(membership_cache.get(room_id))
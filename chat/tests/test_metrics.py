@@ -0,0 +1,202 @@
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from channels.testing import WebsocketCommunicator
+
+from chat import metrics
+from chat.metrics import Registry
+from chat.models import Room
+from chat.tests.test_consumers import application
+
+
+def dead_pid():
+    """Return the id of a process that has exited."""
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+
+class TestRegistry(SimpleTestCase):
+    def setUp(self):
+        """Create a registry with one metric of each kind."""
+        self.registry = Registry()
+        self.requests = self.registry.counter('requests_total', "Requests.", labels=('path',))
+        self.sockets = self.registry.gauge('sockets', "Open sockets.")
+        self.latency = self.registry.histogram('latency_seconds', "Latency.", buckets=(0.1, 1))
+
+    def test_render_prometheus_text_format(self):
+        """Test that counters, gauges and cumulative histogram buckets render in the text format."""
+        with self.settings(CHAT_METRICS_DIR=''):
+            self.requests.inc(path='/a"b')
+            self.requests.inc(2, path='/a"b')
+            self.sockets.inc()
+            self.sockets.inc()
+            self.sockets.dec()
+            self.latency.observe(0.05)
+            self.latency.observe(0.5)
+            self.latency.observe(5)
+            text = self.registry.render()
+
+        self.assertIn('# TYPE requests_total counter\nrequests_total{path="/a\\"b"} 3\n', text)
+        self.assertIn('sockets 1\n', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 2\n', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3\n', text)
+        self.assertIn('latency_seconds_sum 5.55\n', text)
+        self.assertIn('latency_seconds_count 3\n', text)
+
+    def test_collect_merges_processes_sharing_a_directory(self):
+        """Test that values of other processes are added up, without the gauges of exited processes."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        snapshot = {
+            'requests_total': [[['/'], 4]],
+            'sockets': [[[], 7]],
+            'latency_seconds': [[[], {'buckets': [1, 0], 'sum': 0.01, 'count': 1}]],
+        }
+        Path(directory, f'{dead_pid()}.json').write_text(json.dumps(snapshot))
+
+        with self.settings(CHAT_METRICS_DIR=directory, CHAT_METRICS_FLUSH_INTERVAL=0):
+            self.requests.inc(path='/')
+            self.sockets.inc()
+            self.latency.observe(0.05)
+            values = self.registry.collect()
+
+        self.assertEqual(values['requests_total'], {('/',): 5})
+        self.assertEqual(values['sockets'], {(): 1})
+        self.assertEqual(values['latency_seconds'][()]['buckets'], [2, 0])
+        self.assertEqual(values['latency_seconds'][()]['count'], 2)
+
+    def test_collect_folds_snapshots_of_exited_processes(self):
+        """Test that the snapshot of an exited process is removed once its counters are part of this process's values."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        Path(directory, f'{dead_pid()}.json').write_text(json.dumps({'requests_total': [[['/'], 4]]}))
+
+        with self.settings(CHAT_METRICS_DIR=directory, CHAT_METRICS_FLUSH_INTERVAL=0):
+            self.registry.collect()
+            values = self.registry.collect()
+
+        self.assertEqual(values['requests_total'], {('/',): 4})
+        self.assertEqual([path.name for path in Path(directory).iterdir()], [f'{os.getpid()}.json'])
+
+    def test_first_write_keeps_counters_of_a_previous_process_with_the_same_id(self):
+        """Test that a snapshot left under this process's id is added to its values instead of overwritten."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        Path(directory, f'{os.getpid()}.json').write_text(json.dumps({'requests_total': [[['/'], 4]], 'sockets': [[[], 7]]}))
+
+        with self.settings(CHAT_METRICS_DIR=directory, CHAT_METRICS_FLUSH_INTERVAL=0):
+            self.requests.inc(path='/')
+            values = self.registry.collect()
+
+        self.assertEqual(values['requests_total'], {('/',): 5})
+        self.assertEqual(values['sockets'], {})
+
+    def test_failed_write_is_logged_and_leaves_no_temporary_file(self):
+        """Test that a snapshot that cannot be written is logged instead of raising, without a leftover file."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        Path(directory, f'{os.getpid()}.json').mkdir()
+
+        with self.settings(CHAT_METRICS_DIR=directory), self.assertLogs('chat.metrics', 'ERROR'):
+            self.registry._writer_pid = os.getpid()
+            self.registry.write()
+
+        self.assertEqual([path.name for path in Path(directory).iterdir()], [f'{os.getpid()}.json'])
+
+    def test_updates_schedule_one_background_write(self):
+        """Test that updates only start one timer and do not write the snapshot themselves."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+
+        with self.settings(CHAT_METRICS_DIR=directory, CHAT_METRICS_FLUSH_INTERVAL=60):
+            self.registry.write()
+            self.requests.inc(path='/')
+            timer = self.registry._timer
+            for _ in range(4):
+                self.requests.inc(path='/')
+            timer.cancel()
+            self.assertIs(self.registry._timer, timer)
+            snapshot = json.loads(Path(directory, f'{os.getpid()}.json').read_text())
+
+        self.assertEqual(snapshot['requests_total'], [])
+
+
+class TestMetricsView(TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+
+    def test_metrics_disabled_without_token(self):
+        """Test that the endpoint does not exist while no metrics token is configured."""
+        with self.settings(CHAT_METRICS_TOKEN=''):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_metrics_require_token(self):
+        """Test that a missing or wrong bearer token is refused."""
+        with self.settings(CHAT_METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+
+    def test_metrics_include_request_timings(self):
+        """Test that HTTP requests are timed by view and exposed to token holders."""
+        User.objects.create_user(username='user', password='pass')
+        self.client.login(username='user', password='pass')
+        self.client.get(reverse('home'))
+
+        with self.settings(CHAT_METRICS_TOKEN='secret'):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(
+            'http_request_duration_seconds_count{view="home",method="GET",status="200"} 1',
+            response.content.decode(),
+        )
+
+
+class TestConsumerMetrics(TransactionTestCase):
+    def setUp(self):
+        """Reset metrics and create a room with its owner."""
+        metrics.registry.clear()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        self.room = Room.objects.create(owner=self.owner, name='Metrics Room')
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_consumer_counts_sockets_and_messages(self):
+        """Test that open sockets, received frames, stored messages and delivered frames are counted."""
+        async def inner():
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{self.room.pk}/')
+            communicator.scope['user'] = self.owner
+            await communicator.connect()
+            self.assertEqual(metrics.registry.collect()['chat_open_sockets'], {(): 1})
+
+            await communicator.send_to(text_data=json.dumps({'message': 'Hello'}))
+            await communicator.receive_from(timeout=5)
+            await communicator.disconnect()
+
+        with self.settings(CHAT_WRITE_BEHIND=False, CHAT_METRICS_DIR=''):
+            self.loop.run_until_complete(inner())
+            values = metrics.registry.collect()
+
+        self.assertEqual(values['chat_open_sockets'], {(): 0})
+        self.assertEqual(values['chat_connections_total'], {('accepted',): 1})
+        self.assertEqual(values['chat_frames_received_total'], {('text',): 1})
+        self.assertEqual(values['chat_messages_total'], {('direct',): 1})
+        self.assertEqual(values['chat_frames_sent_total'], {(): 1})
+        self.assertEqual(values['chat_message_db_seconds'][('direct',)]['count'], 1)
+        self.assertEqual(values['chat_group_send_seconds'][()]['count'], 1)
@@ -1,9 +1,14 @@
+import shutil
+import tempfile
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from chat.models import Room, Message
 from django.core.files.uploadedfile import SimpleUploadedFile
 from io import BytesIO
 import time
+from datetime import timedelta
 
 
 class TestRoomModel(TestCase):
@@ -86,7 +91,10 @@ class TestRoomModel(TestCase):
 
 class TestMessageModel(TestCase):
     def setUp(self):
-        """Set up users and rooms for testing message functionality."""
+        """Set up users and rooms for testing message functionality, with a temporary MEDIA_ROOT."""
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
         self.user1 = User.objects.create_user(username="TestUser1", password="password123")
         self.user2 = User.objects.create_user(username="TestUser2", password="password123")
 
@@ -97,6 +105,11 @@ class TestMessageModel(TestCase):
             is_publicly_visible=False,
         )
 
+    def tearDown(self):
+        """Remove the temporary MEDIA_ROOT."""
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
     def test_valid_message_creation(self):
         """Test whether a message with text content is created successfully."""
         message = Message.objects.create(
@@ -176,6 +189,62 @@ class TestMessageModel(TestCase):
         self.assertEqual(messages[0], message2)
         self.assertEqual(messages[1], message1)
 
+    def test_creation_updates_room_activity(self):
+        """Test whether creating messages updates the room's activity columns."""
+        Message.objects.create(room=self.room, sender=self.user1, content="First")
+        last = Message.objects.create(room=self.room, sender=self.user2, content="Second")
+
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_count, 2)
+        self.assertEqual(self.room.last_message_id, last.pk)
+        self.assertEqual(self.room.last_message_at, last.created_at)
+
+    def test_older_message_does_not_replace_latest(self):
+        """Test whether recording an older message keeps the newer last_message_at."""
+        last = Message.objects.create(room=self.room, sender=self.user1, content="Latest")
+        Room.record_messages(self.room.pk, last.created_at - timedelta(minutes=5), last.pk + 100)
+
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_count, 2)
+        self.assertEqual(self.room.last_message_id, last.pk)
+
+    def test_deletion_updates_room_activity(self):
+        """Test whether deleting messages lowers the count and moves the latest message back."""
+        first = Message.objects.create(room=self.room, sender=self.user1, content="First")
+        last = Message.objects.create(room=self.room, sender=self.user2, content="Second")
+
+        last.delete()
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_count, 1)
+        self.assertEqual(self.room.last_message_id, first.pk)
+        self.assertEqual(self.room.last_message_at, first.created_at)
+
+        first.delete()
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_count, 0)
+        self.assertIsNone(self.room.last_message_id)
+        self.assertIsNone(self.room.last_message_at)
+
+    def test_user_deletion_updates_activity_of_other_rooms(self):
+        """Test whether deleting a user takes their messages out of the activity of rooms they do not own."""
+        first = Message.objects.create(room=self.room, sender=self.user1, content="First")
+        Message.objects.create(room=self.room, sender=self.user2, content="Second")
+        Message.objects.create(room=self.room, sender=self.user2, content="Third")
+
+        self.user2.delete()
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_count, 1)
+        self.assertEqual(self.room.last_message_id, first.pk)
+
+    def test_room_deletion_does_not_update_activity_per_message(self):
+        """Test whether deleting a room deletes its messages without updating its activity row by row."""
+        for i in range(3):
+            Message.objects.create(room=self.room, sender=self.user2, content=f"Message {i}")
+
+        with CaptureQueriesContext(connection) as queries:
+            self.room.delete()
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE "chat_room"')])
+
     def test_meta_verbose_name(self):
         """Test whether the Message model has the correct verbose names."""
         self.assertEqual(Message._meta.verbose_name, "Message")
@@ -0,0 +1,143 @@
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import skipUnless
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from chat import partitioning
+from chat.history import get_page
+from chat.models import Message, Room
+
+
+class TestMonths(SimpleTestCase):
+    def test_month_start_uses_utc(self):
+        """Test that the month of a datetime is taken in UTC."""
+        value = datetime(2026, 3, 1, 0, 30, tzinfo=dt_timezone(timedelta(hours=2)))
+        self.assertEqual(partitioning.month_start(value), date(2026, 2, 1))
+
+    def test_add_months_crosses_years(self):
+        """Test that adding and subtracting months wraps around year boundaries."""
+        self.assertEqual(partitioning.add_months(date(2026, 11, 1), 3), date(2027, 2, 1))
+        self.assertEqual(partitioning.add_months(date(2026, 1, 1), -13), date(2024, 12, 1))
+
+    def test_upper_bound(self):
+        """Test that the month a partition ends at is read from its bound expression."""
+        bound = "FOR VALUES FROM ('2026-10-01 00:00:00+00') TO ('2026-11-01 00:00:00+00')"
+        self.assertEqual(partitioning.upper_bound(bound), date(2026, 11, 1))
+        self.assertIsNone(partitioning.upper_bound('DEFAULT'))
+
+    def test_partition_name(self):
+        """Test that partitions are named after their month."""
+        self.assertEqual(partitioning.partition_name(date(2026, 7, 1)), 'chat_message_p2026_07')
+
+
+@skipUnless(connection.vendor != 'postgresql', "Checks the single-table fallback.")
+class TestSingleTableFallback(TestCase):
+    @override_settings(CHAT_MESSAGE_PARTITIONING=True)
+    def test_partitioning_is_disabled(self):
+        """Test whether partitioning stays off on databases other than PostgreSQL."""
+        self.assertFalse(partitioning.is_enabled())
+        self.assertEqual(partitioning.ensure_partitions(), [])
+
+
+@skipUnless(connection.vendor == 'postgresql', "Partitioning requires PostgreSQL.")
+@override_settings(CHAT_MESSAGE_PARTITIONING=True, CHAT_MESSAGE_PARTITIONS_AHEAD=2)
+class TestPostgresqlPartitioning(TestCase):
+    def setUp(self):
+        """Set up a room and a single-table chat_message, converted back if migrations partitioned it."""
+        self.user = User.objects.create_user(username="owner", password="pw")
+        self.room = Room.objects.create(owner=self.user, name="Room")
+        self.now = datetime(2026, 10, 18, tzinfo=dt_timezone.utc)
+        # DDL is transactional on PostgreSQL, so the test transaction undoes this
+        with connection.schema_editor() as schema_editor:
+            partitioning.unpartition_messages(schema_editor)
+
+    def partitions(self):
+        with connection.cursor() as cursor:
+            cursor.execute(partitioning.POSTGRESQL_PARTITIONS, [partitioning.TABLE])
+            return {name for name, _ in cursor.fetchall()}
+
+    def test_convert_keeps_rows_and_routes_new_ones(self):
+        """Test that converting keeps existing messages and stores new ones in monthly partitions."""
+        user, room, now = self.user, self.room, self.now
+        old = Message.objects.create(room=room, sender=user, content="before")
+
+        with connection.schema_editor() as schema_editor:
+            partitioning.partition_messages(schema_editor, now=now)
+        with connection.cursor() as cursor:
+            self.assertTrue(partitioning.is_partitioned(cursor))
+        self.assertEqual(self.partitions(), {
+            'chat_message_legacy', 'chat_message_default', 'chat_message_p2026_11', 'chat_message_p2026_12',
+        })
+
+        new = Message.objects.create(room=room, sender=user, content="after")
+        Message.objects.filter(pk=new.pk).update(created_at=datetime(2026, 12, 5, tzinfo=dt_timezone.utc))
+        self.assertGreater(new.pk, old.pk)
+        self.assertEqual(set(room.messages.values_list('content', flat=True)), {"before", "after"})
+        self.assertEqual(partitioning.ensure_partitions(now=now), [])
+
+    def test_partition_takes_rows_from_the_default_partition(self):
+        """Test that creating a month the default partition holds rows of moves them into the new partition."""
+        with connection.schema_editor() as schema_editor:
+            partitioning.partition_messages(schema_editor, now=self.now)
+        late = Message.objects.create(room=self.room, sender=self.user, content="late")
+        Message.objects.filter(pk=late.pk).update(created_at=datetime(2027, 2, 3, tzinfo=dt_timezone.utc))
+
+        created = partitioning.ensure_partitions(now=datetime(2027, 1, 5, tzinfo=dt_timezone.utc), ahead=1)
+        self.assertEqual(created, ['chat_message_p2027_01', 'chat_message_p2027_02'])
+        self.assertIn('chat_message_default', self.partitions())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT content FROM chat_message_p2027_02")
+            self.assertEqual(cursor.fetchall(), [("late",)])
+            cursor.execute("SELECT count(*) FROM chat_message_default")
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertEqual(Message.objects.get(pk=late.pk).content, "late")
+
+
+class TestPartitionAwareHistory(TestCase):
+    def setUp(self):
+        """Set up a room with messages spread over several months."""
+        self.user = User.objects.create_user(username="owner", password="pw")
+        self.room = Room.objects.create(owner=self.user, name="Room")
+        start = datetime(2025, 1, 10, tzinfo=dt_timezone.utc)
+        days = [0, 1, 40, 41, 42, 200, 300, 301, 302, 303]
+        for day in days:
+            message = Message.objects.create(room=self.room, sender=self.user, content=f"day {day}")
+            Message.objects.filter(pk=message.pk).update(created_at=start + timedelta(days=day))
+        Room.objects.filter(pk=self.room.pk).update(
+            created_at=start - timedelta(days=3), last_message_at=start + timedelta(days=303),
+        )
+        self.room.refresh_from_db()
+
+    def pages(self, limit):
+        before = None
+        pages = []
+        while True:
+            page, has_more = get_page(self.room, before=before, limit=limit)
+            pages.append([message.content for message in page])
+            if not has_more:
+                return pages
+            before = page[0].created_at, page[0].pk
+
+    def test_windows_return_the_same_pages(self):
+        """Test that month-bounded reads page through history like unbounded reads."""
+        for limit in (1, 3, 4, 20):
+            expected = self.pages(limit)
+            with override_settings(CHAT_MESSAGE_PARTITIONING=True):
+                self.assertEqual(self.pages(limit), expected)
+
+    @override_settings(CHAT_MESSAGE_PARTITIONING=True)
+    def test_newest_page_reads_only_the_newest_month(self):
+        """Test that a newest page filled by the latest month runs one bounded query."""
+        with self.assertNumQueries(1) as context:
+            page, has_more = get_page(self.room, limit=3)
+        self.assertEqual([message.content for message in page], ["day 301", "day 302", "day 303"])
+        self.assertTrue(has_more)
+        self.assertIn('"created_at" >=', context.captured_queries[0]['sql'])
+
+    @override_settings(CHAT_MESSAGE_PARTITIONING=True)
+    def test_room_without_messages(self):
+        """Test that a room without messages returns an empty page without querying."""
+        empty = Room.objects.create(owner=self.user, name="Empty")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_page(empty), ([], False))
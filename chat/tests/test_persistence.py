@@ -0,0 +1,128 @@
+import asyncio
+from datetime import timedelta
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError
+from django.utils import timezone
+
+from chat.models import Room, Message
+from chat.persistence import MessageWriteBuffer, WriteBufferFull
+
+
+class TestMessageWriteBuffer(TestCase):
+    def setUp(self):
+        """Set up a user, a room and an empty buffer."""
+        self.user = User.objects.create_user(username="buffered", password="pw")
+        self.room = Room.objects.create(owner=self.user, name="Buffered Room")
+        self.buffer = MessageWriteBuffer()
+
+    def test_add_returns_unique_provisional_ids(self):
+        """Test that every queued message gets its own provisional id."""
+        first, _ = self.buffer.add(self.room.pk, self.user.pk, "one")
+        second, _ = self.buffer.add(self.room.pk, self.user.pk, "two")
+        self.assertNotEqual(first, second)
+        self.assertTrue(first.startswith("p"))
+        self.assertEqual(len(self.buffer), 2)
+        self.buffer.flush_sync()
+
+    def test_flush_writes_messages_in_order(self):
+        """Test that flushing inserts all queued messages in the order they were added."""
+        for i in range(5):
+            self.buffer.add(self.room.pk, self.user.pk, f"message {i}")
+        self.assertFalse(Message.objects.exists())
+
+        written = self.buffer.flush_sync()
+
+        self.assertEqual(written, 5)
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(self.buffer.last_batch_size, 5)
+        contents = list(Message.objects.order_by("id").values_list("content", flat=True))
+        self.assertEqual(contents, [f"message {i}" for i in range(5)])
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_count, 5)
+        self.assertEqual(self.room.last_message_id, Message.objects.order_by("id").last().pk)
+
+    def test_messages_keep_the_time_they_were_added(self):
+        """Test that flushed messages are stored with the time they were queued, not the time of the flush."""
+        before = timezone.now()
+        _, queued_at = self.buffer.add(self.room.pk, self.user.pk, "queued")
+        self.assertEqual(self.buffer._pending[0].created_at, queued_at)
+        self.assertGreaterEqual(queued_at, before)
+
+        self.buffer._pending[0].created_at = queued_at - timedelta(minutes=1)
+        self.buffer.flush_sync()
+        self.assertEqual(Message.objects.get().created_at, queued_at - timedelta(minutes=1))
+
+    def test_has_pending(self):
+        """Test whether pending messages are reported per room."""
+        self.buffer.add(self.room.pk, self.user.pk, "queued")
+        self.assertTrue(self.buffer.has_pending(self.room.pk))
+        self.assertFalse(self.buffer.has_pending(self.room.pk + 1))
+        self.buffer.flush_sync()
+        self.assertFalse(self.buffer.has_pending(self.room.pk))
+
+    @override_settings(CHAT_WRITE_BEHIND_MAX_PENDING=2)
+    def test_add_refuses_messages_past_the_limit(self):
+        """Test that a full buffer refuses new messages until it is flushed."""
+        self.buffer.add(self.room.pk, self.user.pk, "one")
+        self.buffer.add(self.room.pk, self.user.pk, "two")
+        with self.assertRaises(WriteBufferFull):
+            self.buffer.add(self.room.pk, self.user.pk, "three")
+
+        self.buffer.flush_sync()
+        self.buffer.add(self.room.pk, self.user.pk, "three")
+        self.assertEqual(len(self.buffer), 1)
+        self.buffer.flush_sync()
+
+    def test_flush_empty_buffer(self):
+        """Test that flushing an empty buffer is a no-op."""
+        self.assertEqual(self.buffer.flush_sync(), 0)
+
+
+class TestMessageWriteBufferFailures(TransactionTestCase):
+    def test_flush_drops_only_rejected_rows(self):
+        """Test that a message for a missing room does not block the rest of the batch."""
+        user = User.objects.create_user(username="buffered", password="pw")
+        room = Room.objects.create(owner=user, name="Buffered Room")
+        buffer = MessageWriteBuffer()
+        buffer.add(room.pk, user.pk, "kept")
+        buffer.add(room.pk + 1000, user.pk, "orphan")
+
+        written = buffer.flush_sync()
+
+        self.assertEqual(written, 1)
+        self.assertEqual(list(Message.objects.values_list("content", flat=True)), ["kept"])
+
+
+class FailingOnceBuffer(MessageWriteBuffer):
+    """Write buffer whose first batch insert fails."""
+
+    def __init__(self):
+        super().__init__()
+        self.failures = 0
+
+    def _write(self, batch):
+        if not self.failures:
+            self.failures += 1
+            raise DatabaseError("database is locked")
+        return super()._write(batch)
+
+
+class TestMessageWriteBufferRetry(TransactionTestCase):
+    @override_settings(CHAT_WRITE_BEHIND_INTERVAL=0.05)
+    def test_failed_flush_is_retried(self):
+        """Test that messages put back by a failed flush are written by a scheduled retry."""
+        user = User.objects.create_user(username="buffered", password="pw")
+        room = Room.objects.create(owner=user, name="Buffered Room")
+        buffer = FailingOnceBuffer()
+
+        async def run():
+            buffer.add(room.pk, user.pk, "retried")
+            for _ in range(100):
+                await asyncio.sleep(0.05)
+                if not len(buffer) and buffer.failures:
+                    return
+
+        asyncio.run(run())
+        self.assertEqual(buffer.failures, 1)
+        self.assertEqual(list(Message.objects.values_list("content", flat=True)), ["retried"])
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from django.test import SimpleTestCase
+
+from chat.presence import PresenceTracker
+
+
+def make_user(pk):
+    """Return a stand-in for a user with the given id."""
+    return SimpleNamespace(pk=pk, username=f"user{pk}")
+
+
+class TestPresenceTracker(SimpleTestCase):
+    def setUp(self):
+        """Create a tracker and connect two users to a room."""
+        self.tracker = PresenceTracker()
+        self.alice, self.bob = make_user(1), make_user(2)
+        self.join(self.alice, "alice-1")
+        self.join(self.bob, "bob-1")
+        self.tracker.collect()
+
+    def join(self, user, channel_name, room_id=1):
+        """Connect a user from inside an event loop, as the consumer does."""
+        async def inner():
+            self.tracker.join(room_id, f"chat_{room_id}", channel_name, user)
+
+        asyncio.run(inner())
+
+    def test_changes_are_coalesced_into_one_delta(self):
+        """Test that repeated typing and joins within an interval produce a single delta."""
+        for _ in range(10):
+            self.tracker.set_typing(1, self.alice, True)
+        self.join(make_user(3), "carol-1")
+
+        updates = self.tracker.collect()
+        self.assertEqual(updates, [("chat_1", {
+            'online_count': 3, 'joined': ["user3"], 'left': [], 'typing': ["user1"], 'typing_count': 1,
+        })])
+        self.assertEqual(self.tracker.collect(), [])
+
+    def test_join_and_leave_within_interval_cancel_out(self):
+        """Test that a user who connects and disconnects between ticks is not broadcast."""
+        self.join(make_user(3), "carol-1")
+        self.tracker.leave(1, "carol-1")
+        self.assertEqual(self.tracker.collect(), [])
+
+    def test_second_connection_does_not_change_presence(self):
+        """Test that users are reported as left only when their last connection closes."""
+        self.join(self.alice, "alice-2")
+        self.tracker.leave(1, "alice-1")
+        self.assertEqual(self.tracker.collect(), [])
+
+        self.tracker.leave(1, "alice-2")
+        self.assertEqual(self.tracker.collect()[0][1]['left'], ["user1"])
+
+    def test_connections_expire_without_heartbeat(self):
+        """Test that connections without a recent heartbeat are dropped."""
+        self.tracker.heartbeat(1, "chat_1", "bob-1", self.bob)
+        with self.settings(CHAT_PRESENCE_TIMEOUT=0.5):
+            updates = self.tracker.collect(now=time.monotonic() + 0.25)
+            self.assertEqual(updates, [])
+            self.tracker.heartbeat(1, "chat_1", "bob-1", self.bob)
+            updates = self.tracker.collect(now=time.monotonic() + 0.75)
+        self.assertEqual(updates[0][1]['left'], ["user1", "user2"])
+        self.assertEqual(self.tracker.snapshot(1)['online_count'], 0)
+
+    def test_typing_expires(self):
+        """Test that a typing state ends after CHAT_TYPING_TIMEOUT without refresh."""
+        with self.settings(CHAT_TYPING_TIMEOUT=1):
+            self.tracker.set_typing(1, self.alice, True)
+        self.tracker.collect()
+
+        updates = self.tracker.collect(now=time.monotonic() + 2)
+        self.assertEqual(updates[0][1]['typing'], [])
+
+    def test_large_rooms_only_receive_counts(self):
+        """Test that names are omitted once more than CHAT_PRESENCE_MAX_NAMES users are online."""
+        for pk in range(3, 6):
+            self.join(make_user(pk), f"user-{pk}")
+            self.tracker.set_typing(1, make_user(pk), True)
+        with self.settings(CHAT_PRESENCE_MAX_NAMES=2):
+            delta = self.tracker.collect()[0][1]
+            snapshot = self.tracker.snapshot(1)
+
+        self.assertEqual(delta['online_count'], 5)
+        self.assertEqual(delta['joined'], [])
+        self.assertEqual(delta['typing'], ["user3", "user4"])
+        self.assertEqual(delta['typing_count'], 3)
+        self.assertEqual(snapshot['online'], [])
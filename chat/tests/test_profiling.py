@@ -0,0 +1,123 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from channels.testing import WebsocketCommunicator
+
+from chat.models import Room, Message
+from chat.profiling import QueryBudgetExceeded, profile
+from chat.tests.test_consumers import application, make_png_bytes
+
+
+class TestQueryProfile(TestCase):
+    def test_profile_counts_duplicate_and_similar_queries(self):
+        """Test that repeated statements are counted as duplicates or, with other parameters, as similar."""
+        user = User.objects.create_user(username='user', password='pass')
+        with profile('test') as query_profile:
+            User.objects.filter(pk=user.pk).first()
+            User.objects.filter(pk=user.pk).first()
+            User.objects.filter(pk=user.pk + 1).first()
+            Room.objects.count()
+
+        self.assertEqual(query_profile.count, 4)
+        self.assertEqual(query_profile.duplicates, 1)
+        self.assertEqual(query_profile.similar, 2)
+        self.assertIsNotNone(query_profile.slowest)
+        self.assertGreater(query_profile.duration, 0)
+
+    def test_queries_outside_profile_are_not_recorded(self):
+        """Test whether only queries inside the profiled block are recorded."""
+        with profile('test') as query_profile:
+            pass
+        Room.objects.count()
+        self.assertEqual(query_profile.count, 0)
+
+
+class TestQueryProfilerMiddleware(TestCase):
+    def setUp(self):
+        """Log in a user who owns a room with messages, one of them with an image."""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.guest = User.objects.create_user(username='guest', password='pass')
+        self.room = Room.objects.create(owner=self.user, name='Room')
+        self.room.guests.add(self.guest)
+        for i in range(10):
+            Message.objects.create(room=self.room, sender=self.guest if i % 2 else self.user, content=f'Message {i}')
+        self.client.login(username='user', password='pass')
+
+    def test_profiler_disabled_by_default(self):
+        """Test that responses carry no profiling headers while the profiler is off."""
+        with self.settings(CHAT_PROFILER=False):
+            response = self.client.get(reverse('home'))
+        self.assertNotIn('X-Query-Count', response)
+
+    def test_profiler_reports_headers_and_logs(self):
+        """Test that profiled responses carry query headers and are logged with their budget."""
+        with self.settings(CHAT_PROFILER=True, CHAT_QUERY_BUDGETS={'room': {'queries': 50}}):
+            with self.assertLogs('chat.profiling', 'INFO') as logs:
+                response = self.client.get(reverse('room', kwargs={'pk': self.room.pk}))
+
+        self.assertGreater(int(response['X-Query-Count']), 0)
+        self.assertEqual(response['X-Query-Budget'], '50')
+        self.assertIn('X-Query-Time-Ms', response)
+        self.assertIn('room: ', logs.output[0])
+
+    def test_budget_exceeded_raises_in_strict_mode(self):
+        """Test that strict mode turns an exceeded query budget into an error."""
+        with self.settings(CHAT_PROFILER=True, CHAT_PROFILER_STRICT=True, CHAT_QUERY_BUDGETS={'home': {'queries': 1}}):
+            with self.assertLogs('chat.profiling', 'WARNING'):
+                with self.assertRaisesMessage(QueryBudgetExceeded, "home ran"):
+                    self.client.get(reverse('home'))
+
+    def test_views_stay_within_query_budgets(self):
+        """Test that the chat views run no more queries than CHAT_QUERY_BUDGETS allows."""
+        os.makedirs(os.path.join(self.media_root, 'message_images'))
+        with open(os.path.join(self.media_root, 'message_images', 'test.png'), 'wb') as f:
+            f.write(make_png_bytes())
+        image = Message.objects.create(room=self.room, sender=self.guest, image='message_images/test.png')
+
+        with self.settings(MEDIA_ROOT=self.media_root, CHAT_PROFILER=True, CHAT_PROFILER_STRICT=True):
+            for url in (
+                reverse('home'),
+                reverse('room', kwargs={'pk': self.room.pk}),
+                reverse('room-messages', kwargs={'pk': self.room.pk}),
+                reverse('protected-media', kwargs={'message_id': image.pk}),
+            ):
+                with self.assertLogs('chat.profiling', 'INFO'):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+
+class TestConsumerProfiling(TransactionTestCase):
+    def setUp(self):
+        """Set up an event loop and a room with its owner."""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        self.room = Room.objects.create(owner=self.owner, name='Profiled Room')
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_websocket_events_stay_within_query_budgets(self):
+        """Test that connecting and sending a message are profiled, including queries on the database thread."""
+        async def inner():
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{self.room.pk}/')
+            communicator.scope['user'] = self.owner
+            await communicator.connect()
+            await communicator.send_to(text_data=json.dumps({'message': 'Hello'}))
+            await communicator.receive_from(timeout=5)
+            await communicator.disconnect()
+
+        with self.settings(CHAT_PROFILER=True, CHAT_PROFILER_STRICT=True, CHAT_WRITE_BEHIND=False):
+            with self.assertLogs('chat.profiling', 'INFO') as logs:
+                self.loop.run_until_complete(inner())
+
+        self.assertTrue(logs.output[0].startswith('INFO:chat.profiling:websocket.connect: '))
+        receive = next(line for line in logs.output if 'websocket.receive' in line)
+        self.assertNotIn(': 0 queries', receive)
@@ -0,0 +1,46 @@
+from unittest import skipUnless
+from django.test import SimpleTestCase
+
+from chat import encoding, protocol
+
+
+MESSAGE = {
+    'id': 7,
+    'sender': 'alice',
+    'message': 'hi',
+    'timestamp': '2025-02-23T10:00:00.250000+00:00',
+    'image_url': None,
+}
+
+
+class TestProtocol(SimpleTestCase):
+    def test_negotiate_prefers_server_order(self):
+        """Test that the server picks its preferred subprotocol among the offered ones."""
+        self.assertEqual(protocol.negotiate([protocol.JSON, protocol.COMPACT]), protocol.COMPACT)
+        self.assertEqual(protocol.negotiate(['chat.v2', protocol.JSON]), protocol.JSON)
+        self.assertIsNone(protocol.negotiate([]))
+
+    def test_compact_message_shortens_keys(self):
+        """Test that compact frames use short keys, epoch milliseconds and drop empty fields."""
+        self.assertEqual(protocol.compact_message(MESSAGE), {'i': 7, 's': 'alice', 'm': 'hi', 't': 1740304800250})
+
+    def test_frames_are_selected_per_protocol(self):
+        """Test that each client gets the pre-encoded frame of its subprotocol, and old clients the legacy one."""
+        frames = protocol.encode_message(MESSAGE)
+        self.assertEqual(encoding.loads(protocol.select_frame(None, frames)['text_data']), MESSAGE)
+        self.assertEqual(protocol.select_frame(protocol.JSON, frames), {'text_data': frames['text']})
+        self.assertEqual(protocol.select_frame(protocol.COMPACT, frames), {'text_data': frames['compact']})
+
+    def test_incoming_compact_keys_are_expanded(self):
+        """Test that compact clients may send short keys."""
+        data = protocol.decode(protocol.COMPACT, text_data='{"m":"hello","type":"upload"}')
+        self.assertEqual(data, {'message': 'hello', 'type': 'upload'})
+
+    @skipUnless(protocol.msgpack, "msgpack is not installed.")
+    def test_msgpack_frames_round_trip(self):
+        """Test that MessagePack clients receive binary frames and may send them."""
+        frames = protocol.encode_message(MESSAGE)
+        sent = protocol.select_frame(protocol.MSGPACK, frames)
+        self.assertEqual(protocol.msgpack.unpackb(sent['bytes_data']), protocol.compact_message(MESSAGE))
+        data = protocol.decode(protocol.MSGPACK, bytes_data=protocol.msgpack.packb({'m': 'hey'}))
+        self.assertEqual(data, {'message': 'hey'})
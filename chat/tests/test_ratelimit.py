@@ -0,0 +1,72 @@
+from django.test import SimpleTestCase
+
+from chat.ratelimit import RateLimiter, TokenBucket
+
+
+class TestTokenBucket(SimpleTestCase):
+    def test_bucket_refills_over_time(self):
+        """Test that a drained bucket allows frames again after refilling."""
+        bucket = TokenBucket(rate=2, burst=2)
+        now = bucket.updated
+        for _ in range(2):
+            self.assertEqual(bucket.wait_time(1, now), 0)
+            bucket.take(1)
+        self.assertAlmostEqual(bucket.wait_time(1, now), 0.5)
+        self.assertEqual(bucket.wait_time(1, now + 0.5), 0)
+
+    def test_amount_above_burst_never_fits(self):
+        """Test that a frame larger than the burst can never be allowed."""
+        bucket = TokenBucket(rate=10, burst=5)
+        self.assertEqual(bucket.wait_time(6, bucket.updated + 100), float('inf'))
+
+
+class TestRateLimiter(SimpleTestCase):
+    def test_user_budget_is_shared_between_connections(self):
+        """Test that a user's sockets draw from one per-user budget."""
+        limiter = RateLimiter()
+        with self.settings(CHAT_RATE_MESSAGE_BURST=10, CHAT_RATE_USER_MESSAGE_BURST=3, CHAT_RATE_USER_MESSAGES=0):
+            first, second = limiter.open(1), limiter.open(1)
+            self.assertIsNone(first.check(10))
+            self.assertIsNone(second.check(10))
+            self.assertIsNone(first.check(10))
+            scope, budget, _ = second.check(10)
+        self.assertEqual((scope, budget), ('user', 'messages'))
+
+    def test_rejected_frames_are_not_charged(self):
+        """Test that a frame rejected by the user budget does not use connection tokens."""
+        limiter = RateLimiter()
+        with self.settings(CHAT_RATE_BYTE_BURST=100, CHAT_RATE_USER_BYTE_BURST=50, CHAT_RATE_BYTES=0):
+            limits = limiter.open(1)
+            self.assertEqual(limits.check(60)[:2], ('user', 'bytes'))
+        self.assertEqual(limits.buckets['bytes'].tokens, 100)
+
+    def test_upload_chunks_only_cost_bytes(self):
+        """Test that frames checked with message=False do not use message tokens."""
+        limiter = RateLimiter()
+        with self.settings(CHAT_RATE_MESSAGE_BURST=1, CHAT_RATE_MESSAGES=0):
+            limits = limiter.open(1)
+            for _ in range(5):
+                self.assertIsNone(limits.check(1000, message=False))
+            self.assertIsNone(limits.check(10))
+
+    def test_repeated_violations_mark_connection_abusive(self):
+        """Test that a connection becomes abusive after CHAT_RATE_MAX_VIOLATIONS rejected frames."""
+        limiter = RateLimiter()
+        with self.settings(CHAT_RATE_MESSAGE_BURST=1, CHAT_RATE_MESSAGES=0, CHAT_RATE_MAX_VIOLATIONS=2):
+            limits = limiter.open(1)
+            limits.check(1)
+            for _ in range(2):
+                limits.check(1)
+                self.assertFalse(limits.is_abusive())
+            limits.check(1)
+            self.assertTrue(limits.is_abusive())
+
+    def test_user_budget_is_dropped_with_last_connection(self):
+        """Test that per-user state is released when the user's last socket closes."""
+        limiter = RateLimiter()
+        limiter.open(1)
+        limiter.open(1)
+        limiter.close(1)
+        self.assertIn(1, limiter._users)
+        limiter.close(1)
+        self.assertNotIn(1, limiter._users)
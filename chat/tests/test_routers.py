@@ -0,0 +1,119 @@
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.connection import ConnectionDoesNotExist
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from chat import routers
+from chat.membership import is_member, membership_cache
+from chat.models import Message, Room
+
+
+@override_settings(CHAT_DATABASE_REPLICAS=['replica'], CHAT_REPLICA_STICKY_SECONDS=5)
+class TestReplicaRouter(SimpleTestCase):
+    def setUp(self):
+        """Set up a router and an empty cache."""
+        self.router = routers.ReplicaRouter()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_reads_use_replica_only_when_enabled(self):
+        """Test that only reads within replica_reads go to a replica."""
+        self.assertEqual(self.router.db_for_read(Message), DEFAULT_DB_ALIAS)
+        with routers.replica_reads(1):
+            self.assertEqual(self.router.db_for_read(Message), 'replica')
+        self.assertEqual(self.router.db_for_read(Message), DEFAULT_DB_ALIAS)
+
+    def test_writes_use_primary(self):
+        """Test that writes go to the primary and keep later reads of the block there."""
+        with routers.replica_reads(1):
+            self.assertEqual(self.router.db_for_write(Message), DEFAULT_DB_ALIAS)
+            self.assertEqual(self.router.db_for_read(Message), DEFAULT_DB_ALIAS)
+
+    def test_pinned_user_reads_primary(self):
+        """Test that a user who wrote recently reads from the primary while other users do not."""
+        routers.pin_primary(1)
+        with routers.replica_reads(1):
+            self.assertEqual(self.router.db_for_read(Message), DEFAULT_DB_ALIAS)
+        with routers.replica_reads(2):
+            self.assertEqual(self.router.db_for_read(Message), 'replica')
+
+        cache.delete('chat:primary:1')
+        with routers.replica_reads(1):
+            self.assertEqual(self.router.db_for_read(Message), 'replica')
+
+    def test_primary_reads_within_replica_reads(self):
+        """Test that primary_reads keeps reads on the primary and passes its writes to the outer block."""
+        with routers.replica_reads(1) as state:
+            with routers.primary_reads():
+                self.assertEqual(self.router.db_for_read(Message), DEFAULT_DB_ALIAS)
+            self.assertEqual(self.router.db_for_read(Message), 'replica')
+            with routers.primary_reads():
+                self.router.db_for_write(Message)
+            self.assertTrue(state.wrote)
+
+    @override_settings(CHAT_DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        """Test that everything uses the primary and nobody is pinned without replicas."""
+        routers.pin_primary(1)
+        self.assertIsNone(cache.get('chat:primary:1'))
+        with routers.replica_reads(1):
+            self.assertEqual(self.router.db_for_read(Message), DEFAULT_DB_ALIAS)
+
+    def test_replicas_are_not_migrated(self):
+        """Test whether migrations are skipped on replicas."""
+        self.assertFalse(self.router.allow_migrate('replica', 'chat'))
+        self.assertIsNone(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'chat'))
+
+
+class TestReadYourWrites(TestCase):
+    def setUp(self):
+        """Set up a public room and a user who is not its guest."""
+        self.owner = User.objects.create_user(username="owner", password="pw")
+        self.user = User.objects.create_user(username="user", password="pw")
+        self.room = Room.objects.create(owner=self.owner, name="Room", is_publicly_visible=True)
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    @override_settings(CHAT_DATABASE_REPLICAS=['replica'])
+    def test_join_pins_user_to_primary(self):
+        """Test that joining a room keeps the user's room list and room page on the primary."""
+        self.client.force_login(self.user)
+        self.client.post(reverse('room-join', args=[self.room.pk]))
+        self.assertIsNotNone(cache.get(f'chat:primary:{self.user.pk}'))
+
+        # The replica alias does not exist here, so these only succeed on the primary
+        self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('room', args=[self.room.pk])).status_code, 200)
+
+    @override_settings(CHAT_DATABASE_REPLICAS=['replica'])
+    def test_room_page_reads_replica(self):
+        """Test that the room page of a user without recent writes is read from a replica."""
+        self.room.guests.add(self.user)
+        self.client.force_login(self.user)
+        with self.assertRaises(ConnectionDoesNotExist):
+            self.client.get(reverse('room', args=[self.room.pk]))
+
+    @override_settings(CHAT_DATABASE_REPLICAS=['replica'])
+    def test_cached_lookups_read_primary(self):
+        """Test that room lists and room members, which are cached, are read from the primary."""
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+        membership_cache.clear()
+        with routers.replica_reads(self.owner.pk):
+            self.assertTrue(async_to_sync(is_member)(self.room.pk, self.owner))
+        membership_cache.clear()
+
+    @override_settings(CHAT_DATABASE_REPLICAS=['replica'])
+    def test_reads_do_not_pin(self):
+        """Test that requests without writes do not pin the user."""
+        self.client.force_login(self.user)
+        cache.clear()
+        self.client.get(reverse('room-messages', args=[self.room.pk]))
+        self.assertIsNone(cache.get(f'chat:primary:{self.user.pk}'))
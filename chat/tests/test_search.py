@@ -0,0 +1,98 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from chat.models import Room, Message
+from chat.persistence import MessageWriteBuffer
+from chat.search import parse_cursor, search_messages
+
+
+class TestSearchMessages(TestCase):
+    def setUp(self):
+        """Set up two rooms of one owner and a room the owner has no access to."""
+        self.user = User.objects.create_user(username="owner", password="pw")
+        self.other = User.objects.create_user(username="other", password="pw")
+        self.room = Room.objects.create(owner=self.user, name="Room")
+        self.second_room = Room.objects.create(owner=self.other, name="Second Room")
+        self.second_room.guests.add(self.user)
+        self.foreign_room = Room.objects.create(owner=self.other, name="Foreign Room")
+
+    def test_room_search_ranks_matches(self):
+        """Test that room search returns only matching messages of the room, best match first."""
+        weak = Message.objects.create(room=self.room, sender=self.user, content="deploy went fine and everyone went home early today")
+        strong = Message.objects.create(room=self.room, sender=self.user, content="deploy deploy")
+        Message.objects.create(room=self.room, sender=self.user, content="lunch?")
+        Message.objects.create(room=self.second_room, sender=self.user, content="deploy")
+
+        messages, next_cursor = search_messages("Deploy", room=self.room)
+
+        self.assertEqual(messages, [strong, weak])
+        self.assertGreater(messages[0].search_score, messages[1].search_score)
+        self.assertIsNone(next_cursor)
+
+    def test_user_search_covers_accessible_rooms(self):
+        """Test that user search finds messages in owned and joined rooms but not in other rooms."""
+        owned = Message.objects.create(room=self.room, sender=self.user, content="release notes")
+        joined = Message.objects.create(room=self.second_room, sender=self.other, content="release date")
+        Message.objects.create(room=self.foreign_room, sender=self.other, content="release secret")
+
+        messages, _ = search_messages("release", user=self.user)
+
+        self.assertCountEqual(messages, [owned, joined])
+
+    def test_all_terms_must_match_and_last_is_prefix(self):
+        """Test that every term has to match and the last one matches as a prefix."""
+        match = Message.objects.create(room=self.room, sender=self.user, content="database migration finished")
+        Message.objects.create(room=self.room, sender=self.user, content="database is down")
+
+        messages, _ = search_messages("database migr", room=self.room)
+
+        self.assertEqual(messages, [match])
+
+    def test_query_syntax_is_not_interpreted(self):
+        """Test that operators and quotes in a query are treated as plain words."""
+        match = Message.objects.create(room=self.room, sender=self.user, content="NOT a \"quoted\" OR thing")
+
+        messages, _ = search_messages('"quoted" OR (NOT', room=self.room)
+        self.assertEqual(messages, [match])
+        self.assertEqual(search_messages('*** "" ()', room=self.room), ([], None))
+
+    def test_keyset_pagination_visits_every_match_once(self):
+        """Test that following cursors returns each match exactly once."""
+        created = [Message.objects.create(room=self.room, sender=self.user, content=f"ping {i}") for i in range(5)]
+
+        seen, after = [], None
+        while True:
+            messages, next_cursor = search_messages("ping", room=self.room, after=after, limit=2)
+            seen.extend(messages)
+            if next_cursor is None:
+                break
+            after = parse_cursor(next_cursor)
+
+        self.assertCountEqual(seen, created)
+        self.assertEqual(len(seen), len(created))
+
+    def test_index_follows_updates_and_deletes(self):
+        """Test that edited and deleted messages are reflected in search results."""
+        message = Message.objects.create(room=self.room, sender=self.user, content="old words")
+        message.content = "new words"
+        message.save()
+
+        self.assertEqual(search_messages("old", room=self.room)[0], [])
+        self.assertEqual(search_messages("new", room=self.room)[0], [message])
+
+        message.delete()
+        self.assertEqual(search_messages("words", room=self.room)[0], [])
+
+    def test_bulk_inserted_messages_are_indexed(self):
+        """Test that messages written by the write-behind buffer are searchable."""
+        buffer = MessageWriteBuffer()
+        buffer.add(self.room.pk, self.user.pk, "buffered hello")
+        buffer.flush_sync()
+
+        messages, _ = search_messages("buffered", room=self.room)
+        self.assertEqual([message.content for message in messages], ["buffered hello"])
+
+    def test_invalid_cursor_is_rejected(self):
+        """Test that malformed cursors raise ValueError."""
+        with self.assertRaises(ValueError):
+            parse_cursor("not-a-cursor")
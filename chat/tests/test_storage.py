@@ -0,0 +1,87 @@
+import tempfile
+from io import BytesIO
+from pathlib import Path
+from django.db import IntegrityError
+from django.test import TestCase
+from django.contrib.auth.models import User
+from PIL import Image
+
+from chat.imaging import save_with_image, store_image
+from chat.models import ImageBlob, Room, Message
+
+
+def make_png_bytes(color="red"):
+    """Return the bytes of a small PNG image."""
+    buffer = BytesIO()
+    Image.new("RGB", (4, 4), color=color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TestContentAddressedStorage(TestCase):
+    def setUp(self):
+        """Use a temporary MEDIA_ROOT and set up a room to attach images to."""
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username="owner", password="pw")
+        self.room = Room.objects.create(owner=self.user, name="Image Room")
+
+    def tearDown(self):
+        """Restore the original MEDIA_ROOT."""
+        self.settings_override.disable()
+
+    def test_identical_uploads_share_one_file(self):
+        """Test that storing the same image twice writes one hash-sharded file with two references."""
+        with self.captureOnCommitCallbacks(execute=True):
+            first = store_image(make_png_bytes())
+            second = store_image(make_png_bytes())
+
+        self.assertEqual(first, second)
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(first, f"message_images/{blob.digest[:2]}/{blob.digest[2:4]}/{blob.digest}.png")
+        self.assertEqual(len(list(Path(self.media_root).rglob("*.png"))), 1)
+
+    def test_failed_message_save_keeps_no_reference(self):
+        """Test that a message that cannot be saved rolls back the reference taken for its image."""
+        save_with_image(Message(room=self.room, sender=self.user), make_png_bytes())
+        with self.assertRaises(IntegrityError):
+            save_with_image(Message(room=self.room), make_png_bytes())
+
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_rolled_back_upload_leaves_no_file(self):
+        """Test that a new image whose message cannot be saved writes no file."""
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(IntegrityError):
+                save_with_image(Message(room=self.room), make_png_bytes())
+
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertEqual(list(Path(self.media_root).rglob("*")), [])
+
+    def test_different_images_get_different_blobs(self):
+        """Test that distinct images are stored separately."""
+        self.assertNotEqual(store_image(make_png_bytes("red")), store_image(make_png_bytes("blue")))
+        self.assertEqual(ImageBlob.objects.count(), 2)
+
+    def test_file_is_deleted_with_last_reference(self):
+        """Test that deleting messages releases references and removes the file when none are left."""
+        with self.captureOnCommitCallbacks(execute=True):
+            name = store_image(make_png_bytes())
+            store_image(make_png_bytes())
+        first = Message.objects.create(room=self.room, sender=self.user, image=name)
+        second = Message.objects.create(room=self.room, sender=self.user, image=name)
+        path = Path(self.media_root) / name
+        path.with_name(f"{path.stem}.thumb.webp").write_bytes(b"variant")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(path.exists())
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(path.exists())
+        self.assertFalse(path.with_name(f"{path.stem}.thumb.webp").exists())
+        self.assertFalse(ImageBlob.objects.exists())
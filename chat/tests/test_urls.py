@@ -1,6 +1,6 @@
 from django.test import SimpleTestCase
 from django.urls import reverse, resolve
-from chat.views import RoomListView, RoomDetailView, RoomCreateView, RoomToogleFavouriteView, RoomLeaveView, RoomUpdateView, RoomDeleteView, RoomJoinView, ProtectedMediaView
+from chat.views import RoomListView, RoomDetailView, RoomCreateView, RoomToogleFavouriteView, RoomLeaveView, RoomUpdateView, RoomDeleteView, RoomJoinView, ProtectedMediaView, ArchivedMediaView, MessageHistoryView, MessageSearchView, MetricsView
 
 
 class TestUrlResolution(SimpleTestCase):
@@ -49,6 +49,21 @@ class TestUrlResolution(SimpleTestCase):
         url = reverse('protected-media', args=[1])
         self.assertEqual(resolve(url).func.view_class, ProtectedMediaView)
 
+    def test_room_messages_url_resolution(self):
+        """Test whether the room-messages URLPattern is resolving to the MessageHistoryView."""
+        url = reverse('room-messages', args=[1])
+        self.assertEqual(resolve(url).func.view_class, MessageHistoryView)
+
+    def test_room_search_url_resolution(self):
+        """Test whether the room-search URLPattern is resolving to the MessageSearchView."""
+        url = reverse('room-search', args=[1])
+        self.assertEqual(resolve(url).func.view_class, MessageSearchView)
+
+    def test_message_search_url_resolution(self):
+        """Test whether the message-search URLPattern is resolving to the MessageSearchView."""
+        url = reverse('message-search')
+        self.assertEqual(resolve(url).func.view_class, MessageSearchView)
+
 
 class TestUrlReversal(SimpleTestCase):
     def test_home_url_reversal(self):
@@ -95,3 +110,28 @@ class TestUrlReversal(SimpleTestCase):
         """Test whether the reversed protected-media URLPattern is '/my-rooms/media/1/'."""
         url = reverse('protected-media', args=[1])
         self.assertEqual(url, '/my-rooms/media/1/')
+
+    def test_room_messages_url_reversal(self):
+        """Test whether the reversed room-messages URLPattern is '/my-rooms/room/1/messages/'."""
+        url = reverse('room-messages', args=[1])
+        self.assertEqual(url, '/my-rooms/room/1/messages/')
+
+    def test_room_search_url_reversal(self):
+        """Test whether the reversed room-search URLPattern is '/my-rooms/room/1/search/'."""
+        url = reverse('room-search', args=[1])
+        self.assertEqual(url, '/my-rooms/room/1/search/')
+
+    def test_message_search_url_reversal(self):
+        """Test whether the reversed message-search URLPattern is '/my-rooms/search/'."""
+        url = reverse('message-search')
+        self.assertEqual(url, '/my-rooms/search/')
+
+    def test_metrics_url_resolution(self):
+        """Test whether the metrics URLPattern is resolving to the MetricsView."""
+        url = reverse('metrics')
+        self.assertEqual(resolve(url).func.view_class, MetricsView)
+
+    def test_archive_media_url_resolution(self):
+        """Test whether the archive-media URLPattern is resolving to the ArchivedMediaView."""
+        url = reverse('archive-media', args=[1, 2])
+        self.assertEqual(resolve(url).func.view_class, ArchivedMediaView)
@@ -2,8 +2,13 @@ from django.test import TestCase, RequestFactory, Client
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
+import shutil
+import tempfile
+from io import BytesIO
 from pathlib import Path
+from PIL import Image
 from django.conf import settings
+from django.core.cache import cache
 from chat.models import Room, Message
 
 
@@ -21,6 +26,7 @@ class TestRoomListView(TestCase):
         self.room_joined.guests.add(self.user1)
         # Create a public room where user1 is neither owner nor guest
         self.room_public = Room.objects.create(owner=self.user2, name="Public Room", is_publicly_visible=True)
+        cache.clear()
 
     def test_room_categories_in_context(self):
         """Test that RoomListView context contains proper categorized room lists."""
@@ -38,6 +44,36 @@ class TestRoomListView(TestCase):
         self.assertIn(self.room_joined, joined_rooms)
         self.assertIn(self.room_public, public_rooms)
 
+    def test_room_lists_use_one_query_and_are_cached(self):
+        """Test that the room lists cost one query to build and none when served from the cache."""
+        self.client.login(username="user1", password="testpass")
+        # Session and user lookups plus a single room query
+        with self.assertNumQueries(3):
+            self.client.get(reverse('home'))
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['joined_rooms'][0].participant_count, 2)
+
+    def test_cached_room_lists_are_invalidated(self):
+        """Test that favourites, new messages and new public rooms refresh the cached lists."""
+        self.client.login(username="user1", password="testpass")
+        self.client.get(reverse('home'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('room-toggle-favourite', kwargs={'pk': self.room_joined.pk}))
+        response = self.client.get(reverse('home'))
+        self.assertTrue(response.context['joined_rooms'][0].is_favourite)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(room=self.room_public, sender=self.user2, content="Hi")
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['public_rooms'][0].last_message_id, message.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            new_room = Room.objects.create(owner=self.user2, name="New Public", is_publicly_visible=True)
+        response = self.client.get(reverse('home'))
+        self.assertIn(new_room, response.context['public_rooms'])
+
 
 class TestRoomDetailView(TestCase):
     def setUp(self):
@@ -75,6 +111,102 @@ class TestRoomDetailView(TestCase):
                          "Message count should increment by one after posting.")
 
 
+class TestMessageHistoryView(TestCase):
+    def setUp(self):
+        """Set up a room with 30 messages for testing history pagination."""
+        self.client = Client()
+        self.user = User.objects.create_user(username="user1", password="testpass")
+        self.outsider = User.objects.create_user(username="user2", password="testpass")
+        self.room = Room.objects.create(owner=self.user, name="History Room")
+        self.messages = [
+            Message.objects.create(room=self.room, sender=self.user, content=f"Message {i}")
+            for i in range(30)
+        ]
+        self.url = reverse('room-messages', kwargs={'pk': self.room.pk})
+
+    def test_newest_page_is_returned_in_chronological_order(self):
+        """Test that without cursors the newest messages are returned oldest first."""
+        self.client.login(username="user1", password="testpass")
+        response = self.client.get(self.url, {'limit': 10})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([m['message'] for m in data['messages']], [f"Message {i}" for i in range(20, 30)])
+        self.assertTrue(data['has_more'])
+
+    def test_before_cursor_pages_backwards(self):
+        """Test that the before cursor returns the page preceding the given message."""
+        self.client.login(username="user1", password="testpass")
+        response = self.client.get(self.url, {'before': self.messages[5].pk, 'limit': 10})
+        data = response.json()
+        self.assertEqual([m['id'] for m in data['messages']], [m.pk for m in self.messages[:5]])
+        self.assertFalse(data['has_more'])
+
+    def test_after_cursor_pages_forwards(self):
+        """Test that the after cursor returns the messages following the given message."""
+        self.client.login(username="user1", password="testpass")
+        response = self.client.get(self.url, {'after': self.messages[25].pk})
+        data = response.json()
+        self.assertEqual([m['id'] for m in data['messages']], [m.pk for m in self.messages[26:]])
+        self.assertFalse(data['has_more'])
+
+    def test_invalid_cursor_returns_400(self):
+        """Test that a cursor that is neither an id nor a timestamp is rejected."""
+        self.client.login(username="user1", password="testpass")
+        response = self.client.get(self.url, {'before': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_member_gets_404(self):
+        """Test that users outside the room cannot read its history."""
+        self.client.login(username="user2", password="testpass")
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+
+class TestMessageSearchView(TestCase):
+    def setUp(self):
+        """Set up a room and a foreign room with searchable messages."""
+        self.client = Client()
+        self.user = User.objects.create_user(username="user1", password="testpass")
+        self.outsider = User.objects.create_user(username="user2", password="testpass")
+        self.room = Room.objects.create(owner=self.user, name="Search Room")
+        self.foreign_room = Room.objects.create(owner=self.outsider, name="Foreign Room")
+        self.matches = [
+            Message.objects.create(room=self.room, sender=self.user, content=f"meeting at {i}")
+            for i in range(3)
+        ]
+        Message.objects.create(room=self.foreign_room, sender=self.outsider, content="meeting elsewhere")
+
+    def test_room_search_pages_with_cursor(self):
+        """Test that room search returns ranked pages linked by the next cursor."""
+        self.client.login(username="user1", password="testpass")
+        url = reverse('room-search', kwargs={'pk': self.room.pk})
+        first = self.client.get(url, {'q': 'meeting', 'limit': 2}).json()
+        second = self.client.get(url, {'q': 'meeting', 'limit': 2, 'cursor': first['next']}).json()
+
+        ids = [m['id'] for m in first['messages'] + second['messages']]
+        self.assertCountEqual(ids, [m.pk for m in self.matches])
+        self.assertIsNone(second['next'])
+        self.assertEqual(first['messages'][0]['room'], self.room.pk)
+
+    def test_user_search_excludes_foreign_rooms(self):
+        """Test that searching all rooms only returns messages from the user's rooms."""
+        self.client.login(username="user1", password="testpass")
+        data = self.client.get(reverse('message-search'), {'q': 'meeting'}).json()
+        self.assertCountEqual([m['id'] for m in data['messages']], [m.pk for m in self.matches])
+
+    def test_invalid_cursor_returns_400(self):
+        """Test that a malformed cursor is rejected."""
+        self.client.login(username="user1", password="testpass")
+        response = self.client.get(reverse('message-search'), {'q': 'meeting', 'cursor': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_member_gets_404(self):
+        """Test that users outside the room cannot search it."""
+        self.client.login(username="user2", password="testpass")
+        response = self.client.get(reverse('room-search', kwargs={'pk': self.room.pk}), {'q': 'meeting'})
+        self.assertEqual(response.status_code, 404)
+
+
 class TestRoomCreateView(TestCase):
     def setUp(self):
         """Set up a user for testing room creation."""
@@ -251,7 +383,10 @@ class TestRoomDeleteView(TestCase):
 
 class TestProtectedMediaView(TestCase):
     def setUp(self):
-        """Set up a room with an image message to test access via ProtectedMediaView."""
+        """Set up a room with an image message in a temporary MEDIA_ROOT to test access via ProtectedMediaView."""
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
         self.client = Client()
         self.owner = User.objects.create_user(username="owner", password="testpass")
         self.guest = User.objects.create_user(username="guest", password="testpass")
@@ -294,10 +429,101 @@ class TestProtectedMediaView(TestCase):
         response.close()
         self.assertEqual(response.status_code, 403)
 
+    def test_conditional_get_returns_304(self):
+        """Test that a request with a matching ETag gets a 304 without a body."""
+        self.client.login(username="owner", password="testpass")
+        url = reverse('protected-media', kwargs={'message_id': self.message.pk})
+        response = self.client.get(url)
+        response.close()
+        self.assertIn('private', response['Cache-Control'])
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_range_request_returns_partial_content(self):
+        """Test that a byte range request returns 206 with only the requested bytes."""
+        self.client.login(username="owner", password="testpass")
+        url = reverse('protected-media', kwargs={'message_id': self.message.pk})
+        response = self.client.get(url, HTTP_RANGE='bytes=1-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.image_content[1:4])
+        self.assertEqual(response['Content-Range'], f'bytes 1-3/{len(self.image_content)}')
+
+    def test_unsatisfiable_range_returns_416(self):
+        """Test that a range starting past the end of the file returns 416."""
+        self.client.login(username="owner", password="testpass")
+        url = reverse('protected-media', kwargs={'message_id': self.message.pk})
+        response = self.client.get(url, HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_x_accel_redirect_delivery(self):
+        """Test that the nginx backend hands the file to the proxy instead of sending it."""
+        self.client.login(username="guest", password="testpass")
+        url = reverse('protected-media', kwargs={'message_id': self.message.pk})
+        with self.settings(CHAT_MEDIA_DELIVERY='x-accel-redirect', CHAT_MEDIA_ACCEL_PREFIX='/internal/'):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/internal/' + self.message.image.name)
+        self.assertEqual(response.content, b'')
+
+    def test_x_sendfile_delivery(self):
+        """Test that the X-Sendfile backend points the proxy at the file on disk."""
+        self.client.login(username="guest", password="testpass")
+        url = reverse('protected-media', kwargs={'message_id': self.message.pk})
+        with self.settings(CHAT_MEDIA_DELIVERY='x-sendfile'):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Sendfile'], str(self.media_file_path))
+
+    def tearDown(self):
+        """Remove the temporary MEDIA_ROOT."""
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+
+class TestProtectedMediaVariants(TestCase):
+    def setUp(self):
+        """Set up an image message backed by a real PNG in a temporary MEDIA_ROOT."""
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.client = Client()
+        self.owner = User.objects.create_user(username="owner", password="testpass")
+        self.room = Room.objects.create(owner=self.owner, name="Variant Room")
+        buffer = BytesIO()
+        Image.new("RGB", (800, 400), color="green").save(buffer, format="PNG")
+        self.message = Message.objects.create(
+            room=self.room, sender=self.owner,
+            image=SimpleUploadedFile("photo.png", buffer.getvalue(), content_type="image/png"),
+        )
+        self.url = reverse('protected-media', kwargs={'message_id': self.message.pk})
+        self.client.login(username="owner", password="testpass")
+
     def tearDown(self):
-        """Clean up the dummy media file after tests."""
-        if self.media_file_path.exists():
-            try:
-                self.media_file_path.unlink()
-            except PermissionError:
-                pass
\ No newline at end of file
+        """Restore the original MEDIA_ROOT."""
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_thumbnail_is_webp_when_accepted(self):
+        """Test that clients accepting WebP receive a downscaled WebP variant."""
+        response = self.client.get(self.url, {'size': 'thumb'}, HTTP_ACCEPT='image/webp,*/*')
+        content = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('Accept', response['Vary'])
+        with Image.open(BytesIO(content)) as img:
+            self.assertEqual(img.size, (320, 160))
+
+    def test_thumbnail_falls_back_to_jpeg(self):
+        """Test that clients without WebP support receive a JPEG variant cached next to the original."""
+        response = self.client.get(self.url, {'size': 'thumb'}, HTTP_ACCEPT='image/*')
+        response.close()
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        original = Path(self.media_root) / self.message.image.name
+        self.assertTrue(original.with_name(f'{original.stem}.thumb.jpg').exists())
+
+    def test_unknown_size_returns_404(self):
+        """Test that sizes not listed in CHAT_IMAGE_VARIANTS are rejected."""
+        response = self.client.get(self.url, {'size': 'huge'})
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,47 @@
+import re
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.utils import timezone
+
+
+class UploadError(Exception):
+    """Raised when an image upload header or chunk is rejected."""
+
+
+class ImageUpload:
+    """Collects the binary frames of a single image upload into a temporary file."""
+
+    def __init__(self, room_id, message, content_type, size):
+        """Validate the upload header and open the temporary file."""
+        if not isinstance(content_type, str) or not content_type.startswith('image/'):
+            raise UploadError("Only image uploads are supported.")
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            raise UploadError("Upload size must be a positive integer.")
+        if size > settings.CHAT_MAX_UPLOAD_SIZE:
+            raise UploadError("Image exceeds the maximum upload size.")
+
+        ext = re.sub(r'[^a-z0-9]', '', content_type.split('/')[-1].lower()) or 'bin'
+        file_name = f'chat_{room_id}_{timezone.now().timestamp()}.{ext}'
+        self.message = message if isinstance(message, str) else ''
+        self.size = size
+        self.received = 0
+        self.file = TemporaryUploadedFile(file_name, content_type, size, None)
+
+    @property
+    def complete(self):
+        """Return True once all announced bytes have been received."""
+        return self.received == self.size
+
+    def write(self, chunk):
+        """Append a chunk to the temporary file (blocking, run off the event loop)."""
+        if self.received + len(chunk) > self.size:
+            raise UploadError("Received more data than announced in the upload header.")
+        self.file.write(chunk)
+        self.received += len(chunk)
+        if self.complete:
+            self.file.flush()
+            self.file.seek(0)
+
+    def close(self):
+        """Close and remove the temporary file if it was not moved into storage."""
+        self.file.close()
@@ -1,9 +1,12 @@
 from django.urls import path 
-from .views import RoomListView, RoomDetailView, RoomCreateView, RoomToogleFavouriteView, RoomLeaveView, RoomUpdateView, RoomDeleteView, RoomJoinView, ProtectedMediaView
+from .views import RoomListView, RoomDetailView, RoomCreateView, RoomToogleFavouriteView, RoomLeaveView, RoomUpdateView, RoomDeleteView, RoomJoinView, ProtectedMediaView, ArchivedMediaView, MessageHistoryView, MessageSearchView
 
 urlpatterns = [
     path('', RoomListView.as_view(), name='home'),
     path('room/<int:pk>/', RoomDetailView.as_view(), name='room'),
+    path('room/<int:pk>/messages/', MessageHistoryView.as_view(), name='room-messages'),
+    path('room/<int:pk>/search/', MessageSearchView.as_view(), name='room-search'),
+    path('search/', MessageSearchView.as_view(), name='message-search'),
     path('room-create/', RoomCreateView.as_view(), name='room-create'),
     path('room-update/<int:pk>/', RoomUpdateView.as_view(), name='room-update'),
     path('room-delete/<int:pk>/', RoomDeleteView.as_view(), name='room-delete'),
@@ -11,4 +14,5 @@ urlpatterns = [
     path('room-leave/<int:pk>/', RoomLeaveView.as_view(), name='room-leave'),
     path('room-join/<int:pk>/', RoomJoinView.as_view(), name='room-join'),
     path('media/<int:message_id>/', ProtectedMediaView.as_view(), name='protected-media'),
+    path('room/<int:pk>/archive/<int:message_id>/image/', ArchivedMediaView.as_view(), name='archive-media'),
 ]
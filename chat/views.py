@@ -1,17 +1,42 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views import View
-from django.db.models import Q, Max, Exists, OuterRef
+from django.db.models import Q
 from django.views.generic import DetailView
 from django.views.generic.list import ListView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import FileResponse, Http404, HttpResponseForbidden
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
 from django.urls import reverse_lazy
 from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import constant_time_compare
 from pathlib import Path
 
+from . import metrics
+from .archive import find_message as find_archived_message
 from .models import Room, Message
 from .forms import MessageForm, RoomForm
+from .history import get_page, parse_cursor
+from .imaging import ImageRejected, get_variant, save_with_image
+from .media import serve_media
+from .persistence import message_buffer
+from .room_index import get_room_index
+from .routers import replica_reads
+from .search import parse_cursor as parse_search_cursor, search_messages
+
+
+class ReplicaReadsMixin:
+    """Reads from a database replica on GET requests, unless the user recently wrote."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads(request.user.pk):
+            response = super().dispatch(request, *args, **kwargs)
+            # Template responses run their queries while rendering
+            if hasattr(response, 'render'):
+                response.render()
+        return response
 
 
 class RoomListView(LoginRequiredMixin, ListView):
@@ -22,55 +47,26 @@ class RoomListView(LoginRequiredMixin, ListView):
     def get_context_data(self, **kwargs):
         """Populate the context with categorized room lists."""
         context = super().get_context_data(**kwargs)
-
-        favourited_subquery = Room.objects.filter(pk=OuterRef('pk'), favorited_by=self.request.user)
-
-        my_rooms = Room.objects.filter(
-            owner=self.request.user
-        ).annotate(
-            last_message_datetime=Max('messages__created_at'),
-            is_favourite=Exists(favourited_subquery)
-        ).order_by('-is_favourite', '-last_message_datetime', '-created_at').distinct()
-
-        joined_rooms = Room.objects.filter(
-            guests=self.request.user
-        ).exclude(
-            owner=self.request.user
-        ).annotate(
-            last_message_datetime=Max('messages__created_at'),
-            is_favourite=Exists(favourited_subquery)
-        ).order_by('-is_favourite', '-last_message_datetime', '-created_at').distinct()
-
-        public_rooms = Room.objects.filter(
-            is_publicly_visible=True
-        ).exclude(
-            Q(owner=self.request.user) | Q(guests=self.request.user)
-        ).annotate(
-            last_message_datetime=Max('messages__created_at'),
-            is_favourite=Exists(favourited_subquery)
-        ).order_by('-is_favourite', '-last_message_datetime', '-created_at').distinct()
-
-        context['my_rooms'] = my_rooms
-        context['joined_rooms'] = joined_rooms
-        context['public_rooms'] = public_rooms
+        context.update(get_room_index(self.request.user))
         return context
 
 
-class RoomDetailView(LoginRequiredMixin, DetailView):
+class RoomDetailView(LoginRequiredMixin, ReplicaReadsMixin, DetailView):
     """Displays room details and handles message submission."""
     model = Room
     context_object_name = 'room'
 
     def get_queryset(self):
         """Restrict access to rooms the user owns or has joined."""
-        return Room.objects.filter(Q(owner=self.request.user) | Q(guests=self.request.user)).distinct()
+        return Room.objects.filter(
+            Q(owner=self.request.user) | Q(guests=self.request.user)
+        ).select_related('owner').distinct()
 
     def get_context_data(self, **kwargs):
         """Add recent messages and message form to context."""
         context = super().get_context_data(**kwargs)
         room = self.object
-        recent_messages = room.messages.all()[:20]
-        context['messages'] = list(reversed(recent_messages))
+        context['messages'], context['has_older_messages'] = get_page(room, limit=20)
         context['message_form'] = MessageForm()
         return context
 
@@ -83,14 +79,79 @@ class RoomDetailView(LoginRequiredMixin, DetailView):
             new_message = form.save(commit=False)
             new_message.room = self.object
             new_message.sender = request.user
-            new_message.save()
-            return redirect('room', pk=self.object.pk)
+            # Messages buffered by this process come first
+            if message_buffer.has_pending(self.object.pk):
+                message_buffer.flush_sync()
+            try:
+                if new_message.image:
+                    save_with_image(new_message, form.cleaned_data['image'])
+                else:
+                    new_message.save()
+            except ImageRejected as e:
+                form.add_error('image', str(e))
+            else:
+                return redirect('room', pk=self.object.pk)
 
         context = self.get_context_data()
         context['message_form'] = form
         return self.render_to_response(context)
 
 
+class MessageHistoryView(LoginRequiredMixin, View):
+    """Returns a page of room messages as JSON, paginated with before/after cursors."""
+
+    def get(self, request, pk):
+        room = get_object_or_404(Room.objects.filter(Q(owner=request.user) | Q(guests=request.user)).distinct(), pk=pk)
+
+        try:
+            limit = int(request.GET.get('limit', settings.CHAT_HISTORY_PAGE_SIZE))
+            before = request.GET.get('before')
+            after = request.GET.get('after')
+            if before and after:
+                raise ValueError("Use either 'before' or 'after', not both.")
+            before = parse_cursor(room, before) if before else None
+            after = parse_cursor(room, after) if after else None
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        limit = max(1, min(limit, settings.CHAT_HISTORY_MAX_PAGE_SIZE))
+
+        messages, has_more = get_page(room, before=before, after=after, limit=limit)
+        return JsonResponse({
+            'messages': [message.to_payload() for message in messages],
+            'has_more': has_more,
+        })
+
+
+class MessageSearchView(LoginRequiredMixin, View):
+    """Returns ranked messages matching ?q= in one room, or in all rooms of the user, as JSON."""
+
+    def get(self, request, pk=None):
+        room = None
+        if pk is not None:
+            room = get_object_or_404(Room.objects.filter(Q(owner=request.user) | Q(guests=request.user)).distinct(), pk=pk)
+
+        try:
+            limit = int(request.GET.get('limit', settings.CHAT_SEARCH_PAGE_SIZE))
+            cursor = request.GET.get('cursor')
+            after = parse_search_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        limit = max(1, min(limit, settings.CHAT_SEARCH_MAX_PAGE_SIZE))
+
+        query = request.GET.get('q', '')
+        if room is not None:
+            messages, next_cursor = search_messages(query, room=room, after=after, limit=limit)
+        else:
+            messages, next_cursor = search_messages(query, user=request.user, after=after, limit=limit)
+        return JsonResponse({
+            'messages': [
+                dict(message.to_payload(), room=message.room_id, score=message.search_score)
+                for message in messages
+            ],
+            'next': next_cursor,
+        })
+
+
 class RoomCreateView(LoginRequiredMixin, CreateView):
     """Handles creation of a new room."""
     model = Room
@@ -154,7 +215,8 @@ class RoomJoinView(LoginRequiredMixin, View):
     """Adds the current user to the room guests."""
     def post(self, request, pk):
         room = get_object_or_404(Room, pk=pk)
-        if room.is_publicly_visible and request.user not in room.guests.all() and request.user != room.owner:
+        is_guest = room.guests.filter(pk=request.user.pk).exists()
+        if room.is_publicly_visible and not is_guest and request.user.pk != room.owner_id:
             room.guests.add(request.user)
         return redirect('home')
 
@@ -164,13 +226,13 @@ class RoomLeaveView(LoginRequiredMixin, View):
     def post(self, request, pk):
         room = get_object_or_404(Room, pk=pk)
 
-        if request.user in room.guests.all():
+        if room.guests.filter(pk=request.user.pk).exists():
             room.guests.remove(request.user)
 
-        if request.user in room.favorited_by.all():
+        if room.favorited_by.filter(pk=request.user.pk).exists():
             room.favorited_by.remove(request.user)
 
-        if request.user == room.owner:
+        if request.user.pk == room.owner_id:
             if room.guests.exists():
                 new_owner = room.guests.first()
                 room.owner = new_owner
@@ -193,22 +255,63 @@ class RoomDeleteView(LoginRequiredMixin, DeleteView):
         return Room.objects.filter(owner=self.request.user)
 
 
-class ProtectedMediaView(LoginRequiredMixin, View):
+class ProtectedMediaView(LoginRequiredMixin, ReplicaReadsMixin, View):
     """Serves image files from messages to authorized users."""
 
     def get(self, request, message_id):
-        message = get_object_or_404(Message, pk=message_id)
+        message = get_object_or_404(Message.objects.select_related('room'), pk=message_id)
         room = message.room
 
         # Access restricted to room owner or guests
-        if request.user != room.owner and request.user not in room.guests.all():
+        if request.user.pk != room.owner_id and not room.guests.filter(pk=request.user.pk).exists():
             return HttpResponseForbidden("You do not have permission to access this resource.")
 
         if not message.image:
             raise Http404("No image associated with this message.")
+        return self.serve_image(request, message.image.name)
 
-        full_path = Path(settings.MEDIA_ROOT) / message.image.name
+    def serve_image(self, request, name):
+        """Serve a stored image, or one of its variants selected by ?size=."""
+        full_path = Path(settings.MEDIA_ROOT) / name
         if not full_path.exists():
             raise Http404("File not found on the server.")
 
-        return FileResponse(open(full_path, 'rb'))
+        variant = request.GET.get('size')
+        if variant is None:
+            metrics.media_requests.inc(variant='original')
+            return serve_media(request, full_path)
+        if variant not in settings.CHAT_IMAGE_VARIANTS:
+            raise Http404("Unknown image size.")
+        metrics.media_requests.inc(variant=variant)
+
+        try:
+            variant_path = get_variant(full_path, variant, request.headers.get('Accept', ''))
+        except (OSError, ValueError):
+            # Fall back to the original if it cannot be downscaled
+            variant_path = full_path
+        response = serve_media(request, variant_path)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+
+class ArchivedMediaView(ProtectedMediaView):
+    """Serves image files from archived messages to room members."""
+
+    def get(self, request, pk, message_id):
+        room = get_object_or_404(Room.objects.filter(Q(owner=request.user) | Q(guests=request.user)).distinct(), pk=pk)
+        message = find_archived_message(room, message_id) if room.archived_through is not None else None
+        if message is None or not message.image:
+            raise Http404("No image associated with this message.")
+        return self.serve_image(request, message.image.name)
+
+
+class MetricsView(View):
+    """Exposes chat and HTTP metrics in the Prometheus text format to holders of the metrics token."""
+
+    def get(self, request):
+        token = settings.CHAT_METRICS_TOKEN
+        if not token:
+            raise Http404("Metrics are disabled.")
+        if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponseForbidden("Invalid metrics token.")
+        return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -11,8 +11,10 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     const protocol = (window.location.protocol === "https:") ? "wss" : "ws";
+    // Prefer compact frames with short keys; servers without subprotocol support send legacy JSON
     const chatSocket = new WebSocket(
-        protocol + '://' + window.location.host + '/ws/' + roomId + '/'
+        protocol + '://' + window.location.host + '/ws/' + roomId + '/',
+        ['chat.v1.compact', 'chat.v1.json']
     );
 
     // Initialize lastMessageDate from the last date separator in the HTML (if any)
@@ -22,10 +24,31 @@ document.addEventListener('DOMContentLoaded', function() {
         ? dateSeparators[dateSeparators.length - 1].innerText.trim() 
         : "";
 
-    // Listen for messages from the server.
-    chatSocket.onmessage = function(e) {
-        const data = JSON.parse(e.data);
+    // Size of the binary frames used to stream image uploads
+    const UPLOAD_CHUNK_SIZE = 64 * 1024;
+    // Presence heartbeats must arrive well within the server's CHAT_PRESENCE_TIMEOUT
+    const HEARTBEAT_INTERVAL = 20 * 1000;
+    // Minimum time between two typing notifications while the user keeps typing
+    const TYPING_NOTIFY_INTERVAL = 2 * 1000;
 
+    // Format a timestamp as the "d.m.Y" date used by the date separators (e.g., "23.02.2025")
+    function formatDate(timestampDate) {
+        return timestampDate.toLocaleDateString(undefined, {
+            day: '2-digit',
+            month: '2-digit',
+            year: 'numeric'
+        }).replace(/\//g, '.');
+    }
+
+    function createDateSeparator(formattedDate) {
+        const dateSeparator = document.createElement('div');
+        dateSeparator.classList.add('date-separator');
+        dateSeparator.innerText = formattedDate;
+        return dateSeparator;
+    }
+
+    // Build the element of a single chat message
+    function createMessageElement(data) {
         // Create a Date object from the timestamp and format time as hh:mm
         const timestampDate = new Date(data.timestamp);
         let hours = timestampDate.getHours();
@@ -35,54 +58,142 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         const formattedTime = `${hours}:${minutes}`;
 
-        // Format the full date string as "d.m.Y" (e.g., "23.02.2025")
-        const formattedDate = timestampDate.toLocaleDateString(undefined, {
-            day: '2-digit',
-            month: '2-digit',
-            year: 'numeric'
-        }).replace(/\//g, '.');
-
-        // If the date changes from the last message, insert a date separator.
-        if (lastMessageDate !== formattedDate) {
-            const dateSeparator = document.createElement('div');
-            dateSeparator.classList.add('date-separator');
-            dateSeparator.innerText = formattedDate;
-            chatLog.appendChild(dateSeparator);
-            lastMessageDate = formattedDate;
-        }
-
         // Create a new div for the message
         const newMessage = document.createElement('div');
         const messageType = (data.sender === currentUser) ? 'sent' : 'received';
         newMessage.classList.add('chat-message', messageType);
+        // Buffered messages carry provisional string ids, which cannot be used as history cursors
+        if (typeof data.id === 'number') {
+            newMessage.dataset.messageId = data.id;
+        }
 
-        // Build the new HTML structure:
+        // Build the new DOM structure:
         // 1. Header container with sender and timestamp.
         // 2. Message body with the content (and optional image).
-        let htmlContent = `<div class="chat-message-header">`;
-        htmlContent += `<strong class="sender">${data.sender}</strong>`;
-        htmlContent += `<span class="timestamp">${formattedTime}</span>`;
-        htmlContent += `</div>`;
-        htmlContent += `<div class="message-body">`;
-        htmlContent += `<div class="message-content">`;
+        // Values are set as text and attributes only, so message content cannot inject markup.
+        const header = document.createElement('div');
+        header.className = 'chat-message-header';
+        const sender = document.createElement('strong');
+        sender.className = 'sender';
+        sender.textContent = data.sender;
+        const timestamp = document.createElement('span');
+        timestamp.className = 'timestamp';
+        timestamp.textContent = formattedTime;
+        header.append(sender, timestamp);
+
+        const body = document.createElement('div');
+        body.className = 'message-body';
+        const content = document.createElement('div');
+        content.className = 'message-content';
+        body.appendChild(content);
 
         // Only add text if it's not empty
         if (data.message && data.message.trim() !== '') {
-            htmlContent += data.message;
+            content.appendChild(document.createTextNode(data.message));
             // Only insert a break if both text and an image exist
             if (data.image_url) {
-                htmlContent += `<br>`;
+                content.appendChild(document.createElement('br'));
             }
         }
 
         if (data.image_url) {
-            htmlContent += `<a href="${data.image_url}" target="_blank">
-                                <img class="message-image" src="${data.image_url}" alt="Image from ${data.sender}">
-                            </a>`;
+            const link = document.createElement('a');
+            link.setAttribute('href', data.image_url);
+            link.setAttribute('target', '_blank');
+            const image = document.createElement('img');
+            image.className = 'message-image';
+            image.setAttribute('src', data.image_url + '?size=thumb');
+            image.setAttribute('alt', 'Image from ' + data.sender);
+            link.appendChild(image);
+            content.appendChild(link);
+        }
+
+        newMessage.append(header, body);
+        return newMessage;
+    }
+
+    const presenceStatus = document.getElementById('presence-status');
+    const typingIndicator = document.getElementById('typing-indicator');
+    let onlineUsers = new Set();
+    let heartbeatTimer = null;
+
+    // Apply a presence snapshot or a coalesced presence change
+    function updatePresence(data) {
+        if (data.online !== undefined) {
+            onlineUsers = new Set(data.online);
+        }
+        (data.joined || []).forEach(function(username) { onlineUsers.add(username); });
+        (data.left || []).forEach(function(username) { onlineUsers.delete(username); });
+
+        // Large rooms only report counts, so names are shown while they are complete
+        if (onlineUsers.size === data.online_count) {
+            presenceStatus.textContent = 'Online: ' + Array.from(onlineUsers).sort().join(', ');
+        } else {
+            presenceStatus.textContent = data.online_count + ' online';
+        }
+
+        const typing = data.typing.filter(function(username) { return username !== currentUser; });
+        const othersTyping = data.typing_count - (data.typing.length - typing.length);
+        if (othersTyping === 0) {
+            typingIndicator.textContent = '';
+        } else if (typing.length === othersTyping) {
+            typingIndicator.textContent = typing.join(', ') + (othersTyping === 1 ? ' is typing...' : ' are typing...');
+        } else {
+            typingIndicator.textContent = othersTyping + ' people are typing...';
         }
-        htmlContent += `</div></div>`;
+    }
+
+    chatSocket.onopen = function() {
+        chatSocket.send(JSON.stringify({'type': 'presence'}));
+        heartbeatTimer = setInterval(function() {
+            chatSocket.send(JSON.stringify({'type': 'heartbeat'}));
+        }, HEARTBEAT_INTERVAL);
+    };
+
+    // Return a chat message with full keys, whatever the negotiated subprotocol
+    function expandMessage(data) {
+        if (chatSocket.protocol !== 'chat.v1.compact' || data.type !== undefined) {
+            return data;
+        }
+        return {
+            id: data.i,
+            sender: data.s,
+            message: data.m || '',
+            timestamp: data.t,
+            image_url: data.u || null
+        };
+    }
+
+    // Build an outgoing chat message in the negotiated format
+    function messageFrame(fields) {
+        if (chatSocket.protocol === 'chat.v1.compact' && fields.message !== undefined) {
+            fields.m = fields.message;
+            delete fields.message;
+        }
+        return JSON.stringify(fields);
+    }
 
-        newMessage.innerHTML = htmlContent;
+    // Listen for messages from the server.
+    chatSocket.onmessage = function(e) {
+        const data = expandMessage(JSON.parse(e.data));
+
+        if (data.type === 'error') {
+            console.error('Chat error:', data.message);
+            return;
+        }
+        if (data.type === 'presence') {
+            updatePresence(data);
+            return;
+        }
+
+        // If the date changes from the last message, insert a date separator.
+        const formattedDate = formatDate(new Date(data.timestamp));
+        if (lastMessageDate !== formattedDate) {
+            chatLog.appendChild(createDateSeparator(formattedDate));
+            lastMessageDate = formattedDate;
+        }
+
+        const newMessage = createMessageElement(data);
         chatLog.appendChild(newMessage);
 
         // If the new message includes an image, wait for it to load before scrolling
@@ -101,7 +212,61 @@ document.addEventListener('DOMContentLoaded', function() {
         }        
     };
 
+    // Load older messages from the history API when the log is scrolled to the top
+    const historyUrl = chatData.dataset.historyUrl;
+    let hasOlderMessages = chatData.dataset.hasOlder === 'true';
+    let loadingHistory = false;
+
+    function loadOlderMessages() {
+        const oldestMessage = chatLog.querySelector('.chat-message[data-message-id]');
+        if (!hasOlderMessages || loadingHistory || !oldestMessage) {
+            return;
+        }
+        loadingHistory = true;
+
+        fetch(historyUrl + '?before=' + encodeURIComponent(oldestMessage.dataset.messageId))
+            .then(function(response) { return response.json(); })
+            .then(function(page) {
+                const fragment = document.createDocumentFragment();
+                let previousDate = '';
+                page.messages.forEach(function(data) {
+                    const formattedDate = formatDate(new Date(data.timestamp));
+                    if (formattedDate !== previousDate) {
+                        fragment.appendChild(createDateSeparator(formattedDate));
+                        previousDate = formattedDate;
+                    }
+                    fragment.appendChild(createMessageElement(data));
+                });
+
+                // Drop the existing first separator if the loaded page ends on the same day
+                const firstElement = chatLog.firstElementChild;
+                if (firstElement && firstElement.classList.contains('date-separator')
+                        && firstElement.innerText.trim() === previousDate) {
+                    firstElement.remove();
+                }
+
+                // Keep the visible messages in place while content is added above them
+                const previousHeight = chatLog.scrollHeight;
+                chatLog.insertBefore(fragment, chatLog.firstChild);
+                chatLog.scrollTop += chatLog.scrollHeight - previousHeight;
+                hasOlderMessages = page.has_more;
+            })
+            .catch(function(error) {
+                console.error('Failed to load older messages:', error);
+            })
+            .finally(function() {
+                loadingHistory = false;
+            });
+    }
+
+    chatLog.addEventListener('scroll', function() {
+        if (chatLog.scrollTop === 0) {
+            loadOlderMessages();
+        }
+    });
+
     chatSocket.onclose = function(e) {
+        clearInterval(heartbeatTimer);
         console.error('Socket closed unexpectedly');
     };
 
@@ -115,21 +280,25 @@ document.addEventListener('DOMContentLoaded', function() {
         const file = imageInput.files[0];
     
         if (file) {
-            const reader = new FileReader();
-            reader.onload = function() {
-                chatSocket.send(JSON.stringify({
+            file.arrayBuffer().then(function(buffer) {
+                // Announce the upload, then stream the raw bytes as binary frames
+                chatSocket.send(messageFrame({
+                    'type': 'upload',
                     'message': message,
-                    'image': reader.result
+                    'content_type': file.type,
+                    'size': buffer.byteLength
                 }));
+                for (let offset = 0; offset < buffer.byteLength; offset += UPLOAD_CHUNK_SIZE) {
+                    chatSocket.send(buffer.slice(offset, offset + UPLOAD_CHUNK_SIZE));
+                }
                 messageInput.value = '';
                 imageInput.value = '';
                 // Clear only the text in the preview span
                 document.getElementById('attachment-text').textContent = '';
                 attachmentPreview.style.display = 'none';
-            };
-            reader.readAsDataURL(file);
+            });
         } else {
-            chatSocket.send(JSON.stringify({
+            chatSocket.send(messageFrame({
                 'message': message
             }));
             messageInput.value = '';
@@ -140,9 +309,23 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });    
 
+    // Notify the room while typing, at most once per TYPING_NOTIFY_INTERVAL
+    let lastTypingNotice = 0;
+    messageInput.addEventListener('input', function() {
+        const now = Date.now();
+        if (messageInput.value && now - lastTypingNotice > TYPING_NOTIFY_INTERVAL) {
+            chatSocket.send(JSON.stringify({'type': 'typing'}));
+            lastTypingNotice = now;
+        } else if (!messageInput.value && lastTypingNotice) {
+            chatSocket.send(JSON.stringify({'type': 'typing', 'typing': false}));
+            lastTypingNotice = 0;
+        }
+    });
+
     messageInput.addEventListener('keyup', function(event) {
         if (event.keyCode === 13) {
             sendButton.click();
+            lastTypingNotice = 0;
         }
     });
 
@@ -54,12 +54,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.middleware.RequestTimingMiddleware',
+    'chat.middleware.QueryProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'chat.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -103,6 +106,11 @@ else:
     }
 
 # Database
+# postgres-pool:// URLs use chat.db.postgresql_pool, which keeps a bounded pool of
+# connections per process, configured with pool_max_size, pool_timeout, pool_max_idle,
+# pool_max_lifetime and pool_check_interval query parameters (CONN_MAX_AGE must stay 0)
+environ.Env.DB_SCHEMES['postgres-pool'] = 'chat.db.postgresql_pool'
+environ.Env.POSTGRES_FAMILY.append('postgres-pool')
 if DEBUG:
     # Development - SQLite
     DATABASES = {
@@ -119,6 +127,22 @@ else:
         )
     }
 
+# Read replicas: comma-separated database URLs in DATABASE_REPLICA_URLS become the
+# aliases replica_1, replica_2, ... used by chat.routers.ReplicaRouter for room pages
+# and media authorization (locally, e.g. a copy of db.sqlite3). Cached room lists and
+# room members are always read from the primary. Users read from the primary for CHAT_REPLICA_STICKY_SECONDS after a write
+for i, url in enumerate(env.list('DATABASE_REPLICA_URLS', default = []), start = 1):
+    DATABASES[f'replica_{i}'] = dict(env.db_url_config(url), TEST = {'MIRROR': 'default'})
+CHAT_DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+CHAT_REPLICA_STICKY_SECONDS = env.int('CHAT_REPLICA_STICKY_SECONDS', default = 5)
+DATABASE_ROUTERS = ['chat.routers.ReplicaRouter']
+
+# Cache (shared backends such as Redis keep cached room lists consistent across processes).
+# Room lists keep a version token per room, so the local cache holds more than the default 300 entries
+CACHES = {
+    'default': env.cache('CACHE_URL', default = 'locmemcache://?max_entries=10000'),
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -154,5 +178,127 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_ROOT = env('MEDIA_ROOT', default = BASE_DIR / 'media')
 MEDIA_URL = '/media/'
 
+# Protected media delivery: 'file' (served by Django), 'x-accel-redirect' (nginx) or 'x-sendfile'
+CHAT_MEDIA_DELIVERY = env('CHAT_MEDIA_DELIVERY', default = 'file')
+CHAT_MEDIA_ACCEL_PREFIX = env('CHAT_MEDIA_ACCEL_PREFIX', default = '/protected-media/')
+CHAT_MEDIA_MAX_AGE = env.int('CHAT_MEDIA_MAX_AGE', default = 60 * 60 * 24)
+
+# Chat uploads
+CHAT_MAX_UPLOAD_SIZE = env.int('CHAT_MAX_UPLOAD_SIZE', default = 10 * 1024 * 1024)
+CHAT_MAX_IMAGE_PIXELS = env.int('CHAT_MAX_IMAGE_PIXELS', default = 5000 * 5000)
+CHAT_IMAGE_JPEG_QUALITY = env.int('CHAT_IMAGE_JPEG_QUALITY', default = 85)
+# Downscaled variants served by ProtectedMediaView with ?size=<name>, as the longest side in pixels
+CHAT_IMAGE_VARIANTS = {
+    'thumb': 320,
+    'medium': 1024,
+}
+CHAT_IMAGE_VARIANT_QUALITY = env.int('CHAT_IMAGE_VARIANT_QUALITY', default = 80)
+CHAT_IMAGE_WORKERS = env.int('CHAT_IMAGE_WORKERS', default = 2)
+CHAT_IMAGE_QUEUE_DEPTH = env.int('CHAT_IMAGE_QUEUE_DEPTH', default = 16)
+
+# Chat message persistence (write-behind batches text messages into bulk inserts)
+CHAT_WRITE_BEHIND = env.bool('CHAT_WRITE_BEHIND', default = False)
+CHAT_WRITE_BEHIND_BATCH_SIZE = env.int('CHAT_WRITE_BEHIND_BATCH_SIZE', default = 100)
+CHAT_WRITE_BEHIND_INTERVAL = env.float('CHAT_WRITE_BEHIND_INTERVAL', default = 0.5)
+# Messages refused with a server_busy error while this many wait to be written
+CHAT_WRITE_BEHIND_MAX_PENDING = env.int('CHAT_WRITE_BEHIND_MAX_PENDING', default = 10000)
+
+# Chat rate limits: token buckets per connection and per user (shared by the user's
+# sockets in one process), refilled per second; upload chunks only cost bytes
+CHAT_RATE_MESSAGES = env.float('CHAT_RATE_MESSAGES', default = 5)
+CHAT_RATE_MESSAGE_BURST = env.int('CHAT_RATE_MESSAGE_BURST', default = 20)
+CHAT_RATE_BYTES = env.int('CHAT_RATE_BYTES', default = 1024 * 1024)
+CHAT_RATE_BYTE_BURST = env.int('CHAT_RATE_BYTE_BURST', default = 2 * CHAT_MAX_UPLOAD_SIZE)
+CHAT_RATE_USER_MESSAGES = env.float('CHAT_RATE_USER_MESSAGES', default = 10)
+CHAT_RATE_USER_MESSAGE_BURST = env.int('CHAT_RATE_USER_MESSAGE_BURST', default = 40)
+CHAT_RATE_USER_BYTES = env.int('CHAT_RATE_USER_BYTES', default = 2 * 1024 * 1024)
+CHAT_RATE_USER_BYTE_BURST = env.int('CHAT_RATE_USER_BYTE_BURST', default = 4 * CHAT_MAX_UPLOAD_SIZE)
+# Connections with more than CHAT_RATE_MAX_VIOLATIONS rejected frames within the window are closed
+CHAT_RATE_MAX_VIOLATIONS = env.int('CHAT_RATE_MAX_VIOLATIONS', default = 20)
+CHAT_RATE_VIOLATION_WINDOW = env.float('CHAT_RATE_VIOLATION_WINDOW', default = 10)
+
+# Chat message history pages
+CHAT_HISTORY_PAGE_SIZE = env.int('CHAT_HISTORY_PAGE_SIZE', default = 50)
+CHAT_HISTORY_MAX_PAGE_SIZE = env.int('CHAT_HISTORY_MAX_PAGE_SIZE', default = 200)
+
+# Chat message retention: messages older than a room's retention_days, or
+# CHAT_RETENTION_DAYS for rooms without their own (0 keeps messages forever), are
+# moved by the archive_messages command into compressed segments under CHAT_ARCHIVE_ROOT
+CHAT_RETENTION_DAYS = env.int('CHAT_RETENTION_DAYS', default = 0)
+CHAT_ARCHIVE_ROOT = env('CHAT_ARCHIVE_ROOT', default = BASE_DIR / 'archive')
+CHAT_ARCHIVE_BLOCK_SIZE = env.int('CHAT_ARCHIVE_BLOCK_SIZE', default = 256)
+
+# Partitioning of the message table by created_at month (PostgreSQL only; other
+# databases keep a single table). Partitions up to CHAT_MESSAGE_PARTITIONS_AHEAD
+# months ahead are created after migrate and by the ensure_message_partitions command
+CHAT_MESSAGE_PARTITIONING = env.bool('CHAT_MESSAGE_PARTITIONING', default = False)
+CHAT_MESSAGE_PARTITIONS_AHEAD = env.int('CHAT_MESSAGE_PARTITIONS_AHEAD', default = 3)
+
+# Chat message search results
+CHAT_SEARCH_PAGE_SIZE = env.int('CHAT_SEARCH_PAGE_SIZE', default = 20)
+CHAT_SEARCH_MAX_PAGE_SIZE = env.int('CHAT_SEARCH_MAX_PAGE_SIZE', default = 100)
+
+# JSON encoder used for WebSocket frames: 'auto' (orjson when installed), 'orjson' or 'json'
+CHAT_JSON_BACKEND = env('CHAT_JSON_BACKEND', default = 'auto')
+
+# Chat presence: changes are broadcast at most once per interval per room, names are
+# only listed up to CHAT_PRESENCE_MAX_NAMES users, and state expires without heartbeats.
+# Presence is tracked per process, so it is only accurate with a single ASGI worker:
+# with several, each broadcasts the online count of its own connections to the room
+CHAT_PRESENCE_INTERVAL = env.float('CHAT_PRESENCE_INTERVAL', default = 0.5)
+CHAT_PRESENCE_TIMEOUT = env.float('CHAT_PRESENCE_TIMEOUT', default = 60)
+CHAT_TYPING_TIMEOUT = env.float('CHAT_TYPING_TIMEOUT', default = 5)
+CHAT_PRESENCE_MAX_NAMES = env.int('CHAT_PRESENCE_MAX_NAMES', default = 20)
+
+# Metrics: /metrics/ is served only with 'Authorization: Bearer <CHAT_METRICS_TOKEN>'.
+# With several server processes, point CHAT_METRICS_DIR at a directory they share
+# so that every process reports the values of all of them
+CHAT_METRICS_TOKEN = env('CHAT_METRICS_TOKEN', default = '')
+CHAT_METRICS_DIR = env('CHAT_METRICS_DIR', default = '')
+CHAT_METRICS_FLUSH_INTERVAL = env.float('CHAT_METRICS_FLUSH_INTERVAL', default = 1.0)
+
+# Query profiler (development): records the queries of every request and WebSocket
+# frame, reports them in X-Query-* response headers and the chat.profiling logger,
+# and compares them with per-URL-name budgets. Strict mode raises QueryBudgetExceeded
+# instead of logging a warning, so tests can enforce the budgets
+CHAT_PROFILER = env.bool('CHAT_PROFILER', default = False)
+CHAT_PROFILER_STRICT = env.bool('CHAT_PROFILER_STRICT', default = False)
+CHAT_PROFILER_LOG = env('CHAT_PROFILER_LOG', default = '')
+# Budgets per URL name or consumer event, shared with the benchmark_views command:
+# the maximum number of queries, for the benchmark also with a warm room list cache
+# ('cached_queries') and optionally the 95th percentile latency in milliseconds ('p95_ms')
+CHAT_QUERY_BUDGETS = {
+    'home': {'queries': 3, 'cached_queries': 2},
+    'room': {'queries': 5},
+    'room-messages': {'queries': 4},
+    'protected-media': {'queries': 3},
+    'websocket.connect': {'queries': 2},
+    'websocket.receive': {'queries': 3},
+}
+
+if CHAT_PROFILER_LOG:
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {
+            'profiler': {
+                'class': 'logging.handlers.RotatingFileHandler',
+                'filename': CHAT_PROFILER_LOG,
+                'maxBytes': 10 * 1024 * 1024,
+                'backupCount': 5,
+            },
+        },
+        'loggers': {
+            'chat.profiling': {'handlers': ['profiler'], 'level': 'INFO', 'propagate': False},
+        },
+    }
+
+# Chat room lists
+CHAT_ROOM_INDEX_CACHE_TTL = env.int('CHAT_ROOM_INDEX_CACHE_TTL', default = 300)
+
+# Chat room membership cache used by WebSocket connections
+CHAT_MEMBERSHIP_CACHE_SIZE = env.int('CHAT_MEMBERSHIP_CACHE_SIZE', default = 1024)
+CHAT_MEMBERSHIP_CACHE_TTL = env.float('CHAT_MEMBERSHIP_CACHE_TTL', default = 60)
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
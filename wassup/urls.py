@@ -19,8 +19,11 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from chat.views import MetricsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('select2/', include('django_select2.urls')),
     path('', include('users.urls')),
     path('my-rooms/', include('chat.urls')),